@@ -5,7 +5,10 @@ import sys
 
 
 def main():
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
+    # у тестов отдельный общий кэш, см. yatube/settings_test.py
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE',
+                          'yatube.settings_test' if sys.argv[1:2] == ['test']
+                          else 'yatube.settings')
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc:
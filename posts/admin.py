@@ -1,13 +1,46 @@
 from django.contrib import admin
 
+from . import moderation, search
 from .models import Comment, Group, Post
+from .pagination import EstimatedCountPaginator
 
 
-class PostAdmin(admin.ModelAdmin):
+class LargeTableAdmin(admin.ModelAdmin):
+    """Список без точных COUNT(*) и без удаления объектов по одному."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        # стандартное действие загружает и удаляет каждый объект отдельно
+        actions.pop("delete_selected", None)
+        return actions
+
+
+class PostAdmin(LargeTableAdmin):
     list_display = ("pk", "text", "pub_date", "author", "group")
+    list_select_related = ("author", "group")
     search_fields = ("text",)
     list_filter = ("pub_date",)
+    date_hierarchy = "pub_date"
     empty_value_display = "-пусто-"
+    actions = ("delete_posts", "remove_from_group")
+
+    def delete_posts(self, request, queryset):
+        deleted = moderation.delete_posts(queryset)
+        self.message_user(request, f"Удалено постов: {deleted}")
+    delete_posts.short_description = "Удалить выбранные посты"
+
+    def remove_from_group(self, request, queryset):
+        updated = moderation.remove_from_group(queryset)
+        self.message_user(request, f"Убрано из групп постов: {updated}")
+    remove_from_group.short_description = "Убрать выбранные посты из групп"
+
+    def get_search_results(self, request, queryset, search_term):
+        # полнотекстовый индекс вместо LIKE '%...%' по всей таблице
+        if not search_term:
+            return queryset, False
+        return search.search(search_term, queryset), False
 
 
 class GroupAdmin(admin.ModelAdmin):
@@ -16,10 +49,17 @@ class GroupAdmin(admin.ModelAdmin):
     empty_value_display = "-пусто-"
 
 
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(LargeTableAdmin):
     list_display = ("pk", "author", "text", "post")
+    list_select_related = ("author", "post")
     search_fields = ("text",)
     empty_value_display = "-пусто-"
+    actions = ("delete_comments",)
+
+    def delete_comments(self, request, queryset):
+        deleted = moderation.delete_comments(queryset)
+        self.message_user(request, f"Удалено комментариев: {deleted}")
+    delete_comments.short_description = "Удалить выбранные комментарии"
 
 
 admin.site.register(Post, PostAdmin)
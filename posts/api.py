@@ -0,0 +1,193 @@
+import hashlib
+import json
+import logging
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count
+from django.http import Http404, HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_safe
+
+from . import caching, thumbnails
+from .feeds import COMMENT_ORDERING, comments_url
+from .models import Comment, Group, Post, User
+from .pagination import CursorPaginator, InvalidCursor
+
+logger = logging.getLogger(__name__)
+
+# только то, что попадает в ответ; модели не создаются
+POST_FIELDS = ('pk', 'text', 'pub_date', 'image', 'image_width',
+               'image_height', 'image_color', 'author__username',
+               'group__slug', 'group__title')
+COMMENT_FIELDS = ('pk', 'text', 'created', 'author__username')
+
+
+def api_view(scopes):
+    """
+    JSON-ответ под версионным ключом, как у `cached_view`.
+
+    В кэше лежит уже сериализованное тело, а ETag и Last-Modified
+    берутся из версий и отметок областей, поэтому на повторный запрос
+    с неизменными данными ответ 304 обходится без базы. Ответ общий
+    для всех пользователей.
+    """
+    def decorator(view):
+        @require_safe
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            page_scopes = scopes(request, *args, **kwargs)
+            key = caching.view_key(f'api:{view.__name__}',
+                                   caching.get_versions(page_scopes),
+                                   request)
+            etag = quote_etag(hashlib.md5(key.encode()).hexdigest())
+            modified = caching.last_modified(page_scopes)
+            not_modified = get_conditional_response(
+                request, etag=etag, last_modified=modified)
+            if not_modified is not None:
+                return caching.set_validators(not_modified, etag, modified,
+                                              private=False)
+            content = cache.get(key)
+            if content is None:
+                try:
+                    data = view(request, *args, **kwargs)
+                except Http404:
+                    return JsonResponse({'detail': 'Не найдено'}, status=404)
+                except InvalidCursor:
+                    return JsonResponse({'detail': 'Неверный курсор'},
+                                        status=400)
+                content = json.dumps(data, cls=DjangoJSONEncoder,
+                                     ensure_ascii=False,
+                                     separators=(',', ':')).encode()
+                cache.set(key, content, settings.FEED_CACHE_TIMEOUT)
+            response = HttpResponse(content, content_type='application/json')
+            return caching.set_validators(response, etag, modified,
+                                          private=False)
+        return wrapper
+    return decorator
+
+
+def _get(queryset, **lookups):
+    row = queryset.filter(**lookups).first()
+    if row is None:
+        raise Http404
+    return row
+
+
+def _comment_counts(ids):
+    return dict(
+        Comment.objects.filter(post_id__in=ids).order_by()
+        .values('post_id').annotate(total=Count('id'))
+        .values_list('post_id', 'total')
+    )
+
+
+def _image(row):
+    name = row['image']
+    if not name:
+        return None
+    try:
+        variants = thumbnails.card_variants(name, row['image_width'])
+    except Exception:
+        # как и в карточке: битая картинка не роняет ответ
+        logger.exception('Не удалось получить миниатюры для %s', name)
+        variants = []
+    return {
+        'url': thumbnails.source(name).url,
+        'width': row['image_width'],
+        'height': row['image_height'],
+        'color': row['image_color'] or None,
+        'thumbnails': [{'width': width, 'url': image.url}
+                       for width, image in variants],
+    }
+
+
+def serialize_posts(rows):
+    """Строки POST_FIELDS в JSON-совместимые словари."""
+    counts = _comment_counts([row['pk'] for row in rows])
+    thumbnails.prefetch((row['image'], row['image_width']) for row in rows)
+    return [{
+        'id': row['pk'],
+        'text': row['text'],
+        'pub_date': row['pub_date'],
+        'author': row['author__username'],
+        'group': {'slug': row['group__slug'],
+                  'title': row['group__title']}
+        if row['group__slug'] else None,
+        'comments': counts.get(row['pk'], 0),
+        'image': _image(row),
+    } for row in rows]
+
+
+def feed_page(request, queryset):
+    """Страница ленты по курсорам `after` / `before`, без COUNT(*)."""
+    paginator = CursorPaginator(queryset.values(*POST_FIELDS),
+                                settings.API_PAGE_SIZE)
+    page = paginator.page(after=request.GET.get('after'),
+                          before=request.GET.get('before'))
+    return {
+        'results': serialize_posts(page.object_list),
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    }
+
+
+@api_view(lambda request: ['global', 'groups'])
+def posts(request):
+    return feed_page(request, Post.objects.all())
+
+
+@api_view(lambda request, slug: [f'group:{slug}', 'groups'])
+def group_posts(request, slug):
+    group = _get(Group.objects.values('pk', 'slug', 'title', 'description'),
+                 slug=slug)
+    data = feed_page(request, Post.objects.filter(group_id=group.pop('pk')))
+    data['group'] = group
+    return data
+
+
+@api_view(lambda request, username: [f'author:{username}', 'groups'])
+def profile_posts(request, username):
+    author = _get(User.objects.values('pk', 'username', 'first_name',
+                                      'last_name'), username=username)
+    data = feed_page(request, Post.objects.filter(author_id=author.pop('pk')))
+    data['author'] = author
+    return data
+
+
+@api_view(lambda request, post_id: [f'post:{post_id}', 'groups'])
+def post_detail(request, post_id):
+    row = _get(Post.objects.values(*POST_FIELDS), pk=post_id)
+    data = serialize_posts([row])[0]
+    # первая страница, остальные — по comments_next, как на странице поста
+    page = comment_page(row['author__username'], post_id)
+    data['comment_list'] = page['comments']
+    data['comments_next'] = page['next']
+    return data
+
+
+def comment_page(username, post_id, after=None):
+    """Страница комментариев поста и адрес следующей в JSON."""
+    paginator = CursorPaginator(
+        Comment.objects.filter(post_id=post_id).values(*COMMENT_FIELDS),
+        settings.COMMENTS_PAGE_SIZE, COMMENT_ORDERING)
+    page = paginator.page(after=after)
+    return {
+        'comments': [{
+            'id': comment['pk'],
+            'text': comment['text'],
+            'created': comment['created'],
+            'author': comment['author__username'],
+        } for comment in page],
+        'next': comments_url(username, post_id, page.next_cursor,
+                             format='json') if page.has_next() else None,
+    }
+
+
+@api_view(lambda request, username, post_id: [f'post:{post_id}'])
+def post_comments(request, username, post_id):
+    _get(Post.objects.values('pk'), pk=post_id, author__username=username)
+    return comment_page(username, post_id, request.GET.get('after'))
@@ -0,0 +1,103 @@
+import os
+import re
+from datetime import timedelta
+
+from django.db.models import Count, F
+from django.utils import timezone
+from sorl.thumbnail import delete as delete_with_thumbnails
+from sorl.thumbnail.images import ImageFile
+
+from .models import MediaBlob, Post
+
+# имена, которые выдаёт ContentAddressedStorage; остальные файлы
+# (загруженные до неё) счётчиками не управляются
+BLOB_RE = re.compile(r'^posts/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.\w+$')
+
+
+def _storage():
+    return Post._meta.get_field('image').storage
+
+
+def acquire(name):
+    if not name or not BLOB_RE.match(name):
+        return
+    MediaBlob.objects.bulk_create([MediaBlob(name=name)],
+                                  ignore_conflicts=True)
+    MediaBlob.objects.filter(name=name).update(refs=F('refs') + 1,
+                                               updated=timezone.now())
+
+
+def release(name):
+    if not name or not BLOB_RE.match(name):
+        return
+    MediaBlob.objects.filter(name=name).update(refs=F('refs') - 1,
+                                               updated=timezone.now())
+
+
+def replace(old_name, new_name):
+    if old_name != new_name:
+        acquire(new_name)
+        release(old_name)
+
+
+def recount():
+    """Пересчитывает ссылки по таблице постов, возвращает число исправлений."""
+    actual = {
+        name: refs for name, refs in
+        Post.objects.exclude(image='').exclude(image__isnull=True)
+        .order_by().values('image').annotate(refs=Count('id'))
+        .values_list('image', 'refs')
+        if BLOB_RE.match(name)
+    }
+    fixed = 0
+    for blob in MediaBlob.objects.all().iterator():
+        refs = actual.pop(blob.name, 0)
+        if blob.refs != refs:
+            MediaBlob.objects.filter(name=blob.name).update(
+                refs=refs, updated=timezone.now())
+            fixed += 1
+    MediaBlob.objects.bulk_create(
+        [MediaBlob(name=name, refs=refs) for name, refs in actual.items()],
+        ignore_conflicts=True,
+    )
+    return fixed + len(actual)
+
+
+def _stale(storage, name, deadline):
+    try:
+        return storage.get_modified_time(name) < deadline
+    except FileNotFoundError:
+        return True
+
+
+def collect(grace=timedelta(hours=24)):
+    """
+    Удаляет файлы без ссылок вместе с их миниатюрами.
+
+    Файл удаляется, только если счётчик обнулился и сам файл не трогали
+    дольше `grace`: за это время успевает сохраниться пост, который
+    загрузил такую же картинку. Так же удаляются файлы, для которых
+    записи нет вовсе (пост не сохранился после загрузки).
+    """
+    storage = _storage()
+    deadline = timezone.now() - grace
+    removed = 0
+    candidates = MediaBlob.objects.filter(refs__lte=0, updated__lt=deadline) \
+        .values_list('name', flat=True)
+    for name in candidates.iterator():
+        if not _stale(storage, name, deadline):
+            continue
+        # запись удаляем первой и только если на неё так и не сослались
+        if MediaBlob.objects.filter(name=name, refs__lte=0).delete()[0]:
+            delete_with_thumbnails(ImageFile(name, storage))
+            removed += 1
+    known = set(MediaBlob.objects.values_list('name', flat=True))
+    for root, _, files in os.walk(storage.path('posts')):
+        for filename in files:
+            name = os.path.relpath(os.path.join(root, filename),
+                                   storage.location).replace('\\', '/')
+            if (BLOB_RE.match(name) and name not in known
+                    and _stale(storage, name, deadline)):
+                delete_with_thumbnails(ImageFile(name, storage))
+                removed += 1
+    return removed
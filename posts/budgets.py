@@ -0,0 +1,92 @@
+import sys
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth import middleware as auth_middleware
+from django.contrib.sessions.backends.base import SessionBase
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.template.base import Variable
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+
+_RESOLVE_LOOKUP = Variable._resolve_lookup.__code__
+# ленивые request.user и request.session: их первая загрузка
+# из шаблона — запрос запроса, а не шаблона
+_LAZY_LOADS = {auth_middleware.get_user.__code__,
+               SessionBase._get_session.__code__}
+
+
+class LazyQueryError(RuntimeError):
+    """Шаблон обратился к базе: незагруженная связь или менеджер."""
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def _template_variable():
+    """Переменная шаблона, при разрешении которой выполняется запрос."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        if frame.f_code in _LAZY_LOADS:
+            return None
+        if frame.f_code is _RESOLVE_LOOKUP:
+            return frame.f_locals['self'].var
+        frame = frame.f_back
+    return None
+
+
+def forbid_lazy_queries(execute, sql, params, many, context):
+    """
+    Обёртка connection.execute_wrapper для строгого режима.
+
+    Запрещает запросы изнутри Variable._resolve_lookup: {{ post.author }}
+    без select_related, {{ post.comments.count }} и т. п. Перебор
+    QuerySet из контекста ({% for %}, {% if %}) разрешён: это запрос
+    представления, просто отложенный. Так же разрешена загрузка ленивых
+    request.user и сессии ({{ user.is_authenticated }}).
+    """
+    variable = _template_variable()
+    if variable is not None:
+        raise LazyQueryError(f'{{{{ {variable} }}}} обращается к базе: {sql}')
+    return execute(sql, params, many, context)
+
+
+class StrictQueriesMiddleware:
+    """Включает `forbid_lazy_queries` на время запроса при QUERY_STRICT."""
+
+    def __init__(self, get_response):
+        if not settings.QUERY_STRICT:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with connection.execute_wrapper(forbid_lazy_queries):
+            return self.get_response(request)
+
+
+def budget_for(path):
+    """Имя URL и его бюджет из QUERY_BUDGETS (None — без бюджета)."""
+    name = resolve(urlsplit(path).path).url_name
+    return name, settings.QUERY_BUDGETS.get(name)
+
+
+def check_budget(client, path, data=None, **extra):
+    """
+    GET через тестовый клиент; QueryBudgetExceeded, если запросов больше
+    бюджета страницы. Возвращает ответ и выполненные запросы.
+    """
+    name, budget = budget_for(path)
+    if budget is None:
+        raise QueryBudgetExceeded(f'Для {name} ({path}) нет бюджета '
+                                  f'в QUERY_BUDGETS')
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(path, data or {}, **extra)
+    if len(queries) > budget:
+        listing = '\n'.join(f'  {query["sql"]}'
+                            for query in queries.captured_queries)
+        raise QueryBudgetExceeded(
+            f'{name} ({path}): {len(queries)} запросов при бюджете '
+            f'{budget}:\n{listing}')
+    return response, queries.captured_queries
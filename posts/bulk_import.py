@@ -0,0 +1,309 @@
+import json
+from collections import Counter
+from contextlib import contextmanager
+
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import SuspiciousFileOperation, ValidationError
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import blobs, caching, images, search, stats, timeline
+from .models import Comment, Follow, Group, Post, User
+
+KINDS = ('user', 'group', 'post', 'comment', 'follow')
+
+
+@contextmanager
+def explicit_dates():
+    """
+    Даты из файла вместо текущего времени.
+
+    bulk_create вызывает pre_save полей, и auto_now_add перезаписал бы
+    pub_date и created. Команда работает в отдельном процессе, поэтому
+    поля можно переключить на время загрузки.
+    """
+    fields = [Post._meta.get_field('pub_date'),
+              Comment._meta.get_field('created')]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def _write_lock():
+    """
+    Блокировка записи в начале транзакции пачки, как BEGIN IMMEDIATE.
+
+    atomic() начинает транзакцию отложенным BEGIN, и между MAX(pk)
+    в _allocate и bulk_create работающий сайт успел бы вставить строки
+    с теми же id. UPDATE без строк ничего не меняет, но SQLite берёт
+    для него блокировку записи; запросы сайта ждут конца пачки.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f'UPDATE {Post._meta.db_table} SET id = id WHERE 0')
+
+
+def _allocate(model, objects):
+    # bulk_create в SQLite не возвращает id, поэтому раздаём их сами;
+    # вызывается только под _write_lock
+    first = (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+    for pk, obj in enumerate(objects, first):
+        obj.pk = pk
+    return objects
+
+
+def _lookup(model, field, values, mapping):
+    """Дополняет mapping id уже существующих в базе объектов."""
+    values = list({value for value in values
+                   if isinstance(value, str) and value not in mapping})
+    for start in range(0, len(values), 500):
+        mapping.update(model.objects
+                       .filter(**{f'{field}__in': values[start:start + 500]})
+                       .values_list(field, 'pk'))
+
+
+def _date(value):
+    if value is None:
+        return timezone.now()
+    date = parse_datetime(str(value))
+    if date is None:
+        raise ValidationError(f'неверная дата: {value}')
+    if timezone.is_naive(date):
+        date = timezone.make_aware(date, timezone.utc)
+    return date
+
+
+def _ref(mapping, value, what):
+    try:
+        return mapping[value]
+    except (KeyError, TypeError):
+        raise ValidationError(f'неизвестный {what}: {value}')
+
+
+class Importer:
+    """
+    Загрузка пользователей, групп, постов, комментариев и подписок
+    из NDJSON: по объекту на строку, тип в поле "type".
+
+    Строки обрабатываются пачками по batch_size, каждая пачка в своей
+    транзакции через bulk_create. Ссылки на авторов, группы и посты
+    разрешаются по словарям в памяти (имя, slug, внешний id поста из
+    этого же файла); ссылаться можно на строки выше или на то, что уже
+    есть в базе. Картинка поста — имя файла, уже лежащего в хранилище
+    постов. Сигналы не срабатывают, поэтому счётчики профилей,
+    индекс поиска, ленты подписок и кэш обновляет `finish`.
+    """
+
+    def __init__(self, batch_size=5000):
+        self.batch_size = batch_size
+        self.users = {}
+        self.groups = {}
+        self.posts = {}
+        self.created = Counter()
+        self.errors = []
+        self.lines = 0
+        self._touched_users = set()
+        self._fanout_authors = set()
+        self._post_range = None
+        self._images = {}
+
+    def run(self, lines, progress=None):
+        chunk = []
+        with explicit_dates():
+            for number, line in enumerate(lines, 1):
+                if not line.strip():
+                    continue
+                chunk.append((number, line))
+                if len(chunk) >= self.batch_size:
+                    self._flush(chunk)
+                    chunk = []
+                    if progress is not None:
+                        progress(self)
+            if chunk:
+                self._flush(chunk)
+        self.finish()
+
+    def _error(self, number, error):
+        if isinstance(error, ValidationError):
+            message = '; '.join(error.messages)
+        elif isinstance(error, KeyError):
+            message = f'нет поля {error}'
+        else:
+            message = str(error)
+        self.errors.append((number, message))
+
+    def _build(self, rows, build):
+        built = []
+        for number, record in rows:
+            try:
+                built.append(build(record))
+            except (ValidationError, KeyError, TypeError, ValueError) as error:
+                self._error(number, error)
+        return built
+
+    def _flush(self, chunk):
+        rows = {kind: [] for kind in KINDS}
+        for number, line in chunk:
+            self.lines = number
+            try:
+                record = json.loads(line)
+                rows[record.pop('type')].append((number, record))
+            except (ValueError, KeyError, TypeError, AttributeError):
+                self.errors.append(
+                    (number, 'ожидается JSON-объект с известным "type"'))
+        with transaction.atomic():
+            _write_lock()
+            self._import_users(rows['user'])
+            self._import_groups(rows['group'])
+            _lookup(User, 'username', [
+                record.get(field)
+                for kind, fields in (('post', ['author']),
+                                     ('comment', ['author']),
+                                     ('follow', ['user', 'author']))
+                for _, record in rows[kind] for field in fields
+            ], self.users)
+            _lookup(Group, 'slug', [record.get('group')
+                                    for _, record in rows['post']],
+                    self.groups)
+            self._import_posts(rows['post'])
+            self._import_comments(rows['comment'])
+            self._import_follows(rows['follow'])
+
+    def _import_users(self, rows):
+        _lookup(User, 'username', [record.get('username')
+                                   for _, record in rows], self.users)
+        # пароли не переносятся: вход через восстановление пароля
+        password = make_password(None)
+
+        def build(record):
+            user = User(username=record['username'],
+                        first_name=record.get('first_name', ''),
+                        last_name=record.get('last_name', ''),
+                        email=record.get('email', ''),
+                        password=password)
+            user.clean_fields(exclude=['password'])
+            return user
+
+        new = {}
+        for user in self._build(rows, build):
+            # существующие не трогаем, из повторов в файле берём первый
+            if user.username not in self.users:
+                new.setdefault(user.username, user)
+        users = list(new.values())
+        User.objects.bulk_create(_allocate(User, users))
+        self.users.update((user.username, user.pk) for user in users)
+        self.created['user'] += len(users)
+
+    def _import_groups(self, rows):
+        _lookup(Group, 'slug', [record.get('slug') for _, record in rows],
+                self.groups)
+
+        def build(record):
+            group = Group(slug=record['slug'], title=record['title'],
+                          description=record.get('description', ''))
+            group.clean_fields(exclude=['description'])
+            return group
+
+        new = {}
+        for group in self._build(rows, build):
+            if group.slug not in self.groups:
+                new.setdefault(group.slug, group)
+        groups = list(new.values())
+        Group.objects.bulk_create(_allocate(Group, groups))
+        self.groups.update((group.slug, group.pk) for group in groups)
+        self.created['group'] += len(groups)
+
+    def _import_posts(self, rows):
+        def build(record):
+            group = record.get('group')
+            post = Post(
+                text=record['text'],
+                author_id=_ref(self.users, record.get('author'), 'автор'),
+                group_id=_ref(self.groups, group, 'группа') if group else None,
+                pub_date=_date(record.get('pub_date')),
+            )
+            post.clean_fields(exclude=['author', 'group', 'image'])
+            if record.get('image'):
+                post.image = record['image']
+                for name, value in self._image_meta(post.image.name).items():
+                    setattr(post, name, value)
+            return record.get('id'), post
+
+        built = self._build(rows, build)
+        posts = _allocate(Post, [post for _, post in built])
+        Post.objects.bulk_create(posts)
+        for key, post in built:
+            if key is not None:
+                self.posts[str(key)] = post.pk
+            self._touched_users.add(post.author_id)
+            self._fanout_authors.add(post.author_id)
+        if posts:
+            first = posts[0].pk if self._post_range is None \
+                else self._post_range[0]
+            self._post_range = (first, posts[-1].pk)
+        self.created['post'] += len(posts)
+
+    def _image_meta(self, name):
+        # картинок обычно намного меньше, чем постов с ними
+        if name not in self._images:
+            storage = Post._meta.get_field('image').storage
+            try:
+                with storage.open(name) as file:
+                    self._images[name] = images.describe(file)
+            except (OSError, SuspiciousFileOperation):
+                raise ValidationError(f'нет картинки: {name}')
+        return self._images[name]
+
+    def _import_comments(self, rows):
+        def build(record):
+            comment = Comment(
+                post_id=_ref(self.posts, str(record.get('post')), 'пост'),
+                author_id=_ref(self.users, record.get('author'), 'автор'),
+                text=record['text'],
+                created=_date(record.get('created')),
+            )
+            comment.clean_fields(exclude=['post', 'author'])
+            return comment
+
+        comments = self._build(rows, build)
+        Comment.objects.bulk_create(comments)
+        self._touched_users.update(comment.author_id for comment in comments)
+        self.created['comment'] += len(comments)
+
+    def _import_follows(self, rows):
+        def build(record):
+            follow = Follow(
+                user_id=_ref(self.users, record.get('user'), 'читатель'),
+                author_id=_ref(self.users, record.get('author'), 'автор'),
+            )
+            if follow.user_id == follow.author_id:
+                raise ValidationError('подписка на себя')
+            return follow
+
+        follows = self._build(rows, build)
+        # повторные подписки пропускает уникальный индекс
+        Follow.objects.bulk_create(follows, ignore_conflicts=True)
+        for follow in follows:
+            self._touched_users.update((follow.user_id, follow.author_id))
+            self._fanout_authors.add(follow.author_id)
+        self.created['follow'] += len(follows)
+
+    def finish(self):
+        """Отложенное обслуживание того, что обычно делают сигналы."""
+        users = sorted(self._touched_users)
+        for start in range(0, len(users), 500):
+            stats.rebuild(users[start:start + 500])
+        if self._post_range is not None:
+            search.reindex_where('post.id BETWEEN %s AND %s',
+                                 list(self._post_range))
+        timeline.backfill(sorted(self._fanout_authors))
+        if self._images:
+            blobs.recount()
+        if self.created:
+            # 'groups' входит в ключи всех страниц и карточек
+            caching.bump('global', 'groups')
@@ -0,0 +1,222 @@
+import base64
+import binascii
+import hashlib
+import json
+import re
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import get_template
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.utils.safestring import mark_safe
+
+HOLE_RE = re.compile(r'<!--hole:([A-Za-z0-9_=-]+)-->')
+# что можно подставить в каркас; метки с другими шаблонами и
+# нечитаемые метки (например, набранные в тексте поста) остаются текстом
+HOLE_PREFIX = 'includes/holes/'
+HOLE_TEMPLATES = ('includes/menu.html',)
+
+
+def hole_allowed(template_name):
+    return isinstance(template_name, str) and '..' not in template_name \
+        and (template_name.startswith(HOLE_PREFIX)
+             or template_name in HOLE_TEMPLATES)
+
+
+def _version_key(scope):
+    return f'version:{scope}'
+
+
+def _fresh_version():
+    # после вытеснения ключа версия не должна совпасть со старой
+    return int(time.time() * 1000)
+
+
+def get_versions(scopes):
+    keys = [_version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    missing = {key: _fresh_version() for key in keys if key not in versions}
+    if missing:
+        for key, value in missing.items():
+            cache.add(key, value, None)
+        versions.update(cache.get_many(list(missing)))
+    return [versions.get(key, 0) for key in keys]
+
+
+def bump(*scopes):
+    for scope in scopes:
+        key = _version_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _fresh_version(), None)
+    if scopes:
+        now = int(time.time())
+        cache.set_many({_changed_key(scope): now for scope in scopes}, None)
+
+
+def _changed_key(scope):
+    return f'changed:{scope}'
+
+
+def last_modified(scopes):
+    """
+    Время последнего изменения областей (unix time) для Last-Modified.
+
+    Если отметки нет (кэш очищен), изменением считается текущий момент.
+    """
+    keys = [_changed_key(scope) for scope in scopes]
+    stamps = cache.get_many(keys)
+    now = int(time.time())
+    for key in keys:
+        if key not in stamps:
+            cache.add(key, now, None)
+            stamps[key] = now
+    return max(stamps.values())
+
+
+def post_scopes(author_username, group_slug, post_id):
+    scopes = ['global', f'author:{author_username}', f'post:{post_id}']
+    if group_slug:
+        scopes.append(f'group:{group_slug}')
+    return scopes
+
+
+def count(name, amount):
+    if not amount:
+        return
+    key = f'counter:{name}'
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        cache.set(key, amount, None)
+
+
+def counters(*names):
+    values = cache.get_many([f'counter:{name}' for name in names])
+    return {name: values.get(f'counter:{name}', 0) for name in names}
+
+
+def attach_cards(posts):
+    """
+    Подтягивает из кэша отрисованные карточки постов одним запросом.
+
+    Ключ карточки содержит версии поста (правка, комментарии) и групп
+    (переименование), поэтому устаревшая карточка просто не находится.
+    Не найденные карточки отрисует и сохранит тег `post_card`.
+    """
+    scopes = [f'post:{post.id}' for post in posts]
+    *post_versions, groups_version = get_versions(scopes + ['groups'])
+    for post, version in zip(posts, post_versions):
+        post.card_key = f'card:{post.id}:{version}.{groups_version}'
+    cards = cache.get_many([post.card_key for post in posts])
+    for post in posts:
+        post.cached_card = cards.get(post.card_key)
+    count('card_hits', len(cards))
+    count('card_misses', len(posts) - len(cards))
+    return posts
+
+
+def hole_marker(template_name, params):
+    if not hole_allowed(template_name):
+        raise ValueError(f'{template_name} не разрешён для дырок')
+    payload = json.dumps([template_name, params], separators=(',', ':'))
+    encoded = base64.urlsafe_b64encode(payload.encode()).decode()
+    return mark_safe(f'<!--hole:{encoded}-->')
+
+
+def render_hole(template_name, params, request):
+    return get_template(template_name).render(params, request)
+
+
+def fill_holes(content, request):
+    """Подставляет в общий каркас страницы фрагменты текущего пользователя."""
+    templates = {}
+
+    def fill(match):
+        try:
+            template_name, params = json.loads(
+                base64.urlsafe_b64decode(match.group(1)))
+        except (ValueError, TypeError, binascii.Error):
+            return match.group(0)
+        if not hole_allowed(template_name) or not isinstance(params, dict):
+            return match.group(0)
+        if template_name not in templates:
+            templates[template_name] = get_template(template_name)
+        return templates[template_name].render(params, request)
+
+    return HOLE_RE.sub(fill, content)
+
+
+def view_key(name, versions, request):
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return 'view:{}:{}:{}'.format(
+        name, '.'.join(str(version) for version in versions), path)
+
+
+def set_validators(response, etag, modified, private=True):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(modified)
+    # ответ каждый раз перепроверяется по ETag; страницы с дырками личные
+    if private:
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(response, public=True, no_cache=True)
+    return response
+
+
+def cached_view(scopes):
+    """
+    Кэширует общий для всех пользователей каркас страницы.
+
+    Ключ строится из версий областей страницы; записи увеличивают версии
+    (`bump`), поэтому каркас живёт FEED_CACHE_TIMEOUT секунд, но новые
+    данные видны сразу. Всё, что зависит от пользователя, шаблоны выводят
+    через `{% hole %}`: в каркасе остаётся метка, которая заполняется
+    на каждом запросе.
+
+    Те же версии дают ETag и Last-Modified: на условный GET с неизменной
+    страницей отвечаем 304, не обращаясь к базе за постами.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            page_scopes = scopes(request, *args, **kwargs)
+            key = view_key(view.__name__, get_versions(page_scopes),
+                           request)
+            # дырки зависят от пользователя, форма — от CSRF-cookie
+            etag = quote_etag(hashlib.md5('{}:{}:{}'.format(
+                key, request.user.pk,
+                request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+            ).encode()).hexdigest())
+            modified = last_modified(page_scopes)
+            not_modified = get_conditional_response(
+                request, etag=etag, last_modified=modified)
+            if not_modified is not None:
+                return set_validators(not_modified, etag, modified)
+            response = cache.get(key)
+            if response is None:
+                request.skeleton = True
+                try:
+                    response = view(request, *args, **kwargs)
+                finally:
+                    request.skeleton = False
+                # CSRF-токен вне «дырки» сделал бы каркас личным
+                if (response.status_code == 200 and not response.streaming
+                        and not request.META.get('CSRF_COOKIE_USED')):
+                    cache.set(key, response, settings.FEED_CACHE_TIMEOUT)
+            if response.status_code == 200 and not response.streaming:
+                response = set_validators(response.__class__(
+                    fill_holes(response.content.decode(response.charset),
+                               request),
+                    content_type=response['Content-Type'],
+                ), etag, modified)
+            return response
+        return wrapper
+    return decorator
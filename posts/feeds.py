@@ -0,0 +1,75 @@
+from collections import defaultdict
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.db.models import Count, F, Window
+from django.db.models.functions import RowNumber
+from django.urls import reverse
+
+from . import thumbnails
+from .caching import attach_cards
+from .models import Comment
+
+# страницы комментариев под постом: новые сверху, курсор по (created, id)
+COMMENT_ORDERING = ('-created', '-pk')
+
+
+def comments_url(username, post_id, cursor, **params):
+    """Адрес следующей страницы комментариев (post_comments)."""
+    return '{}?{}'.format(reverse('post_comments', args=[username, post_id]),
+                          urlencode({'after': cursor, **params}))
+
+
+def attach_comment_counts(posts):
+    """
+    Проставляет post.comment_count одним сгруппированным запросом.
+
+    Счётчик считается уже для постов страницы: аннотация на исходном
+    QuerySet превратила бы COUNT(*) пагинатора в подзапрос по всей таблице.
+    """
+    ids = [post.id for post in posts]
+    counts = dict(
+        Comment.objects.filter(post_id__in=ids).order_by()
+        .values('post_id').annotate(total=Count('id'))
+        .values_list('post_id', 'total')
+    )
+    for post in posts:
+        post.comment_count = counts.get(post.id, 0)
+    return posts
+
+
+def attach_comment_previews(posts, limit):
+    """Последние `limit` комментариев каждого поста оконным запросом."""
+    ids = [post.id for post in posts]
+    previews = defaultdict(list)
+    if ids and limit:
+        ranked = Comment.objects.filter(post_id__in=ids).annotate(
+            author_username=F('author__username'),
+            row_number=Window(RowNumber(), partition_by=[F('post_id')],
+                              order_by=[F('created').desc(),
+                                        F('id').desc()]),
+        ).values('id', 'post_id', 'text', 'created', 'author_username',
+                 'row_number')
+        sql, params = ranked.query.sql_with_params()
+        comments = Comment.objects.raw(
+            f'SELECT * FROM ({sql}) WHERE row_number <= %s '
+            f'ORDER BY post_id, row_number',
+            params + (limit,),
+        )
+        for comment in comments:
+            previews[comment.post_id].append(comment)
+    for post in posts:
+        post.comment_preview = previews[post.id]
+    return posts
+
+
+def prepare_page(page):
+    page.object_list = list(page.object_list)
+    attach_cards(page.object_list)
+    # данные нужны только для карточек, которых нет в кэше
+    misses = [post for post in page.object_list if post.cached_card is None]
+    attach_comment_counts(misses)
+    thumbnails.prefetch((post.image, post.image_width) for post in misses)
+    if settings.FEED_COMMENT_PREVIEW:
+        attach_comment_previews(misses, settings.FEED_COMMENT_PREVIEW)
+    return page
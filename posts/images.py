@@ -0,0 +1,95 @@
+import hashlib
+import io
+import os
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, features
+
+ORIENTATION = 0x0112
+EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg', 'PNG': 'png'}
+
+
+def _target_format(has_alpha):
+    wanted = settings.POST_IMAGE_FORMAT
+    if wanted == 'WEBP' and not features.check('webp'):
+        wanted = 'JPEG'
+    if wanted == 'JPEG' and has_alpha:
+        return 'PNG'
+    return wanted
+
+
+def normalize(source, max_side=None):
+    """
+    Уменьшает картинку до max_side по большей стороне и перекодирует её.
+
+    JPEG декодируется сразу в уменьшенном масштабе (draft), остальные
+    форматы — целиком, поэтому до декодирования размер растра (после
+    draft) сверяется с POST_IMAGE_MAX_PIXELS: иначе ValidationError.
+    EXIF и прочие метаданные не сохраняются, ориентация с EXIF
+    применяется к пикселям. Анимации возвращаются как есть (None).
+    """
+    max_side = max_side or settings.POST_IMAGE_MAX_SIDE
+    image = Image.open(source)
+    image.draft('RGB', (max_side, max_side))
+    width, height = image.size
+    if width * height > settings.POST_IMAGE_MAX_PIXELS:
+        raise ValidationError(
+            f'Слишком большая картинка: {width}×{height}, можно не больше '
+            f'{settings.POST_IMAGE_MAX_PIXELS // 10 ** 6} Мп')
+    if getattr(image, 'is_animated', False):
+        return None
+    image.thumbnail((max_side, max_side), Image.LANCZOS, reducing_gap=3.0)
+    image = ImageOps.exif_transpose(image)
+    has_alpha = image.mode in ('RGBA', 'LA') or (
+        image.mode == 'P' and 'transparency' in image.info)
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+    image_format = _target_format(has_alpha)
+    output = io.BytesIO()
+    options = {'quality': settings.POST_IMAGE_QUALITY}
+    if image_format == 'PNG':
+        options = {'optimize': True}
+    icc_profile = image.info.get('icc_profile')
+    if icc_profile:
+        options['icc_profile'] = icc_profile
+    image.save(output, image_format, **options)
+    return output.getvalue(), EXTENSIONS[image_format]
+
+
+def normalize_upload(upload):
+    upload.seek(0)
+    result = normalize(upload)
+    if result is None:
+        upload.seek(0)
+        return upload
+    data, extension = result
+    stem = os.path.splitext(os.path.basename(upload.name))[0]
+    return ContentFile(data, name=f'{stem}.{extension}')
+
+
+def describe(file):
+    """
+    Размеры (с учётом ориентации EXIF), средний цвет и sha256 картинки.
+
+    Для цвета картинка декодируется в масштабе 1/8 (draft) и сжимается
+    до одного пикселя.
+    """
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    image = Image.open(file)
+    width, height = image.size
+    if image.getexif().get(ORIENTATION) in (5, 6, 7, 8):
+        width, height = height, width
+    image.draft('RGB', (64, 64))
+    image.thumbnail((64, 64))
+    red, green, blue = image.convert('RGB').resize((1, 1), Image.BOX) \
+        .getpixel((0, 0))
+    return {
+        'image_width': width,
+        'image_height': height,
+        'image_color': f'#{red:02x}{green:02x}{blue:02x}',
+        'image_hash': digest.hexdigest(),
+    }
@@ -0,0 +1,69 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts import caching
+from posts.models import Post
+
+
+def _pages(post):
+    """Пары (страница, HTML-адрес, адрес API) для поста-образца."""
+    username = post.author.username
+    pages = [
+        ('index', reverse('index'), reverse('api_posts')),
+        ('profile', reverse('profile', args=[username]),
+         reverse('api_profile_posts', args=[username])),
+        ('post', reverse('post', args=[username, post.pk]),
+         reverse('api_post', args=[post.pk])),
+    ]
+    if post.group_id:
+        pages.insert(1, ('group', reverse('group', args=[post.group.slug]),
+                         reverse('api_group_posts', args=[post.group.slug])))
+    return pages
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает HTML-страницы лент с JSON API: запросов в секунду, '
+            'размер ответа и число запросов к базе')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--cold', action='store_true',
+                            help='перед каждым запросом сбрасывать версии '
+                                 'кэша, чтобы мерить отрисовку целиком')
+
+    def _measure(self, client, url, requests, cold):
+        size = queries = 0
+        started = time.perf_counter()
+        for _ in range(requests):
+            if cold:
+                # 'groups' входит в ключи всех страниц и карточек
+                caching.bump('groups')
+            with CaptureQueriesContext(connection) as captured:
+                response = client.get(url)
+            if response.status_code != 200:
+                raise CommandError(f'{url}: ответ {response.status_code}')
+            size += len(response.content)
+            queries += len(captured)
+        elapsed = time.perf_counter() - started
+        return requests / elapsed, size / requests, queries / requests
+
+    def handle(self, *args, **options):
+        post = Post.objects.select_related('author', 'group') \
+            .order_by('-pub_date', '-pk').first()
+        if post is None:
+            raise CommandError('В базе нет постов')
+        client = Client()
+        requests = options['requests']
+        self.stdout.write(f'{"страница":>9} {"формат":>7} {"запр./с":>9} '
+                          f'{"ответ, КБ":>10} {"к базе":>7}')
+        for name, html_url, api_url in _pages(post):
+            for kind, url in (('html', html_url), ('json', api_url)):
+                rate, size, queries = self._measure(client, url, requests,
+                                                    options['cold'])
+                self.stdout.write(f'{name:>9} {kind:>7} {rate:>9.0f} '
+                                  f'{size / 1024:>10.1f} {queries:>7.1f}')
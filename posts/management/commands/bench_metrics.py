@@ -0,0 +1,150 @@
+import gc
+import json
+import math
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.http import HttpResponse
+from django.test import Client, RequestFactory
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from posts.models import Post
+from yatube import metrics
+
+from .bench_views import BENCH_ADDR, percentile
+
+MIDDLEWARE = 'yatube.metrics.MetricsMiddleware'
+GC_EVERY = 1000
+TRIM = 0.2
+BLOCK = 250
+MAX_ROUNDS = 4
+
+
+def trimmed_mean(values, trim=TRIM):
+    """Среднее без доли trim самых малых и самых больших значений."""
+    ordered = sorted(values)
+    cut = int(len(ordered) * trim)
+    return statistics.mean(ordered[cut:len(ordered) - cut])
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает время ответа страниц с MetricsMiddleware и без него '
+            'и выводит накладные расходы в JSON. Шаблоны в обоих вариантах '
+            'из TimedDjangoTemplates: без запроса в обработке их обёртка '
+            'стоит одного getattr')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=4000,
+                            help='пар запросов на страницу за один круг')
+        parser.add_argument('--max-overhead', type=float, default=1.0,
+                            help='ошибка, если накладные расходы больше, %%')
+
+    def urls(self):
+        post = Post.objects.select_related('author').order_by('-pk').first()
+        if post is None:
+            raise CommandError('В базе нет постов, запустите seed_data')
+        return {
+            'index': reverse('index'),
+            'post': reverse('post', args=[post.author.username, post.pk]),
+            'api_posts': reverse('api_posts'),
+        }
+
+    def clients(self, url):
+        """Клиенты с MetricsMiddleware и без: цепочка собирается один раз."""
+        enabled = Client(REMOTE_ADDR=BENCH_ADDR)
+        enabled.get(url)
+        disabled = Client(REMOTE_ADDR=BENCH_ADDR)
+        with override_settings(MIDDLEWARE=[name for name in
+                                           settings.MIDDLEWARE
+                                           if name != MIDDLEWARE]):
+            disabled.get(url)
+        return enabled, disabled
+
+    def pairs(self, enabled, disabled, url, count):
+        """Время count пар запросов (с метриками, без)."""
+        timings = []
+        gc.disable()
+        try:
+            for number in range(count):
+                if number % GC_EVERY == 0:
+                    gc.collect()
+                pair = {}
+                # первый запрос пары бывает медленнее: порядок чередуется
+                for client in (enabled, disabled) if number % 2 \
+                        else (disabled, enabled):
+                    started = time.perf_counter()
+                    client.get(url)
+                    pair[client] = time.perf_counter() - started
+                timings.append((pair[enabled], pair[disabled]))
+        finally:
+            gc.collect()
+            gc.enable()
+        return timings
+
+    def measure(self, url, requests, limit):
+        """
+        Накладные расходы — усечённое среднее разниц пар: время ответа
+        здесь скачет на сотни микросекунд, медиана и минимумы оказались
+        заметно шумнее. Измеряемые ответы (каждый METRICS_SAMPLE_RATE-й)
+        дороже остальных на единицы микросекунд и при усечении выпадают
+        не чаще прочих, так что их цена входит в среднее.
+
+        Погрешность — две стандартные ошибки по блокам из BLOCK пар;
+        пока предел в её границах, добавляется ещё requests пар, но не
+        больше MAX_ROUNDS раз.
+        """
+        enabled, disabled = self.clients(url)
+        timings = []
+        for _ in range(MAX_ROUNDS):
+            timings += self.pairs(enabled, disabled, url, requests)
+            without = percentile([without for _, without in timings], 0.5)
+            differences = [with_time - without_time
+                           for with_time, without_time in timings]
+            overhead = trimmed_mean(differences)
+            blocks = [trimmed_mean(differences[start:start + BLOCK])
+                      for start in range(0, len(differences) - BLOCK + 1,
+                                         BLOCK)]
+            error = 2 * statistics.stdev(blocks) / math.sqrt(len(blocks)) \
+                if len(blocks) > 1 else math.inf
+            if abs(overhead / without * 100 - limit) > error / without * 100:
+                break
+        return {
+            'with_ms': round(percentile([with_time for with_time, _
+                                         in timings], 0.5) * 1000, 4),
+            'without_ms': round(without * 1000, 4),
+            'overhead_us': round(overhead * 10 ** 6, 1),
+            'overhead_pct': round(overhead / without * 100, 2),
+            'error_pct': round(error / without * 100, 2)
+            if error != math.inf else None,
+            'pairs': len(timings),
+        }
+
+    def isolated(self, iterations=20000):
+        """Стоимость самой middleware вокруг готового ответа, мкс."""
+        response = HttpResponse(b'x' * 10000)
+        middleware = metrics.MetricsMiddleware(lambda request: response)
+        request = RequestFactory().get('/')
+        started = time.perf_counter()
+        for _ in range(iterations):
+            middleware(request)
+        return (time.perf_counter() - started) / iterations * 10 ** 6
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1:
+            raise CommandError('--requests должно быть больше нуля')
+        limit = options['max_overhead']
+        results = {name: self.measure(url, options['requests'], limit)
+                   for name, url in self.urls().items()}
+        overhead = max(result['overhead_pct'] for result in results.values())
+        report = {
+            'results': results,
+            'middleware_us': round(self.isolated(), 2),
+            'max_overhead_pct': overhead,
+        }
+        self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+        if overhead > limit:
+            raise CommandError(f'Накладные расходы {overhead}% больше '
+                               f'{limit}%')
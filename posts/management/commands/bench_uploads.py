@@ -0,0 +1,114 @@
+import io
+import json
+import os
+import resource
+import time
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from posts.images import normalize
+
+
+def _synthetic(megapixels, image_format):
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    # градиент вместо однотонной заливки, чтобы JPEG был похож на фото
+    image = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    output = io.BytesIO()
+    options = {'quality': 90} if image_format == 'JPEG' else {}
+    image.save(output, image_format, **options)
+    return output.getvalue()
+
+
+def _rss_kb():
+    with open('/proc/self/statm') as statm:
+        pages = int(statm.read().split()[1])
+    return pages * resource.getpagesize() // 1024
+
+
+def _naive(data):
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    image.thumbnail((2048, 2048), Image.LANCZOS)
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=85)
+    return output.getvalue()
+
+
+def _measure(func, data):
+    """
+    Замер в дочернем процессе: ru_maxrss родителя не мешает пику.
+
+    Возвращает словарь elapsed, memory и size (-1 — картинка отклонена)
+    или error, если обработка упала.
+    """
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # что бы ни случилось, ребёнок не должен вернуться в команду
+        result = {'error': 'замер не завершён'}
+        try:
+            os.close(read_end)
+            baseline = _rss_kb()
+            started = time.perf_counter()
+            try:
+                size = len(func(data))
+            except ValidationError:
+                # отклонено до декодирования
+                size = -1
+            elapsed = time.perf_counter() - started
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            result = {'elapsed': elapsed, 'memory': peak - baseline,
+                      'size': size}
+        except BaseException as error:
+            result = {'error': f'{type(error).__name__}: {error}'}
+        finally:
+            try:
+                os.write(write_end, json.dumps(result).encode())
+            finally:
+                os._exit(0)
+    os.close(write_end)
+    with os.fdopen(read_end) as pipe:
+        result = pipe.read()
+    _, status = os.waitpid(pid, 0)
+    if not result:
+        # например, убит при нехватке памяти
+        return {'error': f'процесс завершился со статусом {status}'}
+    return json.loads(result)
+
+
+class Command(BaseCommand):
+    help = 'Замеряет время и пиковую память обработки загруженных картинок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--megapixels', type=int, nargs='+',
+                            default=[2, 12, 40])
+        parser.add_argument('--formats', nargs='+', default=['JPEG', 'PNG'],
+                            choices=['JPEG', 'PNG'])
+        parser.add_argument('--naive', action='store_true',
+                            help='сравнить с полным декодированием')
+
+    def handle(self, *args, **options):
+        modes = [('normalize', lambda data: normalize(io.BytesIO(data))[0])]
+        if options['naive']:
+            modes.append(('naive', _naive))
+        self.stdout.write(
+            f'{"формат":>6} {"Мп":>4} {"режим":>10} {"исходник, КБ":>13} '
+            f'{"результат, КБ":>14} {"время, мс":>10} {"память, МБ":>11}')
+        for image_format in options['formats']:
+            for megapixels in options['megapixels']:
+                data = _synthetic(megapixels, image_format)
+                for name, func in modes:
+                    result = _measure(func, data)
+                    row = (f'{image_format:>6} {megapixels:>4} {name:>10} '
+                           f'{len(data) // 1024:>13} ')
+                    if 'error' in result:
+                        self.stderr.write(f'{row}ошибка: {result["error"]}')
+                        continue
+                    size = result['size'] // 1024 if result['size'] >= 0 \
+                        else 'отклонено'
+                    self.stdout.write(
+                        f'{row}{size:>14} {result["elapsed"] * 1000:>10.0f} '
+                        f'{result["memory"] / 1024:>11.1f}')
@@ -0,0 +1,232 @@
+import json
+import math
+import platform
+import random
+import resource
+import time
+import tracemalloc
+from collections import Counter
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from posts import caching
+from posts.models import Comment, Follow, Group, Post, User
+
+READS = ('index', 'group_posts', 'profile', 'post_view', 'follow_index')
+WRITES = ('new_post', 'add_comment', 'post_edit', 'follow')
+BENCH_ADDR = '203.0.113.1'
+# метрики, по которым --compare показывает изменения
+COMPARED = ('p50_ms', 'p95_ms', 'p99_ms', 'queries_mean', 'peak_memory_kb')
+
+
+def percentile(values, fraction):
+    """Ближайший ранг: значение, не меньше которого fraction выборки."""
+    ordered = sorted(values)
+    rank = math.ceil(fraction * len(ordered)) - 1
+    return ordered[min(max(rank, 0), len(ordered) - 1)]
+
+
+class Sample:
+    """Кого и что запрашивать: выбирается один раз по данным в базе."""
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.posts = list(Post.objects.order_by('?')
+                          .values_list('pk', 'author__username')[:1000])
+        if not self.posts:
+            raise CommandError('В базе нет постов, запустите seed_data')
+        self.groups = list(Group.objects.values_list('pk', 'slug'))
+        authors = User.objects.annotate(total=Count('posts')) \
+            .filter(total__gt=0).order_by('-total')
+        # самый плодовитый автор и случайные, как в реальном трафике
+        self.authors = [authors[0].username] + \
+            list(authors.order_by('?').values_list('username', flat=True)
+                 [:100])
+        self.writer = authors[0]
+        self.reader = User.objects.annotate(total=Count('follower')) \
+            .order_by('-total').first()
+        self.writer_posts = list(self.writer.posts.values_list('pk',
+                                                               flat=True))
+
+    def page(self, pages):
+        return {'page': self.rng.randint(1, pages)}
+
+
+class Command(BaseCommand):
+    help = ('Прогоняет страницы и формы через тестовый клиент и выводит '
+            'p50/p95/p99 времени ответа, число запросов к базе и пиковую '
+            'память в JSON. Формы пишут в базу: запускать на копии')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100,
+                            help='запросов на сценарий')
+        parser.add_argument('--only', nargs='+', choices=READS + WRITES)
+        parser.add_argument('--no-writes', action='store_true')
+        parser.add_argument('--cold', action='store_true',
+                            help='сбрасывать версии кэша перед запросом')
+        parser.add_argument('--memory-samples', type=int, default=5,
+                            help='запросов под tracemalloc на сценарий')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='файл для JSON, иначе stdout')
+        parser.add_argument('--compare',
+                            help='прошлый JSON: изменения пишутся в stderr')
+
+    def scenarios(self, sample):
+        """Имя -> (клиент, функция, возвращающая метод, адрес и данные)."""
+        rng = sample.rng
+        # адрес не из INTERNAL_IPS, иначе замер включит debug toolbar
+        anonymous, reader, writer = (Client(REMOTE_ADDR=BENCH_ADDR)
+                                     for _ in range(3))
+        reader.force_login(sample.reader)
+        writer.force_login(sample.writer)
+
+        def post_view():
+            pk, username = rng.choice(sample.posts)
+            return 'get', reverse('post', args=[username, pk]), None
+
+        def new_post():
+            data = {'text': f'замер {rng.random()}'}
+            if sample.groups:
+                data['group'] = rng.choice(sample.groups)[0]
+            return 'post', reverse('new_post'), data
+
+        def add_comment():
+            pk, username = rng.choice(sample.posts)
+            return 'post', reverse('add_comment', args=[username, pk]), \
+                {'text': f'замер {rng.random()}'}
+
+        def post_edit():
+            pk = rng.choice(sample.writer_posts)
+            return 'post', reverse('post_edit', args=[
+                sample.writer.username, pk]), {'text': f'правка {pk}'}
+
+        def follow():
+            author = rng.choice(sample.authors)
+            view = 'profile_follow' if rng.random() < 0.5 \
+                else 'profile_unfollow'
+            return 'get', reverse(view, args=[author]), None
+
+        scenarios = {
+            'index': (anonymous, lambda: (
+                'get', reverse('index'), sample.page(20))),
+            'profile': (anonymous, lambda: (
+                'get', reverse('profile', args=[rng.choice(sample.authors)]),
+                sample.page(3))),
+            'post_view': (anonymous, post_view),
+            'follow_index': (reader, lambda: (
+                'get', reverse('follow_index'), sample.page(3))),
+            'new_post': (writer, new_post),
+            'add_comment': (writer, add_comment),
+            'post_edit': (writer, post_edit),
+            'follow': (reader, follow),
+        }
+        if sample.groups:
+            scenarios['group_posts'] = (anonymous, lambda: (
+                'get', reverse('group', args=[rng.choice(sample.groups)[1]]),
+                sample.page(5)))
+        return scenarios
+
+    def measure(self, client, request, options):
+        latencies, queries, statuses = [], [], Counter()
+        for _ in range(options['requests']):
+            method, url, data = request()
+            if options['cold']:
+                # 'groups' входит в ключи всех страниц и карточек
+                caching.bump('groups')
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = getattr(client, method)(url, data)
+                latencies.append((time.perf_counter() - started) * 1000)
+            queries.append(len(captured))
+            statuses[str(response.status_code)] += 1
+        peak = 0
+        # tracemalloc замедляет всё, поэтому память меряется отдельно
+        for _ in range(options['memory_samples']):
+            method, url, data = request()
+            tracemalloc.start()
+            try:
+                getattr(client, method)(url, data)
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+            finally:
+                tracemalloc.stop()
+        return {
+            'requests': len(latencies),
+            'p50_ms': round(percentile(latencies, 0.5), 3),
+            'p95_ms': round(percentile(latencies, 0.95), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+            'mean_ms': round(sum(latencies) / len(latencies), 3),
+            'queries_mean': round(sum(queries) / len(queries), 2),
+            'queries_p95': percentile(queries, 0.95),
+            'queries_max': max(queries),
+            'peak_memory_kb': peak // 1024,
+            'statuses': dict(statuses),
+        }
+
+    def compare(self, baseline, results):
+        self.stderr.write(f'{"сценарий":>13} {"метрика":>15} '
+                          f'{"было":>10} {"стало":>10} {"разница":>8}')
+        for name, result in results.items():
+            before = baseline.get('results', {}).get(name)
+            if before is None:
+                continue
+            for metric in COMPARED:
+                old, new = before.get(metric), result[metric]
+                if old is None:
+                    continue
+                change = f'{(new - old) / old * 100:+.0f}%' if old else '—'
+                self.stderr.write(f'{name:>13} {metric:>15} {old:>10} '
+                                  f'{new:>10} {change:>8}')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1:
+            raise CommandError('--requests должно быть больше нуля')
+        sample = Sample(random.Random(options['seed']))
+        scenarios = self.scenarios(sample)
+        names = options['only'] or READS + (
+            () if options['no_writes'] else WRITES)
+        results = {}
+        for name in names:
+            if name in scenarios:
+                results[name] = self.measure(*scenarios[name], options)
+        report = {
+            'meta': {
+                'created': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'requests': options['requests'],
+                'cold': options['cold'],
+                'seed': options['seed'],
+                'data': {
+                    'users': User.objects.count(),
+                    'groups': len(sample.groups),
+                    'posts': Post.objects.count(),
+                    'comments': Comment.objects.count(),
+                    'follows': Follow.objects.count(),
+                },
+                'settings': {
+                    'FEED_PAGINATION': settings.FEED_PAGINATION,
+                    'FEED_COMMENT_PREVIEW': settings.FEED_COMMENT_PREVIEW,
+                    'THUMBNAIL_WORKERS': settings.THUMBNAIL_WORKERS,
+                },
+            },
+            'results': results,
+            # ru_maxrss в Linux — в килобайтах
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as file:
+                self.compare(json.load(file), results)
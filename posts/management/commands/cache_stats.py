@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from posts import caching
+
+
+class Command(BaseCommand):
+    help = ('Показывает попадания в кэш карточек постов и в хранилище '
+            'сведений о миниатюрах')
+
+    def handle(self, *args, **options):
+        stats = caching.counters('card_hits', 'card_misses')
+        total = stats['card_hits'] + stats['card_misses']
+        rate = stats['card_hits'] / total * 100 if total else 0
+        self.stdout.write(
+            f'Карточки постов: попаданий {stats["card_hits"]}, '
+            f'промахов {stats["card_misses"]}, доля попаданий {rate:.1f}%'
+        )
+        tiers = caching.counters('thumbnail_kv_memory', 'thumbnail_kv_cache',
+                                 'thumbnail_kv_db', 'thumbnail_kv_miss')
+        total = sum(tiers.values())
+        rate = tiers['thumbnail_kv_memory'] / total * 100 if total else 0
+        self.stdout.write(
+            f'Миниатюры: из памяти {tiers["thumbnail_kv_memory"]}, '
+            f'из кэша {tiers["thumbnail_kv_cache"]}, '
+            f'из базы {tiers["thumbnail_kv_db"]}, '
+            f'нет записи {tiers["thumbnail_kv_miss"]}, '
+            f'доля памяти {rate:.1f}%'
+        )
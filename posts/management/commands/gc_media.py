@@ -0,0 +1,22 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from posts import blobs
+
+
+class Command(BaseCommand):
+    help = 'Удаляет картинки, на которые не ссылается ни один пост'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=float, default=24,
+                            help='сколько ждать после последней ссылки')
+        parser.add_argument('--recount', action='store_true',
+                            help='сначала пересчитать ссылки по постам')
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            fixed = blobs.recount()
+            self.stdout.write(f'Исправлено счётчиков: {fixed}')
+        removed = blobs.collect(timedelta(hours=options['grace_hours']))
+        self.stdout.write(f'Удалено файлов: {removed}')
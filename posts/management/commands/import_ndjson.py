@@ -0,0 +1,45 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts.bulk_import import KINDS, Importer
+
+
+class Command(BaseCommand):
+    help = ('Загружает пользователей, группы, посты, комментарии и подписки '
+            'из NDJSON-файла пачками через bulk_create')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='файл NDJSON, «-» — stdin')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--max-errors', type=int, default=20,
+                            help='сколько ошибок вывести подробно')
+
+    def handle(self, *args, **options):
+        importer = Importer(batch_size=options['batch_size'])
+        started = time.perf_counter()
+
+        def progress(importer):
+            if options['verbosity'] > 1:
+                elapsed = time.perf_counter() - started
+                self.stdout.write(f'строк: {importer.lines}, '
+                                  f'{importer.lines / elapsed:.0f} в секунду')
+
+        if options['path'] == '-':
+            importer.run(sys.stdin, progress)
+        else:
+            with open(options['path'], encoding='utf-8') as lines:
+                importer.run(lines, progress)
+        elapsed = time.perf_counter() - started
+        for number, message in importer.errors[:options['max_errors']]:
+            self.stderr.write(f'строка {number}: {message}')
+        hidden = len(importer.errors) - options['max_errors']
+        if hidden > 0:
+            self.stderr.write(f'и ещё ошибок: {hidden}')
+        created = ', '.join(f'{kind}: {importer.created[kind]}'
+                            for kind in KINDS)
+        self.stdout.write(
+            f'Загружено — {created}. Строк: {importer.lines}, '
+            f'с ошибками: {len(importer.errors)}, '
+            f'{importer.lines / elapsed:.0f} строк в секунду')
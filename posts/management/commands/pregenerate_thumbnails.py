@@ -0,0 +1,39 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from posts import thumbnails
+from posts.models import Post
+
+
+def _generate(row):
+    try:
+        return thumbnails.generate(*row)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = 'Создаёт недостающие миниатюры для картинок существующих постов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+
+    def handle(self, *args, **options):
+        rows = Post.objects.exclude(image='').exclude(image__isnull=True) \
+            .order_by('pk').values_list('image', 'image_width').iterator()
+        done = 0
+        batch_size = options['workers'] * 4
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            run = map if thumbnails.in_memory_db() else pool.map
+            # Executor.map забирает итератор целиком, поэтому пачками
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                for _ in run(_generate, batch):
+                    done += 1
+                self.stdout.write(f'Обработано картинок: {done}')
+        self.stdout.write(f'Готово, обработано картинок: {done}')
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from posts import timeline
+
+
+class Command(BaseCommand):
+    help = ('Удаляет пачками записи лент авторов, переведённых в режим '
+            'чтения')
+
+    def handle(self, *args, **options):
+        deleted = timeline.prune_pulled()
+        self.stdout.write(f'Удалено записей лент: {deleted}')
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = 'Заново строит полнотекстовый индекс постов'
+
+    def handle(self, *args, **options):
+        total = search.rebuild()
+        self.stdout.write(f'Проиндексировано постов: {total}')
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from posts import stats
+from posts.models import User
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает денормализованные счётчики профилей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('pk')
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+        user_ids = users.values_list('pk', flat=True).iterator()
+        batch_size = options['batch_size']
+        total = fixed = 0
+        batch = []
+        for user_id in user_ids:
+            batch.append(user_id)
+            if len(batch) >= batch_size:
+                fixed += stats.rebuild(batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            fixed += stats.rebuild(batch)
+            total += len(batch)
+        self.stdout.write(f'Проверено профилей: {total}, исправлено: {fixed}')
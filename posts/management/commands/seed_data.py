@@ -0,0 +1,145 @@
+import io
+import json
+import random
+import time
+from datetime import timedelta
+from itertools import accumulate
+
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from PIL import Image
+
+from posts import thumbnails
+from posts.bulk_import import Importer
+from posts.images import normalize
+from posts.models import Post
+
+WORDS = ('кот', 'утро', 'город', 'река', 'книга', 'дорога', 'чай', 'снег',
+         'музыка', 'лес', 'поезд', 'письмо', 'окно', 'море', 'сад', 'дом')
+
+
+def _weights(count, alpha):
+    """Накопленные веса закона Ципфа: k-й по популярности ~ 1 / k^alpha."""
+    return list(accumulate(1 / rank ** alpha for rank in range(1, count + 1)))
+
+
+def _text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def _make_images(rng, count):
+    """Несколько разных картинок в хранилище постов: [(имя, ширина)]."""
+    storage = Post._meta.get_field('image').storage
+    images = []
+    for number in range(count):
+        color = tuple(rng.randrange(256) for _ in range(3))
+        width = rng.choice((800, 1200, 1600, 2400))
+        image = Image.linear_gradient('L').resize((width, width * 3 // 4)) \
+            .convert('RGB')
+        image.paste(color, (0, 0, width // 2, width // 4))
+        source = io.BytesIO()
+        image.save(source, 'JPEG', quality=90)
+        source.seek(0)
+        data, extension = normalize(source)
+        name = storage.save(f'posts/seed-{number}.{extension}',
+                            ContentFile(data))
+        images.append((name, Image.open(io.BytesIO(data)).width))
+    return images
+
+
+class Command(BaseCommand):
+    help = ('Наполняет базу синтетическим сообществом: пользователи, группы, '
+            'посты с распределением по степенному закону, комментарии, '
+            'подписки и картинки')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--posts', type=int, default=None,
+                            help='по умолчанию 10 на пользователя')
+        parser.add_argument('--comments', type=float, default=3,
+                            help='в среднем на пост')
+        parser.add_argument('--follows', type=float, default=20,
+                            help='в среднем на пользователя')
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument('--images', type=int, default=10,
+                            help='разных картинок')
+        parser.add_argument('--image-ratio', type=float, default=0.3,
+                            help='доля постов с картинкой')
+        parser.add_argument('--alpha', type=float, default=1.1,
+                            help='показатель степенного закона')
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--prefix', default='seed')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def records(self, rng, options, image_names):
+        """Записи для Importer в порядке, в котором ссылки уже известны."""
+        prefix = options['prefix']
+        users = [f'{prefix}{number}' for number in range(options['users'])]
+        groups = [f'{prefix}-group-{number}'
+                  for number in range(options['groups'])]
+        # порядок в списке — ранг популярности: у первых больше постов,
+        # подписчиков и комментариев
+        popularity = _weights(len(users), options['alpha'])
+        post_count = options['posts']
+        if post_count is None:
+            post_count = len(users) * 10
+        now = timezone.now()
+        for username in users:
+            yield {'type': 'user', 'username': username,
+                   'first_name': username.capitalize()}
+        for slug in groups:
+            yield {'type': 'group', 'slug': slug, 'title': slug.title(),
+                   'description': _text(rng, 12)}
+        for number in range(post_count):
+            record = {
+                'type': 'post', 'id': number,
+                'author': rng.choices(users, cum_weights=popularity)[0],
+                'text': _text(rng, rng.randint(5, 60)),
+                'pub_date': (now - timedelta(
+                    seconds=rng.randrange(options['days'] * 86400)
+                )).isoformat(),
+            }
+            if groups and rng.random() < 0.7:
+                record['group'] = rng.choice(groups)
+            if image_names and rng.random() < options['image_ratio']:
+                record['image'] = rng.choice(image_names)
+            yield record
+        if post_count:
+            post_popularity = _weights(post_count, options['alpha'])
+            for _ in range(int(post_count * options['comments'])):
+                yield {
+                    'type': 'comment',
+                    'post': rng.choices(range(post_count),
+                                        cum_weights=post_popularity)[0],
+                    'author': rng.choice(users),
+                    'text': _text(rng, rng.randint(2, 20)),
+                }
+        for username in users:
+            follows = min(round(rng.expovariate(1 / options['follows'])),
+                          len(users) - 1) if options['follows'] else 0
+            # dict, а не set: порядок не зависит от хэшей, --seed повторяем
+            for author in dict.fromkeys(rng.choices(
+                    users, cum_weights=popularity, k=follows)):
+                if author != username:
+                    yield {'type': 'follow', 'user': username,
+                           'author': author}
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        started = time.perf_counter()
+        images = _make_images(rng, options['images'])
+        importer = Importer(batch_size=options['batch_size'])
+        image_names = [name for name, _ in images]
+        importer.run(json.dumps(record, ensure_ascii=False)
+                     for record in self.records(rng, options, image_names))
+        # картинки повторяются, так что миниатюр немного
+        for name, width in images:
+            thumbnails.generate(name, width)
+        for number, message in importer.errors[:20]:
+            self.stderr.write(f'строка {number}: {message}')
+        created = ', '.join(f'{kind}: {total}'
+                            for kind, total in importer.created.items())
+        self.stdout.write(f'Создано — {created} за '
+                          f'{time.perf_counter() - started:.1f} с')
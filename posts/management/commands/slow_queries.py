@@ -0,0 +1,76 @@
+import json
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Fingerprint:
+    def __init__(self, record):
+        self.normalized = record['normalized']
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.call_sites = Counter()
+        self.plan = None
+
+    def add(self, record):
+        # пропущенные ограничением частоты учтены в suppressed
+        self.count += 1 + record.get('suppressed', 0)
+        self.total_ms += record['duration_ms'] + \
+            record.get('suppressed_ms', 0)
+        self.max_ms = max(self.max_ms, record['duration_ms'])
+        self.call_sites[record.get('call_site') or '?'] += 1
+        self.plan = record.get('plan') or self.plan
+
+
+class Command(BaseCommand):
+    help = ('Сводка журнала медленных запросов: отпечатки по суммарному '
+            'времени')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--log', default=None,
+                            help='журнал, по умолчанию SLOW_QUERY_LOG')
+        parser.add_argument('--top', type=int, default=10)
+        parser.add_argument('--plans', action='store_true',
+                            help='показать последний план запроса')
+
+    def read(self, path):
+        fingerprints, broken = {}, 0
+        try:
+            with open(path, encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                        key = record['fingerprint']
+                        if key not in fingerprints:
+                            fingerprints[key] = Fingerprint(record)
+                        fingerprints[key].add(record)
+                    except (ValueError, KeyError, TypeError):
+                        broken += 1
+        except FileNotFoundError:
+            raise CommandError(f'Нет журнала {path}: включите SLOW_QUERY_MS')
+        return fingerprints, broken
+
+    def handle(self, *args, **options):
+        path = options['log'] or settings.SLOW_QUERY_LOG
+        fingerprints, broken = self.read(path)
+        if broken:
+            self.stderr.write(f'Пропущено нечитаемых строк: {broken}')
+        top = sorted(fingerprints.items(), key=lambda item: -item[1].total_ms)
+        for rank, (key, stats) in enumerate(top[:options['top']], 1):
+            sites = ', '.join(f'{site} ×{count}' for site, count
+                              in stats.call_sites.most_common(3))
+            self.stdout.write(
+                f'{rank}. {key}: всего {stats.total_ms:.1f} мс, '
+                f'запросов {stats.count}, в среднем '
+                f'{stats.total_ms / stats.count:.1f} мс, '
+                f'максимум {stats.max_ms:.1f} мс\n'
+                f'   откуда: {sites}\n'
+                f'   {stats.normalized[:300]}'
+            )
+            if options['plans'] and stats.plan:
+                for step in stats.plan:
+                    self.stdout.write(f'   | {step}')
+        if not fingerprints:
+            self.stdout.write('Медленных запросов нет')
@@ -0,0 +1,35 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from posts import thumbnails
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = ('Показывает для каждого варианта миниатюр, сколько места они '
+            'занимают и сколько ещё не создано')
+
+    def handle(self, *args, **options):
+        rows = Post.objects.exclude(image='').exclude(image__isnull=True) \
+            .order_by('pk').values_list('image', 'image_width').iterator()
+        expected, ready, size = Counter(), Counter(), Counter()
+        for image, image_width in rows:
+            for width, geometry, spec in thumbnails.specs_for(image_width):
+                expected[width] += 1
+                file = thumbnails.thumbnail_file(image, geometry, spec)
+                if file.storage.exists(file.name):
+                    ready[width] += 1
+                    size[width] += file.storage.size(file.name)
+        self.stdout.write(f'{"ширина":>7} {"создано":>8} {"очередь":>8} '
+                          f'{"объём, КБ":>10} {"в среднем, КБ":>14}')
+        for width in thumbnails.CARD_WIDTHS:
+            average = size[width] / ready[width] if ready[width] else 0
+            self.stdout.write(
+                f'{width:>7} {ready[width]:>8} '
+                f'{expected[width] - ready[width]:>8} '
+                f'{size[width] // 1024:>10} {average / 1024:>14.1f}')
+        self.stdout.write(
+            f'Всего: {sum(ready.values())} миниатюр, '
+            f'{sum(size.values()) // 1024} КБ, '
+            f'не создано: {sum(expected.values()) - sum(ready.values())}')
@@ -0,0 +1,30 @@
+# Generated by Django 2.2.6 on 2026-10-18 20:45
+
+from django.db import migrations
+
+CREATE_INDEX = """
+CREATE VIRTUAL TABLE posts_post_fts USING fts5(
+    text, group_title, author_username,
+    tokenize = 'unicode61 remove_diacritics 2'
+)
+"""
+
+FILL_INDEX = """
+INSERT INTO posts_post_fts (rowid, text, group_title, author_username)
+SELECT post.id, post.text, COALESCE(grp.title, ''), author.username
+FROM posts_post AS post
+JOIN auth_user AS author ON author.id = post.author_id
+LEFT JOIN posts_group AS grp ON grp.id = post.group_id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_media_blobs'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_INDEX, 'DROP TABLE posts_post_fts'),
+        migrations.RunSQL(FILL_INDEX, migrations.RunSQL.noop),
+    ]
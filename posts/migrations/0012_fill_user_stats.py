@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count
+
+COUNTERS = (
+    ('posts', 'Post', 'author_id'),
+    ('followers', 'Follow', 'author_id'),
+    ('following', 'Follow', 'user_id'),
+    ('comments', 'Comment', 'author_id'),
+)
+
+
+def fill_user_stats(apps, schema_editor):
+    # без строк счётчики создавал бы первый просмотр профиля после
+    # выкладки, и одновременные просмотры спорили бы за первичный ключ
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    UserStats = apps.get_model('posts', 'UserStats')
+    user_ids = list(User.objects.filter(stats=None)
+                    .values_list('pk', flat=True))
+    for start in range(0, len(user_ids), 500):
+        batch = user_ids[start:start + 500]
+        counts = {user_id: {name: 0 for name, *_ in COUNTERS}
+                  for user_id in batch}
+        for name, model, field in COUNTERS:
+            rows = apps.get_model('posts', model).objects \
+                .filter(**{f'{field}__in': batch}) \
+                .values(field).annotate(total=Count('pk')) \
+                .values_list(field, 'total')
+            for user_id, total in rows:
+                counts[user_id][name] = total
+        UserStats.objects.bulk_create(
+            [UserStats(user_id=user_id, **values)
+             for user_id, values in counts.items()],
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0011_post_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_user_stats, migrations.RunPython.noop),
+    ]
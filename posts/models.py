@@ -1,6 +1,8 @@
 from django.contrib.auth import get_user_model
 from django.db import models
 
+from .storage import ContentAddressedStorage
+
 User = get_user_model()
 
 
@@ -24,7 +26,25 @@ class Post(models.Model):
         blank=True, null=True,
         related_name='group_posts'
     )
-    image = models.ImageField(upload_to='posts/', blank=True, null=True)
+    image = models.ImageField(upload_to='posts/', blank=True, null=True,
+                              storage=ContentAddressedStorage())
+    # заполняются при сохранении картинки (сигнал pre_save), а не через
+    # width_field/height_field: те открывают файл при каждой загрузке
+    # поста из базы, пока размеры не известны
+    image_width = models.PositiveIntegerField(null=True, editable=False)
+    image_height = models.PositiveIntegerField(null=True, editable=False)
+    image_color = models.CharField(max_length=7, blank=True, editable=False)
+    image_hash = models.CharField(max_length=64, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['pub_date'],
+                         name='posts_post_pub_date_idx'),
+            models.Index(fields=['author', 'pub_date'],
+                         name='posts_post_author_date_idx'),
+            models.Index(fields=['group', 'pub_date'],
+                         name='posts_post_group_date_idx'),
+        ]
 
     def __str__(self):
         return self.text
@@ -40,15 +60,76 @@ class Comment(models.Model):
     text = models.TextField()
     created = models.DateTimeField('time of created', auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'created'],
+                         name='posts_comment_post_date_idx'),
+        ]
+
 
 class Follow(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE,
                              related_name='follower')
     author = models.ForeignKey(User, on_delete=models.CASCADE,
                                related_name='following')
+    # посты автора не раскладываются по лентам подписчиков,
+    # а подтягиваются при чтении (авторы с огромной аудиторией)
+    pull = models.BooleanField(default=False)
 
     class Meta:
         unique_together = ('user', 'author')
+        indexes = [
+            models.Index(fields=['author', 'user'],
+                         name='posts_follow_author_user_idx'),
+        ]
 
     def __str__(self):
         return f'user: {self.user.username} author: {self.author.username}'
+
+
+class TimelineEntry(models.Model):
+    """Материализованная лента подписок: строка на пару (читатель, пост)."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name='timeline')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE,
+                             related_name='timeline')
+    author = models.ForeignKey(User, on_delete=models.CASCADE,
+                               related_name='+')
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'post')
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-post'],
+                         name='posts_timeline_feed_idx'),
+        ]
+
+
+class UserStats(models.Model):
+    """Денормализованные счётчики профиля, обновляются сигналами."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE,
+                                primary_key=True, related_name='stats')
+    posts = models.PositiveIntegerField(default=0)
+    followers = models.PositiveIntegerField(default=0)
+    following = models.PositiveIntegerField(default=0)
+    comments = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'stats: {self.user_id}'
+
+
+class MediaBlob(models.Model):
+    """Файл в хранилище по содержимому и число постов, ссылающихся на него."""
+    name = models.CharField(max_length=100, primary_key=True)
+    refs = models.IntegerField(default=0)
+    # когда счётчик менялся в последний раз; сборщик ждёт после обнуления
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['refs', 'updated'],
+                         name='posts_mediablob_gc_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name}: {self.refs}'
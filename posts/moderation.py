@@ -0,0 +1,84 @@
+from django.db import connection, transaction
+from django.db.models import Count, F
+
+from . import caching, search, stats
+from .models import Comment, MediaBlob, Post, TimelineEntry
+
+
+def _rebuild_stats(user_ids):
+    user_ids = list(user_ids)
+    # не упираемся в лимит переменных SQLite
+    for start in range(0, len(user_ids), 500):
+        stats.rebuild(user_ids[start:start + 500])
+
+
+def _scopes(posts):
+    rows = posts.order_by().values_list('author__username', 'group__slug') \
+        .distinct()
+    scopes = {'global'}
+    for username, slug in rows:
+        scopes.add(f'author:{username}')
+        if slug:
+            scopes.add(f'group:{slug}')
+    return scopes
+
+
+def delete_posts(queryset):
+    """
+    Удаляет посты несколькими DELETE ... WHERE, без загрузки объектов.
+
+    Сигналы при этом не срабатывают, поэтому то, что они поддерживают,
+    обновляется здесь же пачками: индекс поиска, счётчики ссылок
+    на картинки, счётчики профилей и версии кэша (лент, а также
+    самих постов: /api/v1/posts/<id>/ зависит только от версии поста).
+    """
+    posts = Post.objects.filter(pk__in=queryset.values('pk'))
+    comments = Comment.objects.filter(post__in=posts.values('pk'))
+    with transaction.atomic():
+        users = set(posts.values_list('author_id', flat=True).distinct())
+        users |= set(comments.values_list('author_id', flat=True).distinct())
+        images = posts.exclude(image='').exclude(image__isnull=True) \
+            .order_by().values('image').annotate(total=Count('pk')) \
+            .values_list('image', 'total')
+        for name, total in images:
+            MediaBlob.objects.filter(name=name).update(refs=F('refs') - total)
+        scopes = _scopes(posts)
+        post_ids = list(posts.values_list('pk', flat=True))
+        subquery, params = posts.values('pk').query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {search.FTS_TABLE} '
+                           f'WHERE rowid IN ({subquery})', params)
+        TimelineEntry.objects.filter(post__in=posts.values('pk')).delete()
+        comments._raw_delete(comments.db)
+        deleted = posts._raw_delete(posts.db)
+        _rebuild_stats(users)
+    caching.bump(*scopes, *(f'post:{pk}' for pk in post_ids))
+    return deleted
+
+
+def remove_from_group(queryset):
+    """Убирает посты из групп одним UPDATE."""
+    selected = Post.objects.filter(pk__in=queryset.values('pk'))
+    posts = selected.exclude(group=None)
+    with transaction.atomic():
+        scopes = _scopes(posts)
+        post_ids = list(posts.values_list('pk', flat=True))
+        updated = posts.update(group=None)
+        subquery, params = selected.values('pk').query.sql_with_params()
+        search.reindex_where(f'post.id IN ({subquery})', params)
+    # в карточке выводится группа, её ключ зависит от версии поста
+    caching.bump(*scopes, *(f'post:{pk}' for pk in post_ids))
+    return updated
+
+
+def delete_comments(queryset):
+    """Удаляет комментарии одним DELETE и пересчитывает затронутое."""
+    comments = Comment.objects.filter(pk__in=queryset.values('pk'))
+    with transaction.atomic():
+        users = set(comments.values_list('author_id', flat=True).distinct())
+        post_ids = set(comments.values_list('post_id', flat=True).distinct())
+        deleted = comments._raw_delete(comments.db)
+        _rebuild_stats(users)
+    # счётчик комментариев в карточке зависит от версии поста
+    caching.bump(*(f'post:{pk}' for pk in post_ids))
+    return deleted
@@ -0,0 +1,182 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Max, Q
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorPage:
+    is_cursor = True
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return '<CursorPage of %s objects>' % len(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if not self._has_next or not self.object_list:
+            return None
+        return self.paginator.encode_cursor(self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        if not self._has_previous or not self.object_list:
+            return None
+        return self.paginator.encode_cursor(self.object_list[0])
+
+
+class CursorPaginator:
+    """
+    Keyset-пагинация по упорядоченному набору полей.
+
+    Страница выбирается условием по ключу последней (первой) записи
+    предыдущей страницы, поэтому глубина не влияет на стоимость запроса,
+    а COUNT(*) не выполняется вовсе.
+    """
+
+    def __init__(self, object_list, per_page, ordering=('-pub_date', '-pk')):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.fields = [name.lstrip('-') for name in self.ordering]
+        self.descending = [name.startswith('-') for name in self.ordering]
+
+    def _model_field(self, name):
+        annotation = self.object_list.query.annotations.get(name)
+        if annotation is not None:
+            return annotation.output_field
+        opts = self.object_list.model._meta
+        return opts.pk if name == 'pk' else opts.get_field(name)
+
+    def encode_cursor(self, obj):
+        values = []
+        for name in self.fields:
+            # строки из .values() — словари
+            value = obj[name] if isinstance(obj, dict) else getattr(obj, name)
+            if hasattr(value, 'isoformat'):
+                value = value.isoformat()
+            values.append(value)
+        raw = json.dumps(values, separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def decode_cursor(self, token):
+        try:
+            padded = token + '=' * (-len(token) % 4)
+            values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        except (ValueError, TypeError, binascii.Error):
+            raise InvalidCursor(token)
+        if not isinstance(values, list) or len(values) != len(self.fields):
+            raise InvalidCursor(token)
+        # null нельзя сравнивать в _seek, списки и словари — не ключи
+        if not all(isinstance(value, (str, int, float))
+                   and not isinstance(value, bool) for value in values):
+            raise InvalidCursor(token)
+        try:
+            decoded = [self._model_field(name).to_python(value)
+                       for name, value in zip(self.fields, values)]
+        except (ValidationError, TypeError, ValueError):
+            raise InvalidCursor(token)
+        if None in decoded:
+            raise InvalidCursor(token)
+        return decoded
+
+    def _seek(self, values, forward):
+        condition = Q()
+        for i, name in enumerate(self.fields):
+            # «дальше» по направлению сортировки — меньше для убывающих полей
+            lookup = 'lt' if self.descending[i] == forward else 'gt'
+            branch = Q(**{f'{name}__{lookup}': values[i]})
+            for prev_name, prev_value in zip(self.fields[:i], values[:i]):
+                branch &= Q(**{prev_name: prev_value})
+            condition |= branch
+        return condition
+
+    def _reversed_ordering(self):
+        return [name[1:] if name.startswith('-') else f'-{name}'
+                for name in self.ordering]
+
+    def page(self, after=None, before=None):
+        queryset = self.object_list.order_by(*self.ordering)
+        if before:
+            values = self.decode_cursor(before)
+            rows = list(queryset.filter(self._seek(values, forward=False))
+                        .order_by(*self._reversed_ordering())
+                        [:self.per_page + 1])
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            return CursorPage(rows, self, has_next=True,
+                              has_previous=has_previous)
+        if after:
+            values = self.decode_cursor(after)
+            queryset = queryset.filter(self._seek(values, forward=True))
+        rows = list(queryset[:self.per_page + 1])
+        has_next = len(rows) > self.per_page
+        return CursorPage(rows[:self.per_page], self, has_next=has_next,
+                          has_previous=bool(after))
+
+    def get_page(self, after=None, before=None):
+        try:
+            return self.page(after=after, before=before)
+        except InvalidCursor:
+            return self.page()
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор для больших таблиц: без точного COUNT(*).
+
+    Для всей таблицы число строк оценивается по максимальному id — это
+    верхняя граница (удалённые строки дают пустые последние страницы),
+    поэтому Django не примет большую таблицу за одну страницу без LIMIT.
+    Статистика ANALYZE (sqlite_stat1) сама не обновляется и не годится.
+    Выборку с фильтрами считаем точно, но не дальше COUNT_LIMIT строк.
+    """
+    COUNT_LIMIT = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if queryset.query.where:
+            return queryset.order_by()[:self.COUNT_LIMIT].count()
+        return queryset.aggregate(last=Max('pk'))['last'] or 0
+
+
+def paginate(request, object_list, per_page, ordering=('-pub_date', '-pk')):
+    after = request.GET.get('after')
+    before = request.GET.get('before')
+    if after or before or settings.FEED_PAGINATION == 'cursor':
+        paginator = CursorPaginator(object_list, per_page, ordering)
+        return paginator.get_page(after=after, before=before), paginator
+    paginator = Paginator(object_list, per_page)
+    return paginator.get_page(request.GET.get('page', 1)), paginator
@@ -0,0 +1,113 @@
+import re
+
+from django.db import connection
+from django.db.models import Count
+
+from .models import Group, Post, User
+
+FTS_TABLE = 'posts_post_fts'
+TOKEN_RE = re.compile(r'\w+')
+
+_SELECT = f"""
+    SELECT post.id, post.text, COALESCE(grp.title, ''), author.username
+    FROM {Post._meta.db_table} AS post
+    JOIN {User._meta.db_table} AS author ON author.id = post.author_id
+    LEFT JOIN {Group._meta.db_table} AS grp ON grp.id = post.group_id
+"""
+
+
+def match_expression(query):
+    """
+    Запрос пользователя в синтаксисе FTS5: все слова обязательны,
+    последнее ищется по префиксу. Операторы FTS5 из ввода не проходят.
+    """
+    tokens = TOKEN_RE.findall(query)
+    if not tokens:
+        return None
+    terms = [f'"{token}"' for token in tokens]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def reindex_where(where, params):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid IN '
+            f'(SELECT id FROM {Post._meta.db_table} AS post WHERE {where})',
+            params,
+        )
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, text, group_title, '
+            f'author_username) {_SELECT} WHERE {where}',
+            params,
+        )
+
+
+def index_post(post_id):
+    reindex_where('post.id = %s', [post_id])
+
+
+def index_group(group_id):
+    reindex_where('post.group_id = %s', [group_id])
+
+
+def index_author(user_id, username):
+    """Переиндексирует посты автора, если в индексе старое имя."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT author_username FROM {FTS_TABLE} WHERE rowid = '
+            f'(SELECT id FROM {Post._meta.db_table} WHERE author_id = %s '
+            f'LIMIT 1)',
+            [user_id],
+        )
+        row = cursor.fetchone()
+    if row is not None and row[0] != username:
+        reindex_where('post.author_id = %s', [user_id])
+
+
+def remove_post(post_id):
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                       [post_id])
+
+
+def rebuild():
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, text, group_title, '
+            f'author_username) {_SELECT}'
+        )
+        return cursor.rowcount
+
+
+def search(query, queryset=None):
+    """
+    Посты, подходящие под запрос; порядок и пагинацию задаёт вызывающий.
+
+    Текст, название группы и имя автора индексируются вместе, поэтому
+    «котики» находит и посты из группы «Котики».
+    """
+    if queryset is None:
+        queryset = Post.objects.all()
+    expression = match_expression(query)
+    if expression is None:
+        return queryset.none()
+    # RawSQL в id__in получил бы вторые скобки, и SQLite сравнивал бы
+    # только с первой строкой подзапроса
+    return queryset.extra(
+        where=[f'"{Post._meta.db_table}"."id" IN (SELECT rowid FROM '
+               f'{FTS_TABLE} WHERE {FTS_TABLE} MATCH %s)'],
+        params=[expression],
+    )
+
+
+def facets(queryset, limit=5):
+    """Самые частые группы и авторы среди найденного."""
+    queryset = queryset.order_by()
+    groups = queryset.exclude(group=None) \
+        .values('group__slug', 'group__title') \
+        .annotate(total=Count('id')).order_by('-total')[:limit]
+    authors = queryset.values('author__username') \
+        .annotate(total=Count('id')).order_by('-total')[:limit]
+    return {'groups': list(groups), 'authors': list(authors)}
@@ -0,0 +1,153 @@
+from django.core.exceptions import SuspiciousFileOperation
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from . import (blobs, caching, images, search, stats, thumbnails,
+               timeline)
+from .models import Comment, Follow, Group, Post, User
+
+
+def bump_post_caches(post_id, *extra):
+    row = Post.objects.filter(pk=post_id) \
+        .values_list('author__username', 'group__slug').first()
+    if row is not None:
+        caching.bump(*caching.post_scopes(*row, post_id), *extra)
+
+
+def author_scopes(*user_ids):
+    # по id, а не instance.author: связанный объект не загружается
+    return [f'author:{username}' for username in User.objects
+            .filter(pk__in=user_ids).values_list('username', flat=True)]
+
+
+@receiver(pre_save, sender=Post)
+def post_saving(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if instance.pk:
+        # при переносе в другую группу сбросить нужно и старую
+        instance._old_group_slug, instance._old_image = \
+            Post.objects.filter(pk=instance.pk) \
+            .values_list('group__slug', 'image').first() or (None, None)
+    fill_image_meta(instance)
+
+
+def fill_image_meta(instance):
+    image = instance.image
+    if (image and instance.image_hash
+            and image.name == getattr(instance, '_old_image', None)):
+        return
+    instance.image_width = instance.image_height = None
+    instance.image_color = instance.image_hash = ''
+    if not image:
+        return
+    try:
+        image.open('rb')
+        try:
+            meta = images.describe(image)
+        finally:
+            # несохранённый файл ещё будет записан в хранилище
+            if image._committed:
+                image.close()
+            else:
+                image.seek(0)
+    except (OSError, SuspiciousFileOperation):
+        # файла нет или это не картинка: пост показывается без размеров
+        return
+    for name, value in meta.items():
+        setattr(instance, name, value)
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        stats.bump(instance.author_id, posts=1)
+        timeline.fan_out(instance)
+    old_image = None if created else getattr(instance, '_old_image', None)
+    if instance.image.name != old_image:
+        blobs.replace(old_image, instance.image.name)
+        thumbnails.enqueue(instance.image, instance.image_width)
+    search.index_post(instance.pk)
+    old_group_slug = getattr(instance, '_old_group_slug', None)
+    bump_post_caches(instance.pk,
+                     *([f'group:{old_group_slug}'] if old_group_slug else []))
+
+
+@receiver(pre_delete, sender=Post)
+def post_deleting(sender, instance, **kwargs):
+    # при каскадном удалении группы или автора их строк к post_delete
+    # может уже не быть: области кэша находим заранее
+    row = Post.objects.filter(pk=instance.pk) \
+        .values_list('author__username', 'group__slug').first()
+    instance._deleted_scopes = caching.post_scopes(*row, instance.pk) \
+        if row else ['global', f'post:{instance.pk}']
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    stats.bump(instance.author_id, posts=-1)
+    blobs.release(instance.image.name)
+    search.remove_post(instance.pk)
+    caching.bump(*instance._deleted_scopes)
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        caching.bump('groups', f'group:{instance.slug}')
+        if not created:
+            search.index_group(instance.pk)
+
+
+@receiver(post_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    caching.bump('groups', f'group:{instance.slug}')
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, raw=False, update_fields=None,
+               **kwargs):
+    # вход в систему сохраняет только last_login
+    if raw or created or (update_fields and 'username' not in update_fields):
+        return
+    search.index_author(instance.pk, instance.username)
+
+
+@receiver(post_save, sender=Follow)
+def follow_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        stats.bump(instance.author_id, followers=1)
+        stats.bump(instance.user_id, following=1)
+        timeline.add_follow(instance)
+        caching.bump(*author_scopes(instance.author_id, instance.user_id))
+
+
+@receiver(pre_delete, sender=Follow)
+def follow_deleting(sender, instance, **kwargs):
+    # см. post_deleting: при удалении пользователя каскадом
+    instance._deleted_scopes = author_scopes(instance.author_id,
+                                             instance.user_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    stats.bump(instance.author_id, followers=-1)
+    stats.bump(instance.user_id, following=-1)
+    timeline.remove_follow(instance)
+    caching.bump(*instance._deleted_scopes)
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        stats.bump(instance.author_id, comments=1)
+        bump_post_caches(instance.post_id)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    stats.bump(instance.author_id, comments=-1)
+    bump_post_caches(instance.post_id)
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.template.base import Template
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+_TEMPLATE_RENDER = Template.render.__code__
+# обёртки запросов: место вызова — то, что выше них
+_INSTRUMENTATION = {os.path.join(settings.BASE_DIR, path) for path in (
+    'posts/slow_queries.py', 'posts/budgets.py', 'yatube/metrics.py')}
+_NORMALIZE = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'%s|\b\d+(?:\.\d+)?\b'), '?'),
+    # IN (?, ?, ?) с любым числом значений — один отпечаток
+    (re.compile(r'\(\?(?:\s*,\s*\?)*\)'), '(...)'),
+    (re.compile(r'\s+'), ' '),
+]
+MAX_PARAMS = 20
+MAX_PARAM_LENGTH = 100
+
+_lock = threading.Lock()
+# отпечаток -> [когда записан, пропущено, их время в мс]
+_recent = {}
+
+
+def normalize(sql):
+    """SQL без значений: одинаков для запросов, различающихся параметрами."""
+    for pattern, replacement in _NORMALIZE:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def fingerprint(sql):
+    return hashlib.md5(normalize(sql).encode()).hexdigest()[:12]
+
+
+def call_site():
+    """
+    Ближайший к запросу шаблон или функция проекта:
+    'includes/post_item.html' или 'posts/views.py:profile'.
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        code = frame.f_code
+        if code is _TEMPLATE_RENDER:
+            origin = frame.f_locals['self'].origin
+            return origin.template_name or origin.name
+        filename = code.co_filename
+        if (filename.startswith(settings.BASE_DIR)
+                and 'site-packages' not in filename
+                and filename not in _INSTRUMENTATION):
+            path = os.path.relpath(filename, settings.BASE_DIR)
+            return f'{path}:{code.co_name}'
+        frame = frame.f_back
+    return None
+
+
+def explain(connection, sql, params):
+    """План запроса; курсор отдельный, чтобы не сбить выборку запроса."""
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' \
+        else 'EXPLAIN '
+    cursor = connection.create_cursor()
+    try:
+        cursor.execute(prefix + sql, params)
+        return [str(row[-1]) for row in cursor.fetchall()]
+    except DatabaseError as error:
+        return [f'EXPLAIN не удался: {error}']
+    finally:
+        cursor.close()
+
+
+def _params(params):
+    if not isinstance(params, (list, tuple)):
+        return str(params)[:MAX_PARAM_LENGTH]
+    return [str(value)[:MAX_PARAM_LENGTH] for value in params[:MAX_PARAMS]]
+
+
+def report(connection, sql, params, many, duration):
+    key = fingerprint(sql)
+    now = time.monotonic()
+    with _lock:
+        last, skipped, skipped_ms = _recent.get(key, (None, 0, 0.0))
+        if last is not None and now - last < settings.SLOW_QUERY_INTERVAL:
+            _recent[key] = (last, skipped + 1, skipped_ms + duration)
+            return
+        _recent[key] = (now, 0, 0.0)
+    select = sql.lstrip()[:6].upper() in ('SELECT', 'WITH')
+    logger.warning(json.dumps({
+        'time': timezone.now().isoformat(),
+        'fingerprint': key,
+        'duration_ms': round(duration, 3),
+        'sql': sql,
+        'params': None if many else _params(params),
+        'normalized': normalize(sql),
+        'call_site': call_site(),
+        'plan': explain(connection, sql, params)
+        if select and not many else None,
+        # с прошлой записи этого отпечатка: итоги в журнале точные,
+        # хотя EXPLAIN и стек снимаются не для каждого запроса
+        'suppressed': skipped,
+        'suppressed_ms': round(skipped_ms, 3),
+    }, ensure_ascii=False))
+
+
+def log_slow_queries(execute, sql, params, many, context):
+    """Обёртка connection.execute_wrapper: пишет запросы дольше порога."""
+    started = time.perf_counter()
+    result = execute(sql, params, many, context)
+    duration = (time.perf_counter() - started) * 1000
+    if settings.SLOW_QUERY_MS is not None \
+            and duration >= settings.SLOW_QUERY_MS:
+        report(context['connection'], sql, params, many, duration)
+    return result
+
+
+def install(sender, connection, **kwargs):
+    """Приёмник connection_created: включает журнал при SLOW_QUERY_MS."""
+    if settings.SLOW_QUERY_MS is not None \
+            and log_slow_queries not in connection.execute_wrappers:
+        # список обёрток живёт дольше соединения: при переподключении
+        # приёмник вызывается снова
+        connection.execute_wrappers.append(log_slow_queries)
@@ -0,0 +1,59 @@
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import Comment, Follow, Post, UserStats
+
+COUNTERS = (
+    ('posts', Post, 'author_id'),
+    ('followers', Follow, 'author_id'),
+    ('following', Follow, 'user_id'),
+    ('comments', Comment, 'author_id'),
+)
+
+
+def count_for(user_ids):
+    counts = {user_id: {name: 0 for name, *_ in COUNTERS}
+              for user_id in user_ids}
+    for name, model, field in COUNTERS:
+        rows = model.objects.filter(**{f'{field}__in': user_ids}) \
+            .values(field).annotate(total=Count('pk')) \
+            .values_list(field, 'total')
+        for user_id, total in rows:
+            counts[user_id][name] = total
+    return counts
+
+
+def rebuild(user_ids):
+    """Пересчитывает счётчики, возвращает число исправленных записей."""
+    user_ids = list(user_ids)
+    counts = count_for(user_ids)
+    existing = UserStats.objects.in_bulk(user_ids)
+    missing = [UserStats(user_id=user_id, **values)
+               for user_id, values in counts.items()
+               if user_id not in existing]
+    fixed = len(missing)
+    with transaction.atomic():
+        # строку мог только что создать параллельный запрос того же
+        # профиля: его счётчики такие же
+        UserStats.objects.bulk_create(missing, ignore_conflicts=True)
+        for user_id, stats in existing.items():
+            values = counts[user_id]
+            if any(getattr(stats, k) != v for k, v in values.items()):
+                UserStats.objects.filter(pk=user_id).update(**values)
+                fixed += 1
+    return fixed
+
+
+def bump(user_id, **deltas):
+    # отсутствующая строка будет посчитана целиком при первом чтении
+    UserStats.objects.filter(pk=user_id).update(
+        **{name: F(name) + delta for name, delta in deltas.items()}
+    )
+
+
+def get_stats(user):
+    try:
+        return user.stats
+    except UserStats.DoesNotExist:
+        rebuild([user.pk])
+        return UserStats.objects.get(pk=user.pk)
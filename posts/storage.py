@@ -0,0 +1,52 @@
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Хранит файл под именем из sha256 его содержимого.
+
+    Одинаковые загрузки попадают в один файл, поэтому и миниатюры sorl
+    у них общие. Существующий файл не перезаписывается. Ссылки на файлы
+    считает `posts.blobs`, он же удаляет ненужные.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # имя задаёт содержимое, суффиксы от совпадений не нужны
+        return name
+
+    def _save(self, name, content):
+        directory, basename = os.path.split(name)
+        extension = os.path.splitext(basename)[1].lower()
+        os.makedirs(self.path(directory or '.'), exist_ok=True)
+        digest = hashlib.sha256()
+        # хэш считаем при записи во временный файл рядом с итоговым,
+        # чтобы потом переименовать его без копирования
+        handle, temp_path = tempfile.mkstemp(dir=self.path(directory or '.'),
+                                             prefix='.upload-')
+        try:
+            with os.fdopen(handle, 'wb') as temp:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temp.write(chunk)
+            hexdigest = digest.hexdigest()
+            name = os.path.join(directory, hexdigest[:2], hexdigest[2:4],
+                                hexdigest + extension)
+            full_path = self.path(name)
+            if os.path.exists(full_path):
+                # свежая отметка не даст сборщику удалить файл прямо сейчас
+                os.utime(full_path)
+                return name.replace('\\', '/')
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            os.chmod(temp_path, self.file_permissions_mode or 0o644)
+            os.replace(temp_path, full_path)
+            temp_path = None
+        finally:
+            if temp_path is not None:
+                os.remove(temp_path)
+        return name.replace('\\', '/')
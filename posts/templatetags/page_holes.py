@@ -0,0 +1,28 @@
+from django import template
+
+from posts.caching import hole_marker, render_hole
+from posts.forms import CommentForm
+from posts.models import Follow
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def hole(context, template_name, **params):
+    request = context.get('request')
+    if getattr(request, 'skeleton', False):
+        return hole_marker(template_name, params)
+    return render_hole(template_name, params, request)
+
+
+@register.simple_tag(takes_context=True)
+def is_following(context, author_id):
+    user = context.get('user')
+    if user is None or not user.is_authenticated:
+        return False
+    return Follow.objects.filter(user=user, author_id=author_id).exists()
+
+
+@register.simple_tag
+def comment_form():
+    return CommentForm()
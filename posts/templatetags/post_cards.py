@@ -0,0 +1,55 @@
+import logging
+
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.safestring import mark_safe
+from sorl.thumbnail.conf import settings as sorl_settings
+
+from posts import thumbnails
+from posts.caching import fill_holes
+
+logger = logging.getLogger(__name__)
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def post_card(context, post):
+    request = context.get('request')
+    skeleton = getattr(request, 'skeleton', False)
+    html = getattr(post, 'cached_card', None)
+    if html is None:
+        card = context.template.engine.get_template(
+            'includes/post_item.html')
+        # карточка общая для всех, личные части остаются метками
+        request.skeleton = True
+        try:
+            html = card.render(context.new({'post': post,
+                                            'request': request}))
+        finally:
+            request.skeleton = skeleton
+        if hasattr(post, 'card_key'):
+            cache.set(post.card_key, str(html), settings.FEED_CACHE_TIMEOUT)
+    if not skeleton:
+        html = fill_holes(html, request)
+    return mark_safe(html)
+
+
+@register.inclusion_tag('includes/card_image.html')
+def card_image(post):
+    """Картинка карточки с набором ширин в srcset."""
+    try:
+        variants = thumbnails.card_variants(post.image, post.image_width)
+    except Exception:
+        # как {% thumbnail %}: битая картинка не роняет страницу
+        if sorl_settings.THUMBNAIL_DEBUG:
+            raise
+        logger.exception('Не удалось получить миниатюры для %s', post.image)
+        return {'image': None}
+    base = dict(variants)[thumbnails.CARD_BASE_WIDTH]
+    return {
+        'image': base,
+        'srcset': ', '.join(f'{image.url} {width}w'
+                            for width, image in variants),
+        'color': post.image_color,
+    }
@@ -1,16 +1,47 @@
+import base64
 import io
+import json
+import multiprocessing
 import os
 import re
 import tempfile
+import time
+from datetime import timedelta
+from importlib import import_module
+from types import SimpleNamespace
+from unittest import mock
 
+from django.apps import apps as django_apps
 from django.conf import settings as st
-from django.core.cache import cache
+from django.core.cache import cache, caches
+from django.core.exceptions import MiddlewareNotUsed, ValidationError
 from django.core.files.base import ContentFile
-from django.test import Client, TestCase, override_settings
+from django.core.management import call_command
+from django.core.paginator import Paginator
+from django.template import Context, Template
+from django.template.base import Origin
+from django.db import connection
+from django.db.models.query import QuerySet
+from django.test import (Client, RequestFactory, SimpleTestCase, TestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from PIL import Image
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+from yatube import metrics
+from yatube.sqlite_cache import SQLiteCache
+from yatube.thumbnail_kvstore import KVStore
 
-from .models import Group, Post, User
+from . import (blobs, budgets, caching, search, slow_queries, thumbnails,
+               timeline)
+from .images import normalize
+from .management.commands import bench_uploads
+from .models import (Comment, Follow, Group, MediaBlob, Post, TimelineEntry,
+                     User, UserStats)
+from .pagination import (CursorPaginator, EstimatedCountPaginator,
+                         InvalidCursor)
+from .stats import get_stats, rebuild
 
 
 class TestStringMethods(TestCase):
@@ -301,16 +332,17 @@ class TestStringMethods(TestCase):
         self.client.post(reverse('new_post'),
                          {'text': 'test test test'},
                          follow=True)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('index'))
+        self.assertFalse(
+            any('posts_post' in q['sql'] for q in queries.captured_queries),
+            msg='кэширование не работает')
+
         response = self.client.post(reverse('new_post'),
                                     {'text': 'test cache'},
                                     follow=True)
-        self.assertNotContains(response, 'test cache',
-                               msg_prefix='кэширование не работает')
-
-        cache.clear()
-        response = self.client.get(reverse('index'))
         self.assertContains(response, 'test cache',
-                            msg_prefix='записи нет ')
+                            msg_prefix='кэш не сброшен после записи ')
 
     def test_follow(self):
         # non-auth follow
@@ -447,3 +479,1859 @@ class TestStringMethods(TestCase):
             'comment for blogger',
             msg_prefix='Нет комментария от пользователя'
         )
+
+
+class TestCursorPagination(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='cursor',
+                                             password='test')
+        self.group = Group.objects.create(title='cursor group',
+                                          slug='cursor',
+                                          description='cursor group')
+        Post.objects.bulk_create(
+            Post(text=f'cursor post {i}', author=self.user, group=self.group)
+            for i in range(7)
+        )
+        # одинаковые даты проверяют разрешение ничьих по id
+        Post.objects.filter(id__in=Post.objects.order_by('id')
+                            .values_list('id', flat=True)[:4]) \
+            .update(pub_date=Post.objects.earliest('id').pub_date)
+        self.expected = list(Post.objects.order_by('-pub_date', '-id')
+                             .values_list('id', flat=True))
+
+    def walk(self, url):
+        cache.clear()
+        seen = []
+        response = self.client.get(url)
+        page = response.context['page']
+        seen += [post.id for post in page]
+        while page.next_cursor:
+            response = self.client.get(url, {'after': page.next_cursor})
+            page = response.context['page']
+            seen += [post.id for post in page]
+        return seen, page
+
+    @override_settings(FEED_PAGINATION='cursor')
+    def test_all_feeds_walk(self):
+        urls = [
+            reverse('index'),
+            reverse('group', args=[self.group.slug]),
+            reverse('profile', args=[self.user.username]),
+        ]
+        for url in urls:
+            seen, _ = self.walk(url)
+            self.assertEqual(seen, self.expected,
+                             msg=f'Курсорный обход {url} некорректен')
+
+    @override_settings(FEED_PAGINATION='cursor')
+    def test_before_returns_previous_page(self):
+        url = reverse('group', args=[self.group.slug])
+        first = self.client.get(url).context['page']
+        second = self.client.get(url, {'after': first.next_cursor}) \
+            .context['page']
+        back = self.client.get(url, {'before': second.previous_cursor}) \
+            .context['page']
+        self.assertEqual([p.id for p in back], [p.id for p in first])
+        self.assertFalse(back.has_previous())
+
+    @override_settings(FEED_PAGINATION='cursor')
+    def test_no_count_query(self):
+        url = reverse('group', args=[self.group.slug])
+        first = self.client.get(url).context['page']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'after': first.next_cursor})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(
+            any('COUNT(*)' in q['sql'] for q in queries.captured_queries),
+            msg='Курсорная пагинация не должна выполнять COUNT(*)')
+        self.assertContains(response, '?before=')
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        response = self.client.get(
+            reverse('profile', args=[self.user.username]),
+            {'after': 'not-a-cursor'})
+        self.assertEqual([p.id for p in response.context['page']],
+                         self.expected[:5])
+
+    def test_malformed_cursor_values(self):
+        tokens = [
+            base64.urlsafe_b64encode(json.dumps(values).encode())
+            .decode().rstrip('=')
+            for values in ([None, None], [[1], 1], [{}, 1], [True, 1],
+                           ['', 1], ['2020-01-01T00:00:00', 'x'])
+        ]
+        paginator = CursorPaginator(Post.objects.all(), 5)
+        post = Post.objects.filter(author=self.user).first()
+        comments = reverse('post_comments', args=[self.user.username,
+                                                  post.pk])
+        for token in tokens:
+            with self.assertRaises(InvalidCursor, msg=token):
+                paginator.decode_cursor(token)
+            for url in (reverse('index'), reverse('search'),
+                        reverse('profile', args=[self.user.username])):
+                self.assertEqual(self.client.get(
+                    url, {'after': token, 'q': 'пост'}).status_code, 200)
+            self.assertEqual(self.client.get(
+                reverse('api_posts'), {'after': token}).status_code, 400)
+            self.assertEqual(self.client.get(
+                comments, {'after': token}).status_code, 400)
+            self.assertEqual(self.client.get(
+                comments, {'after': token, 'format': 'json'}).status_code,
+                400)
+
+    def test_offset_mode_by_default(self):
+        response = self.client.get(reverse('group', args=[self.group.slug]))
+        self.assertIsInstance(response.context['paginator'], Paginator)
+
+
+class TestTimeline(TestCase):
+    def setUp(self):
+        self.reader = User.objects.create_user(username='reader',
+                                               password='test')
+        self.reader2 = User.objects.create_user(username='reader2',
+                                                password='test')
+        self.author = User.objects.create_user(username='writer',
+                                               password='test')
+        self.client = Client()
+        self.client.force_login(self.reader)
+        self.client_author = Client()
+        self.client_author.force_login(self.author)
+
+    def feed_texts(self):
+        response = self.client.get(reverse('follow_index'))
+        return [post.text for post in response.context['page']]
+
+    def test_fan_out_on_new_post(self):
+        self.client.get(reverse('profile_follow', args=['writer']))
+        self.client_author.post(reverse('new_post'), {'text': 'fresh'})
+        self.assertTrue(
+            TimelineEntry.objects.filter(user=self.reader,
+                                         post__text='fresh').exists(),
+            msg='Пост не разложен по лентам подписчиков')
+        self.assertEqual(self.feed_texts(), ['fresh'])
+
+    def test_backfill_and_unfollow(self):
+        Post.objects.create(text='old post', author=self.author)
+        self.client.get(reverse('profile_follow', args=['writer']))
+        self.assertEqual(self.feed_texts(), ['old post'],
+                         msg='Старые посты не попали в ленту при подписке')
+        self.client.get(reverse('profile_unfollow', args=['writer']))
+        self.assertFalse(TimelineEntry.objects.filter(user=self.reader)
+                         .exists())
+        self.assertEqual(self.feed_texts(), [])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_pull_for_popular_author(self):
+        Post.objects.create(text='before', author=self.author)
+        Follow.objects.create(user=self.reader, author=self.author)
+        Follow.objects.create(user=self.reader2, author=self.author)
+        self.assertTrue(timeline.is_pull_author(self.author.id))
+        # старые записи подписка не удаляет, лента их не дублирует
+        self.assertEqual(
+            TimelineEntry.objects.filter(author=self.author).count(), 1)
+        Post.objects.create(text='after', author=self.author)
+        self.assertFalse(
+            TimelineEntry.objects.filter(author=self.author,
+                                         post__text='after').exists(),
+            msg='Посты популярного автора не должны раскладываться')
+        self.assertEqual(self.feed_texts(), ['after', 'before'])
+        out = io.StringIO()
+        call_command('prune_timeline', stdout=out)
+        self.assertIn('Удалено записей лент: 1', out.getvalue())
+        self.assertFalse(
+            TimelineEntry.objects.filter(author=self.author).exists())
+        self.assertEqual(self.feed_texts(), ['after', 'before'])
+
+
+class TestUserStats(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='counted',
+                                             password='test')
+        self.fan = User.objects.create_user(username='fan', password='test')
+        self.client = Client()
+        self.client.force_login(self.fan)
+
+    def test_counters_follow_writes(self):
+        post = Post.objects.create(text='counted post', author=self.user)
+        stats = get_stats(self.user)
+        self.client.get(reverse('profile_follow', args=['counted']))
+        Comment.objects.create(post=post, author=self.user, text='self')
+        stats.refresh_from_db()
+        self.assertEqual((stats.posts, stats.followers, stats.comments),
+                         (1, 1, 1))
+        self.assertEqual(get_stats(self.fan).following, 1)
+        self.client.get(reverse('profile_unfollow', args=['counted']))
+        post.delete()
+        stats.refresh_from_db()
+        self.assertEqual((stats.posts, stats.followers, stats.comments),
+                         (0, 0, 0))
+
+    def test_profile_without_count_queries(self):
+        Post.objects.create(text='counted post', author=self.user)
+        get_stats(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('profile',
+                                               args=['counted']))
+        self.assertContains(response, 'Записей: 1')
+        self.assertFalse(
+            any('COUNT(' in q['sql'] for q in queries.captured_queries
+                if 'posts_follow' in q['sql']),
+            msg='Счётчики подписок не должны считаться агрегатами')
+
+    def test_rebuild_command_fixes_drift(self):
+        Post.objects.create(text='counted post', author=self.user)
+        UserStats.objects.filter(pk=self.user.pk).update(posts=42)
+        out = io.StringIO()
+        call_command('rebuild_stats', 'counted', stdout=out)
+        self.assertEqual(UserStats.objects.get(pk=self.user.pk).posts, 1)
+        self.assertIn('исправлено: 1', out.getvalue())
+
+    def test_concurrent_first_view(self):
+        get_stats(self.user)
+        # параллельный запрос создал строку после нашего in_bulk
+        with mock.patch.object(UserStats.objects, 'in_bulk',
+                               return_value={}):
+            rebuild([self.user.pk])
+        self.assertEqual(UserStats.objects.filter(pk=self.user.pk).count(),
+                         1)
+
+    def test_migration_fills_counters(self):
+        Post.objects.create(text='counted post', author=self.user)
+        Follow.objects.create(user=self.fan, author=self.user)
+        UserStats.objects.all().delete()
+        migration = import_module('posts.migrations.0012_fill_user_stats')
+        migration.fill_user_stats(django_apps, None)
+        self.assertEqual(
+            list(UserStats.objects.values_list('user__username', 'posts',
+                                               'followers', 'following')
+                 .order_by('user__username')),
+            [('counted', 1, 1, 0), ('fan', 0, 0, 1)])
+
+
+class TestFeedComments(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='talker',
+                                             password='test')
+        self.post = Post.objects.create(text='talked about',
+                                        author=self.user)
+        Comment.objects.bulk_create(
+            Comment(post=self.post, author=self.user, text=f'reply {i}')
+            for i in range(30)
+        )
+
+    def test_comment_count_without_loading_comments(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('profile', args=['talker']))
+        self.assertContains(response, '30 комментариев')
+        self.assertFalse(
+            any('"posts_comment"."text"' in q['sql']
+                for q in queries.captured_queries),
+            msg='Лента не должна загружать текст комментариев')
+
+    @override_settings(FEED_COMMENT_PREVIEW=3)
+    def test_bounded_preview(self):
+        other = Post.objects.create(text='other', author=self.user)
+        Comment.objects.create(post=other, author=self.user, text='lonely')
+        response = self.client.get(reverse('profile', args=['talker']))
+        posts = {post.id: post for post in response.context['page']}
+        self.assertEqual(
+            [c.text for c in posts[self.post.id].comment_preview],
+            ['reply 29', 'reply 28', 'reply 27'])
+        self.assertEqual(
+            [c.text for c in posts[other.id].comment_preview], ['lonely'])
+        self.assertContains(response, 'reply 29')
+
+
+class TestQueryPlans(TestCase):
+    """Запросы лент не должны сканировать таблицы и сортировать во времянке."""
+
+    def setUp(self):
+        self.client = Client()
+        self.users = [User.objects.create_user(username=f'planner{i}',
+                                               password='test')
+                      for i in range(4)]
+        self.client.force_login(self.users[0])
+        self.group = Group.objects.create(title='plans', slug='plans',
+                                          description='plans')
+        for author in self.users[1:]:
+            Follow.objects.create(user=self.users[0], author=author)
+        Post.objects.bulk_create(
+            Post(text=f'plan {i}', author=self.users[i % 4],
+                 group=self.group if i % 2 else None)
+            for i in range(40)
+        )
+        for post in Post.objects.all():
+            timeline.fan_out(post)
+        self.post = Post.objects.filter(author=self.users[1]).first()
+        Comment.objects.bulk_create(
+            Comment(post=post, author=self.users[0], text='plan comment')
+            for post in Post.objects.all()[:10]
+        )
+        # ANALYZE не запускаем: на крошечной выборке планировщик выбрал бы
+        # сканирование, а без статистики он рассчитывает на большие таблицы
+
+    def bad_steps(self, sql, params):
+        tables = connection.introspection.table_names()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            details = [row[-1] for row in cursor.fetchall()]
+        bad = []
+        for detail in details:
+            if 'USE TEMP B-TREE' in detail:
+                bad.append(detail)
+            words = detail.replace('SCAN TABLE', 'SCAN').split()
+            if (words[0] == 'SCAN' and words[1] in tables
+                    and 'INDEX' not in detail):
+                bad.append(detail)
+        return bad
+
+    def check_plans(self, url, data=None):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, data or {})
+        self.assertEqual(response.status_code, 200)
+        for query in queries.captured_queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT'):
+                continue
+            # CaptureQueriesContext отдаёт SQL с подставленными параметрами
+            bad = self.bad_steps(sql, ())
+            self.assertEqual(bad, [], msg=f'{url}: {sql}')
+        return response
+
+    def feed_urls(self):
+        return [
+            reverse('index'),
+            reverse('group', args=[self.group.slug]),
+            reverse('profile', args=[self.users[1].username]),
+            reverse('follow_index'),
+        ]
+
+    def test_feed_plans(self):
+        for url in self.feed_urls():
+            self.check_plans(url, {'page': 2})
+
+    @override_settings(FEED_PAGINATION='cursor')
+    def test_cursor_feed_plans(self):
+        for url in self.feed_urls():
+            page = self.check_plans(url).context['page']
+            self.check_plans(url, {'after': page.next_cursor})
+
+    def test_post_view_plans(self):
+        self.check_plans(reverse('post', args=[self.post.author.username,
+                                               self.post.id]))
+
+
+class TestVersionedCache(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.author = User.objects.create_user(username='cached',
+                                               password='test')
+        self.client_author = Client()
+        self.client_author.force_login(self.author)
+        self.group = Group.objects.create(title='cached group',
+                                          slug='cached',
+                                          description='cached')
+        self.post = Post.objects.create(text='cached post',
+                                        author=self.author,
+                                        group=self.group)
+        self.urls = [
+            reverse('index'),
+            reverse('group', args=['cached']),
+            reverse('profile', args=['cached']),
+            reverse('post', args=['cached', self.post.id]),
+        ]
+
+    def assert_fresh(self, text):
+        for url in self.urls:
+            self.client.get(url)
+            self.assertContains(self.client.get(url), text,
+                                msg_prefix=f'{url} устарел: ')
+
+    def test_edit_invalidates_all_scopes(self):
+        self.assert_fresh('cached post')
+        self.client_author.post(
+            reverse('post_edit', args=['cached', self.post.id]),
+            {'text': 'edited post', 'group': self.group.id})
+        self.assert_fresh('edited post')
+
+    def test_comment_invalidates_feeds(self):
+        self.assert_fresh('Добавить комментарий')
+        self.client_author.post(
+            reverse('add_comment', args=['cached', self.post.id]),
+            {'text': 'a comment'})
+        self.assert_fresh('1 комментариев')
+
+    def test_group_rename_and_follow(self):
+        self.assert_fresh('cached group')
+        self.group.title = 'renamed group'
+        self.group.save()
+        self.assert_fresh('renamed group')
+        Follow.objects.create(
+            user=User.objects.create_user(username='fan2'),
+            author=self.author)
+        response = self.client.get(reverse('profile', args=['cached']))
+        self.assertContains(response, 'Подписчиков: 1')
+
+    def test_group_and_author_delete_with_posts(self):
+        self.assert_fresh('cached post')
+        groups = caching.get_versions(['groups'])
+        # каскад: к post_delete поста строки группы уже нет
+        self.group.delete()
+        self.assertNotEqual(caching.get_versions(['groups']), groups)
+        self.assertNotContains(self.client.get(reverse('index')),
+                               'cached post')
+        self.assertEqual(
+            self.client.get(reverse('group', args=['cached'])).status_code,
+            404)
+        Post.objects.create(text='second post', author=self.author)
+        Follow.objects.create(
+            user=User.objects.create_user(username='fan4'),
+            author=self.author)
+        self.assertContains(self.client.get(reverse('index')), 'second post')
+        self.author.delete()
+        self.assertNotContains(self.client.get(reverse('index')),
+                               'second post')
+
+    def test_skeleton_shared_between_users(self):
+        self.client.get(reverse('index'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client_author.get(reverse('index'))
+        self.assertFalse(
+            any('posts_post' in q['sql'] for q in queries.captured_queries),
+            msg='Авторизованный пользователь не получил общий каркас')
+        self.assertContains(response, 'Редактировать')
+        self.assertContains(response, 'Пользователь: <a href="/cached/">')
+        response = self.client.get(reverse('index'))
+        self.assertNotContains(response, 'Редактировать')
+        self.assertNotContains(response, '<!--hole:')
+
+    def test_untrusted_hole_markers_stay_text(self):
+        def marker(payload):
+            encoded = base64.urlsafe_b64encode(
+                json.dumps(payload).encode()).decode()
+            return f'<!--hole:{encoded}-->'
+
+        request = RequestFactory().get('/')
+        request.user = self.author
+        bad = ['<!--hole:AAAA-->', '<!--hole:=-->', marker(42),
+               marker(['base.html', {}]),
+               marker(['includes/holes/../../base.html', {}]),
+               marker(['includes/holes/nav_user.html', []])]
+        for text in bad:
+            self.assertEqual(caching.fill_holes(text, request), text)
+        filled = caching.fill_holes(
+            caching.hole_marker('includes/holes/nav_user.html', {}), request)
+        self.assertIn('cached', filled)
+        with self.assertRaises(ValueError):
+            caching.hole_marker('base.html', {})
+
+    def test_personal_fragments_on_post_page(self):
+        fan = User.objects.create_user(username='fan3')
+        client_fan = Client()
+        client_fan.force_login(fan)
+        url = reverse('post', args=['cached', self.post.id])
+        self.client.get(url)
+        response = client_fan.get(url)
+        self.assertContains(response, 'csrfmiddlewaretoken')
+        self.assertContains(response, 'Подписаться')
+        client_fan.get(reverse('profile_follow', args=['cached']))
+        self.assertContains(client_fan.get(url), 'Отписаться')
+        self.assertNotContains(self.client.get(url), 'csrfmiddlewaretoken')
+
+
+class TestPostCardCache(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.author = User.objects.create_user(username='carded',
+                                               password='test')
+        self.client_author = Client()
+        self.client_author.force_login(self.author)
+        self.group = Group.objects.create(title='card group', slug='card',
+                                          description='card')
+        self.post = Post.objects.create(text='card post', author=self.author,
+                                        group=self.group)
+
+    def card_counters(self):
+        return caching.counters('card_hits', 'card_misses')
+
+    def test_card_shared_between_feeds(self):
+        before = self.card_counters()
+        self.client.get(reverse('index'))
+        self.client.get(reverse('group', args=['card']))
+        after = self.card_counters()
+        self.assertEqual(after['card_misses'] - before['card_misses'], 1)
+        self.assertEqual(after['card_hits'] - before['card_hits'], 1)
+        out = io.StringIO()
+        call_command('cache_stats', stdout=out)
+        self.assertIn('попаданий', out.getvalue())
+
+    def test_card_version_changes(self):
+        url = reverse('profile', args=['carded'])
+        self.client.get(url)
+        self.group.title = 'renamed card group'
+        self.group.save()
+        self.assertContains(self.client.get(url), 'renamed card group')
+        Comment.objects.create(post=self.post, author=self.author, text='c')
+        self.assertContains(self.client.get(url), '1 комментариев')
+
+    def test_cached_card_personalised_outside_page_cache(self):
+        follower = User.objects.create_user(username='card_fan')
+        Follow.objects.create(user=follower, author=self.author)
+        self.client.get(reverse('index'))
+        client_fan = Client()
+        client_fan.force_login(follower)
+        response = client_fan.get(reverse('follow_index'))
+        self.assertContains(response, 'card post')
+        self.assertNotContains(response, 'Редактировать')
+        self.assertNotContains(response, '<!--hole:')
+
+
+def _incr_worker(path, times):
+    backend = SQLiteCache(path, {})
+    for _ in range(times):
+        backend.incr('shared')
+
+
+class TestSQLiteCache(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'cache.sqlite3')
+        self.cache = SQLiteCache(self.path, {
+            'OPTIONS': {'MAX_ENTRIES': 10, 'CULL_FREQUENCY': 5,
+                        'ACCESS_RESOLUTION': 0},
+        })
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_tests_do_not_touch_shared_cache(self):
+        # общий кэш сайта в BASE_DIR, у тестов — временный
+        self.assertNotEqual(os.path.dirname(cache._path), st.BASE_DIR)
+
+    def test_basic_operations(self):
+        self.cache.set('page', {'html': 'текст'})
+        self.assertEqual(self.cache.get('page'), {'html': 'текст'})
+        self.assertFalse(self.cache.add('page', 'other'))
+        self.cache.set('gone', 1, timeout=-1)
+        self.assertIsNone(self.cache.get('gone'))
+        self.assertTrue(self.cache.add('gone', 2))
+        self.assertEqual(self.cache.get_many(['page', 'gone', 'missing']),
+                         {'page': {'html': 'текст'}, 'gone': 2})
+        self.cache.delete('page')
+        self.assertFalse(self.cache.has_key('page'))
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_totals_survive_overwrites(self):
+        for i in range(3):
+            self.cache.set('same', 'x' * (i + 1))
+        self.assertEqual(self.cache.totals()['entries'], 1)
+
+    def test_lru_eviction(self):
+        for i in range(10):
+            self.cache.set(f'key{i}', i)
+            time.sleep(0.001)
+        self.cache.get('key0')
+        self.cache.set('key10', 10)
+        self.assertLessEqual(self.cache.totals()['entries'], 10)
+        self.assertEqual(self.cache.get('key0'), 0,
+                         msg='Недавно прочитанный ключ вытеснен')
+        self.assertIsNone(self.cache.get('key1'))
+
+    def test_incr_is_atomic_across_processes(self):
+        self.cache.set('shared', 0)
+        context = multiprocessing.get_context('fork')
+        workers = [context.Process(target=_incr_worker,
+                                   args=(self.path, 50))
+                   for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(self.cache.get('shared'), 200)
+
+
+class TestThumbnailPipeline(TestCase):
+    def setUp(self):
+        # sorl хранит сведения о миниатюрах в кэше и в памяти процесса,
+        # а файлы у каждого теста свои
+        cache.clear()
+        default.kvstore.clear()
+        self.media = tempfile.TemporaryDirectory()
+        self.override = override_settings(MEDIA_ROOT=self.media.name)
+        self.override.enable()
+        self.user = User.objects.create_user(username='painter')
+
+    def tearDown(self):
+        self.override.disable()
+        self.media.cleanup()
+
+    def make_post(self):
+        byte_image = io.BytesIO()
+        Image.new('RGB', (400, 300), (0, 128, 0)).save(byte_image, 'jpeg')
+        return Post.objects.create(
+            text='picture', author=self.user,
+            image=ContentFile(byte_image.getvalue(), name='picture.jpg'))
+
+    def thumbnail_files(self):
+        found = []
+        for root, _, files in os.walk(os.path.join(self.media.name,
+                                                   'cache')):
+            found += files
+        return found
+
+    @override_settings(THUMBNAIL_WORKERS=0)
+    def test_thumbnail_queued_on_save(self):
+        with mock.patch('posts.thumbnails.transaction.on_commit') as commit:
+            self.make_post()
+        self.assertEqual(commit.call_count, 1)
+        commit.call_args[0][0]()
+        # 400px: варианты 480, 720 и базовый 960, без 1440
+        self.assertEqual(len(self.thumbnail_files()), 3)
+
+    def test_backfill_command(self):
+        self.make_post()
+        out = io.StringIO()
+        call_command('pregenerate_thumbnails', stdout=out)
+        self.assertIn('обработано картинок: 1', out.getvalue())
+        self.assertEqual(len(self.thumbnail_files()), 3)
+
+    def test_srcset_lists_generated_variants(self):
+        post = self.make_post()
+        thumbnails.generate(post.image, post.image_width)
+        html = self.client.get(reverse('index')).content.decode()
+        srcset = re.search(r'srcset="([^"]*)"', html).group(1)
+        widths = [item.split()[-1] for item in srcset.split(', ')]
+        self.assertEqual(widths, ['480w', '720w', '960w'])
+
+    def test_wide_image_gets_all_variants(self):
+        self.assertEqual(len(thumbnails.specs_for(3000)),
+                         len(thumbnails.CARD_WIDTHS))
+        self.assertEqual(len(thumbnails.specs_for(None)), 3)
+
+    def test_report_command(self):
+        with mock.patch('posts.thumbnails.transaction.on_commit'):
+            self.make_post()
+        out = io.StringIO()
+        call_command('thumbnail_report', stdout=out)
+        self.assertIn('не создано: 3', out.getvalue())
+        call_command('pregenerate_thumbnails', stdout=io.StringIO())
+        out = io.StringIO()
+        call_command('thumbnail_report', stdout=out)
+        self.assertIn('Всего: 3 миниатюр', out.getvalue())
+        self.assertIn('не создано: 0', out.getvalue())
+
+
+class TestImageNormalization(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.override = override_settings(MEDIA_ROOT=self.media.name)
+        self.override.enable()
+        self.user = User.objects.create_user(username='photographer',
+                                             password='test')
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        self.override.disable()
+        self.media.cleanup()
+
+    def jpeg(self, size, exif=None):
+        output = io.BytesIO()
+        options = {'exif': exif.tobytes()} if exif else {}
+        Image.new('RGB', size, (200, 50, 50)).save(output, 'JPEG', **options)
+        output.seek(0)
+        return output
+
+    @override_settings(POST_IMAGE_MAX_SIDE=500)
+    def test_large_image_downscaled(self):
+        data, extension = normalize(self.jpeg((2000, 1000)))
+        image = Image.open(io.BytesIO(data))
+        self.assertEqual(image.size, (500, 250))
+        self.assertEqual(image.format, 'WEBP')
+        self.assertEqual(extension, 'webp')
+
+    def test_exif_stripped_and_orientation_applied(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # повёрнуто на 90°
+        exif[0x010F] = 'Camera'
+        data, _ = normalize(self.jpeg((400, 200), exif))
+        image = Image.open(io.BytesIO(data))
+        self.assertEqual(image.size, (200, 400))
+        self.assertEqual(dict(image.getexif()), {})
+
+    def test_alpha_preserved(self):
+        output = io.BytesIO()
+        Image.new('RGBA', (100, 100), (0, 0, 0, 0)).save(output, 'PNG')
+        output.seek(0)
+        data, _ = normalize(output)
+        image = Image.open(io.BytesIO(data))
+        self.assertEqual(image.mode, 'RGBA')
+        self.assertEqual(image.getpixel((0, 0))[3], 0)
+
+    @override_settings(POST_IMAGE_MAX_PIXELS=10000)
+    def test_pixel_budget(self):
+        output = io.BytesIO()
+        Image.new('RGB', (200, 100)).save(output, 'PNG')
+        output.seek(0)
+        with self.assertRaises(ValidationError):
+            normalize(output)
+        # JPEG сверяется с бюджетом в уменьшенном при чтении масштабе
+        data, _ = normalize(self.jpeg((800, 400)), max_side=50)
+        self.assertEqual(Image.open(io.BytesIO(data)).size, (50, 25))
+
+    @override_settings(POST_IMAGE_MAX_PIXELS=10000)
+    def test_oversized_upload_rejected(self):
+        output = io.BytesIO()
+        Image.new('RGB', (200, 100)).save(output, 'PNG')
+        output.seek(0)
+        output.name = 'huge.png'
+        response = self.client.post(reverse('new_post'),
+                                    {'text': 'huge', 'image': output})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('image', response.context['form'].errors)
+        self.assertFalse(Post.objects.filter(text='huge').exists())
+
+    @override_settings(POST_IMAGE_MAX_SIDE=300)
+    def test_upload_normalized(self):
+        upload = self.jpeg((1200, 900))
+        upload.name = 'photo.jpg'
+        self.client.post(reverse('new_post'),
+                         {'text': 'photo', 'image': upload})
+        post = Post.objects.get(text='photo')
+        self.assertTrue(post.image.name.endswith('.webp'))
+        with Image.open(post.image.path) as image:
+            self.assertEqual(image.size, (300, 225))
+
+
+class TestImageMeta(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.override = override_settings(MEDIA_ROOT=self.media.name)
+        self.override.enable()
+        self.user = User.objects.create_user(username='framer')
+
+    def tearDown(self):
+        self.override.disable()
+        self.media.cleanup()
+
+    def make_post(self, size=(300, 200), color=(0, 0, 255)):
+        byte_image = io.BytesIO()
+        Image.new('RGB', size, color).save(byte_image, 'png')
+        return Post.objects.create(
+            text='meta', author=self.user,
+            image=ContentFile(byte_image.getvalue(), name='meta.png'))
+
+    def test_meta_recorded_on_save(self):
+        post = self.make_post()
+        post.refresh_from_db()
+        self.assertEqual((post.image_width, post.image_height), (300, 200))
+        self.assertEqual(post.image_color, '#0000ff')
+        self.assertEqual(len(post.image_hash), 64)
+
+    def test_meta_not_recomputed_for_same_image(self):
+        post = self.make_post()
+        with mock.patch('posts.images.describe') as describe:
+            post.text = 'edited'
+            post.save()
+        describe.assert_not_called()
+
+    def test_meta_cleared_with_image(self):
+        post = self.make_post()
+        post.image = None
+        post.save()
+        post.refresh_from_db()
+        self.assertIsNone(post.image_width)
+        self.assertEqual(post.image_hash, '')
+
+    def test_missing_file_tolerated(self):
+        post = Post.objects.create(text='lost', author=self.user,
+                                   image='posts/lost.jpg')
+        self.assertIsNone(post.image_width)
+
+    def test_feed_image_lazy_with_size(self):
+        self.make_post()
+        html = self.client.get(reverse('index')).content.decode()
+        img = re.search(r'<img class="card-img"[^>]*>', html).group()
+        self.assertIn('loading="lazy"', img)
+        self.assertIn('width="960"', img)
+        self.assertIn('background-color: #0000ff', img)
+
+
+class TestThumbnailKVStore(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.store = KVStore()
+
+    def image(self, name):
+        return ImageFile(name)
+
+    def remember(self, *names):
+        for name in names:
+            image = self.image(name)
+            image.set_size((10, 10))
+            self.store._set(image.key, image)
+
+    def test_lookup_served_from_memory(self):
+        self.remember('a.jpg')
+        self.store.take_stats()
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(self.store.get(self.image('a.jpg')))
+        self.assertEqual(self.store.take_stats()['memory'], 1)
+
+    @override_settings(THUMBNAIL_KVSTORE_LRU_SIZE=2)
+    def test_lru_bounded(self):
+        self.remember('a.jpg', 'b.jpg')
+        self.store.get(self.image('a.jpg'))
+        self.remember('c.jpg')
+        self.assertEqual(len(self.store._lru), 2)
+        cache.clear()
+        self.store.take_stats()
+        self.store.get(self.image('a.jpg'))
+        self.assertEqual(self.store.take_stats()['memory'], 1)
+        # b вытеснена как самая давно использованная
+        self.store.get(self.image('b.jpg'))
+        self.assertEqual(self.store.take_stats()['db'], 1)
+
+    def test_prefetch_in_one_query(self):
+        self.remember('a.jpg', 'b.jpg', 'c.jpg')
+        cold = KVStore()
+        cache.clear()
+        images = [self.image(name) for name in ('a.jpg', 'b.jpg', 'c.jpg',
+                                                'missing.jpg')]
+        with self.assertNumQueries(1):
+            cold.prefetch(images)
+        with self.assertNumQueries(0):
+            for image in images[:3]:
+                self.assertIsNotNone(cold.get(image))
+            # отсутствие записи закэшировано в общем уровне
+            self.assertIsNone(cold.get(images[3]))
+        stats = cold.take_stats()
+        self.assertEqual((stats['db'], stats['memory'], stats['miss']),
+                         (3, 3, 2))
+
+    def test_delete_forgets(self):
+        self.remember('a.jpg')
+        self.store.delete(self.image('a.jpg'), delete_thumbnails=False)
+        self.assertIsNone(self.store.get(self.image('a.jpg')))
+
+
+class TestMediaDedup(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.override = override_settings(MEDIA_ROOT=self.media.name)
+        self.override.enable()
+        self.user = User.objects.create_user(username='memer')
+
+    def tearDown(self):
+        self.override.disable()
+        self.media.cleanup()
+
+    def upload(self, color=(255, 255, 0), name='meme.png'):
+        byte_image = io.BytesIO()
+        Image.new('RGB', (50, 50), color).save(byte_image, 'png')
+        return ContentFile(byte_image.getvalue(), name=name)
+
+    def make_post(self, **kwargs):
+        return Post.objects.create(text='meme', author=self.user,
+                                   image=self.upload(**kwargs))
+
+    def refs(self, post):
+        return MediaBlob.objects.get(name=post.image.name).refs
+
+    def blob_files(self):
+        found = []
+        for root, _, files in os.walk(os.path.join(self.media.name,
+                                                   'posts')):
+            found += files
+        return found
+
+    def test_duplicates_share_one_file(self):
+        first = self.make_post(name='one.png')
+        second = self.make_post(name='two.png')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name, blobs.BLOB_RE)
+        self.assertEqual(len(self.blob_files()), 1)
+        self.assertEqual(self.refs(first), 2)
+
+    def test_edit_and_delete_release(self):
+        first = self.make_post()
+        second = self.make_post()
+        old_name = first.image.name
+        first.image = self.upload(color=(0, 0, 0))
+        first.save()
+        self.assertEqual(MediaBlob.objects.get(name=old_name).refs, 1)
+        self.assertEqual(self.refs(first), 1)
+        second.delete()
+        self.assertEqual(MediaBlob.objects.get(name=old_name).refs, 0)
+
+    def test_collect_removes_orphans_only(self):
+        kept = self.make_post(color=(1, 2, 3))
+        gone = self.make_post()
+        gone.delete()
+        self.assertEqual(blobs.collect(), 0)  # ещё идёт отсрочка
+        self.assertEqual(blobs.collect(grace=timedelta(0)), 1)
+        self.assertEqual(len(self.blob_files()), 1)
+        self.assertTrue(kept.image.storage.exists(kept.image.name))
+
+    def test_collect_unreferenced_file(self):
+        storage = Post._meta.get_field('image').storage
+        storage.save('posts/lost.png', self.upload())
+        out = io.StringIO()
+        call_command('gc_media', grace_hours=0, stdout=out)
+        self.assertIn('Удалено файлов: 1', out.getvalue())
+        self.assertEqual(self.blob_files(), [])
+
+    def test_recount(self):
+        post = self.make_post()
+        MediaBlob.objects.update(refs=5)
+        self.assertEqual(blobs.recount(), 1)
+        self.assertEqual(self.refs(post), 1)
+
+
+class TestSearch(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='naturalist')
+        self.group = Group.objects.create(title='Котики', slug='cats',
+                                          description='про котиков')
+        self.cat = Post.objects.create(text='Рыжий кот спит на диване',
+                                       author=self.author, group=self.group)
+        self.dog = Post.objects.create(text='Собака гуляет во дворе',
+                                       author=self.author)
+
+    def found(self, query):
+        return set(search.search(query).values_list('text', flat=True))
+
+    def test_match_expression_escapes_operators(self):
+        self.assertEqual(search.match_expression('кот OR "NEAR'),
+                         '"кот" "OR" "NEAR"*')
+        self.assertIsNone(search.match_expression('  *-" '))
+
+    def test_index_follows_edits(self):
+        self.assertEqual(self.found('рыж'), {self.cat.text})
+        self.cat.text = 'Серый кот'
+        self.cat.save()
+        self.assertEqual(self.found('рыжий'), set())
+        self.assertEqual(self.found('серый'), {'Серый кот'})
+        self.dog.delete()
+        self.assertEqual(self.found('собака'), set())
+
+    def test_facets_indexed(self):
+        self.assertEqual(self.found('котики'), {self.cat.text})
+        self.group.title = 'Кошки'
+        self.group.save()
+        self.assertEqual(self.found('кошки'), {self.cat.text})
+        self.author.username = 'zoologist'
+        self.author.save()
+        self.assertEqual(self.found('zoologist'),
+                         {self.cat.text, self.dog.text})
+
+    def test_search_view_keyset_pages(self):
+        for i in range(12):
+            Post.objects.create(text=f'кот номер {i}', author=self.author)
+        response = self.client.get(reverse('search'), {'q': 'кот'})
+        page = response.context['page']
+        self.assertTrue(page.is_cursor)
+        self.assertEqual(len(page), 10)
+        html = response.content.decode()
+        self.assertIn(f'?q=%D0%BA%D0%BE%D1%82&after={page.next_cursor}',
+                      html)
+        response = self.client.get(reverse('search'), {
+            'q': 'кот', 'after': page.next_cursor})
+        self.assertEqual(len(response.context['page']), 3)
+
+    def test_search_view_empty_query(self):
+        response = self.client.get(reverse('search'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['page']), 0)
+
+    def test_search_view_group_facet(self):
+        response = self.client.get(reverse('search'),
+                                   {'q': 'кот', 'group': 'cats'})
+        self.assertEqual(list(response.context['page']), [self.cat])
+        self.assertEqual(response.context['facets']['groups'][0]['total'], 1)
+
+    def test_admin_uses_index(self):
+        admin_user = User.objects.create_superuser(
+            'boss', 'boss@example.com', 'password')
+        self.client.force_login(admin_user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/admin/posts/post/', {'q': 'собака'})
+        self.assertContains(response, 'Собака гуляет')
+        self.assertNotContains(response, 'Рыжий кот')
+        sql = ' '.join(query['sql'] for query in queries)
+        self.assertIn('MATCH', sql)
+        self.assertNotIn('LIKE', sql)
+
+
+class TestLargeTableAdmin(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser(
+            'moderator', 'moderator@example.com', 'password')
+        self.client.force_login(self.admin)
+        self.group = Group.objects.create(title='Спорт', slug='sport',
+                                          description='спорт')
+        self.authors = [User.objects.create_user(username=f'writer{i}')
+                        for i in range(3)]
+
+    def make_posts(self, count):
+        return [Post.objects.create(text=f'заметка {i}', group=self.group,
+                                    author=self.authors[i % 3])
+                for i in range(count)]
+
+    def changelist_queries(self, url, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in queries]
+
+    def test_changelist_queries_do_not_grow(self):
+        self.make_posts(3)
+        few = self.changelist_queries('/admin/posts/post/')
+        self.make_posts(12)
+        many = self.changelist_queries('/admin/posts/post/')
+        self.assertEqual(len(few), len(many))
+        self.assertFalse([sql for sql in many if 'COUNT(*)' in sql])
+
+    def test_estimated_count(self):
+        posts = self.make_posts(5)
+        posts[0].delete()
+        paginator = EstimatedCountPaginator(Post.objects.all(), 2)
+        self.assertEqual(paginator.count, posts[-1].pk)
+        filtered = EstimatedCountPaginator(
+            Post.objects.filter(author=self.authors[0]), 2)
+        self.assertEqual(filtered.count, 1)
+
+    def test_stale_statistics_ignored(self):
+        self.make_posts(5)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        posts = self.make_posts(400)
+        self.assertEqual(
+            EstimatedCountPaginator(Post.objects.all(), 100).count,
+            posts[-1].pk)
+        # список в админке постраничный, а не все 405 строк разом
+        response = self.client.get('/admin/posts/post/')
+        self.assertEqual(len(response.context['cl'].result_list), 100)
+
+    def test_comment_changelist_queries_do_not_grow(self):
+        post = self.make_posts(1)[0]
+        Comment.objects.create(post=post, author=self.authors[0], text='ок')
+        few = self.changelist_queries('/admin/posts/comment/')
+        for author in self.authors:
+            Comment.objects.create(post=post, author=author, text='ок')
+        many = self.changelist_queries('/admin/posts/comment/')
+        self.assertEqual(len(few), len(many))
+
+    def test_delete_posts_action(self):
+        posts = self.make_posts(3)
+        follower = self.authors[1]
+        Follow.objects.create(user=follower, author=self.authors[0])
+        Comment.objects.create(post=posts[0], author=follower, text='ок')
+        versions = caching.get_versions(['global', 'author:writer0'])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/admin/posts/post/', {
+                'action': 'delete_posts',
+                '_selected_action': [posts[0].pk, posts[1].pk],
+            })
+        self.assertEqual(response.status_code, 302)
+        deletes = [query['sql'] for query in queries
+                   if query['sql'].startswith('DELETE FROM "posts_post"')]
+        self.assertEqual(len(deletes), 1)
+        self.assertEqual(list(Post.objects.all()), [posts[2]])
+        self.assertFalse(Comment.objects.exists())
+        self.assertFalse(TimelineEntry.objects.filter(
+            post__in=posts[:2]).exists())
+        self.assertEqual(set(search.search('заметка').values_list(
+            'pk', flat=True)), {posts[2].pk})
+        self.assertEqual(get_stats(self.authors[0]).posts, 0)
+        self.assertEqual(get_stats(follower).comments, 0)
+        self.assertNotEqual(
+            caching.get_versions(['global', 'author:writer0']), versions)
+
+    def test_delete_posts_action_expires_api_detail(self):
+        post = self.make_posts(1)[0]
+        url = reverse('api_post', args=[post.pk])
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.client.post('/admin/posts/post/', {
+            'action': 'delete_posts',
+            '_selected_action': [post.pk],
+        })
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_remove_from_group_action(self):
+        posts = self.make_posts(2)
+        self.client.post('/admin/posts/post/', {
+            'action': 'remove_from_group',
+            '_selected_action': [posts[0].pk],
+        })
+        posts[0].refresh_from_db()
+        self.assertIsNone(posts[0].group)
+        self.assertEqual(set(search.search('спорт').values_list(
+            'pk', flat=True)), {posts[1].pk})
+
+    def test_delete_comments_action(self):
+        post = self.make_posts(1)[0]
+        comment = Comment.objects.create(post=post, author=self.authors[2],
+                                         text='спам')
+        self.client.post('/admin/posts/comment/', {
+            'action': 'delete_comments',
+            '_selected_action': [comment.pk],
+        })
+        self.assertFalse(Comment.objects.exists())
+        self.assertEqual(get_stats(self.authors[2]).comments, 0)
+
+
+class TestConditionalGet(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='chronicler',
+                                               password='test')
+        self.group = Group.objects.create(title='Хроники', slug='chronicles',
+                                          description='хроники')
+        self.post = Post.objects.create(text='первая запись',
+                                        author=self.author, group=self.group)
+        self.urls = [
+            reverse('index'),
+            reverse('group', args=['chronicles']),
+            reverse('profile', args=['chronicler']),
+            reverse('post', args=['chronicler', self.post.pk]),
+        ]
+
+    def test_unchanged_pages_not_modified_without_queries(self):
+        for url in self.urls:
+            etag = self.client.get(url)['ETag']
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304, url)
+            self.assertEqual(response['ETag'], etag)
+
+    def test_logged_in_costs_one_query(self):
+        self.client.force_login(self.author)
+        etag = self.client.get(self.urls[0])['ETag']
+        # только пользователь сессии; сама сессия берётся из кэша
+        with self.assertNumQueries(1):
+            response = self.client.get(self.urls[0],
+                                       HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_differs_per_user(self):
+        anonymous = self.client.get(self.urls[0])['ETag']
+        self.client.force_login(self.author)
+        self.assertNotEqual(self.client.get(self.urls[0])['ETag'], anonymous)
+
+    def test_changes_invalidate(self):
+        etags = [self.client.get(url)['ETag'] for url in self.urls]
+        Comment.objects.create(post=self.post, author=self.author,
+                               text='дополнение')
+        Post.objects.create(text='вторая запись', author=self.author,
+                            group=self.group)
+        for url, etag in zip(self.urls, etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200, url)
+
+    def test_if_modified_since(self):
+        response = self.client.get(self.urls[0])
+        modified = response['Last-Modified']
+        response = self.client.get(self.urls[0],
+                                   HTTP_IF_MODIFIED_SINCE=modified)
+        self.assertEqual(response.status_code, 304)
+        with mock.patch('posts.caching.time.time',
+                        return_value=time.time() + 10):
+            Post.objects.create(text='позже', author=self.author)
+        response = self.client.get(self.urls[0],
+                                   HTTP_IF_MODIFIED_SINCE=modified)
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(API_PAGE_SIZE=2)
+class TestJsonApi(TestCase):
+    def setUp(self):
+        cache.clear()
+        default.kvstore.clear()
+        self.media = tempfile.TemporaryDirectory()
+        self.override = override_settings(MEDIA_ROOT=self.media.name)
+        self.override.enable()
+        self.author = User.objects.create_user(username='reporter')
+        self.group = Group.objects.create(title='Вести', slug='news',
+                                          description='новости')
+        self.posts = [
+            Post.objects.create(text=f'запись {number}', author=self.author,
+                                group=self.group if number else None)
+            for number in range(3)
+        ]
+        Comment.objects.create(post=self.posts[2], author=self.author,
+                               text='первый')
+
+    def tearDown(self):
+        self.override.disable()
+        self.media.cleanup()
+
+    def test_feed_pages_by_cursor(self):
+        response = self.client.get(reverse('api_posts'))
+        self.assertEqual(response['Content-Type'], 'application/json')
+        data = response.json()
+        self.assertEqual([post['text'] for post in data['results']],
+                         ['запись 2', 'запись 1'])
+        self.assertIsNone(data['previous'])
+        first = data['results'][0]
+        self.assertEqual(first['author'], 'reporter')
+        self.assertEqual(first['group'], {'slug': 'news', 'title': 'Вести'})
+        self.assertEqual(first['comments'], 1)
+        self.assertIsNone(first['image'])
+        data = self.client.get(reverse('api_posts'),
+                               {'after': data['next']}).json()
+        self.assertEqual([post['text'] for post in data['results']],
+                         ['запись 0'])
+        self.assertIsNone(data['results'][0]['group'])
+        self.assertIsNone(data['next'])
+        self.assertIsNotNone(data['previous'])
+
+    def test_group_profile_and_detail(self):
+        data = self.client.get(reverse('api_group_posts',
+                                       args=['news'])).json()
+        self.assertEqual(data['group']['title'], 'Вести')
+        self.assertEqual(len(data['results']), 2)
+        data = self.client.get(reverse('api_profile_posts',
+                                       args=['reporter'])).json()
+        self.assertEqual(data['author']['username'], 'reporter')
+        data = self.client.get(reverse('api_post',
+                                       args=[self.posts[2].pk])).json()
+        self.assertEqual([comment['text'] for comment in
+                          data['comment_list']], ['первый'])
+
+    @override_settings(COMMENTS_PAGE_SIZE=2)
+    def test_detail_comments_are_paginated(self):
+        post = self.posts[2]
+        for number in range(3):
+            Comment.objects.create(post=post, author=self.author,
+                                   text=f'ещё {number}')
+        data = self.client.get(reverse('api_post', args=[post.pk])).json()
+        self.assertEqual([comment['text'] for comment in
+                          data['comment_list']], ['ещё 2', 'ещё 1'])
+        rest = self.client.get(data['comments_next']).json()
+        self.assertEqual([comment['text'] for comment in rest['comments']],
+                         ['ещё 0', 'первый'])
+        self.assertIsNone(rest['next'])
+
+    def test_errors_are_json(self):
+        response = self.client.get(reverse('api_group_posts',
+                                           args=['missing']))
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('detail', response.json())
+        response = self.client.get(reverse('api_posts'), {'after': 'мусор'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(reverse('api_posts'))
+        self.assertEqual(response.status_code, 405)
+
+    def test_etag_and_invalidation(self):
+        etag = self.client.get(reverse('api_posts'))['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('api_posts'),
+                                       HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        with self.assertNumQueries(0):
+            self.client.get(reverse('api_posts'))
+        Post.objects.create(text='свежая', author=self.author)
+        response = self.client.get(reverse('api_posts'),
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['text'], 'свежая')
+
+    def test_thumbnail_urls(self):
+        byte_image = io.BytesIO()
+        Image.new('RGB', (400, 300), (0, 128, 0)).save(byte_image, 'jpeg')
+        post = Post.objects.create(
+            text='picture', author=self.author,
+            image=ContentFile(byte_image.getvalue(), name='picture.jpg'))
+        thumbnails.generate(post.image, post.image_width)
+        image = self.client.get(reverse('api_posts')).json()['results'][0][
+            'image']
+        self.assertEqual(image['url'], post.image.url)
+        self.assertEqual((image['width'], image['height']), (400, 300))
+        self.assertEqual([item['width'] for item in image['thumbnails']],
+                         [480, 720, 960])
+        self.assertTrue(all(item['url'].startswith(st.MEDIA_URL)
+                            for item in image['thumbnails']))
+
+    def test_benchmark_command(self):
+        out = io.StringIO()
+        call_command('bench_api', requests=2, cold=True, stdout=out)
+        self.assertIn('json', out.getvalue())
+        self.assertIn('group', out.getvalue())
+
+
+class TestBulkImport(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.existing = User.objects.create_user(username='old_timer')
+        self.reader = User.objects.create_user(username='reader')
+        Follow.objects.create(user=self.reader, author=self.existing)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def run_import(self, records, **options):
+        path = os.path.join(self.directory.name, 'dump.ndjson')
+        with open(path, 'w', encoding='utf-8') as dump:
+            for record in records:
+                dump.write((record if isinstance(record, str)
+                            else json.dumps(record, ensure_ascii=False))
+                           + '\n')
+        out, err = io.StringIO(), io.StringIO()
+        call_command('import_ndjson', path, stdout=out, stderr=err,
+                     **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_batch_locks_before_allocating_ids(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.run_import([{'type': 'group', 'slug': 'moved',
+                              'title': 'Переезд'}])
+        statements = [query['sql'] for query in queries]
+        lock = next(number for number, sql in enumerate(statements)
+                    if sql.startswith('UPDATE') and 'WHERE 0' in sql)
+        allocate = next(number for number, sql in enumerate(statements)
+                        if 'MAX(' in sql)
+        # MAX(pk) под блокировкой записи: сайт не займёт те же id
+        self.assertLess(lock, allocate)
+
+    def test_import_and_deferred_maintenance(self):
+        out, err = self.run_import([
+            {'type': 'user', 'username': 'migrant', 'first_name': 'Мигрант'},
+            {'type': 'user', 'username': 'old_timer'},
+            {'type': 'group', 'slug': 'moved', 'title': 'Переезд'},
+            {'type': 'post', 'id': 'p1', 'author': 'migrant',
+             'group': 'moved', 'text': 'переехали', 'pub_date':
+             '2015-03-01T10:00:00'},
+            {'type': 'post', 'id': 'p2', 'author': 'old_timer',
+             'text': 'старожил на месте'},
+            {'type': 'comment', 'post': 'p1', 'author': 'old_timer',
+             'text': 'с новосельем', 'created': '2015-03-02T10:00:00+00:00'},
+            {'type': 'follow', 'user': 'old_timer', 'author': 'migrant'},
+            {'type': 'follow', 'user': 'old_timer', 'author': 'migrant'},
+            {'type': 'post', 'author': 'nobody', 'text': 'потерянный'},
+            {'type': 'comment', 'post': 'p9', 'author': 'migrant',
+             'text': 'к чему?'},
+            {'type': 'user', 'username': 'плохое имя!'},
+            '{не json',
+        ], batch_size=4)
+        self.assertIn('post: 2', out)
+        self.assertIn('с ошибками: 4', out)
+        self.assertIn('строка 9: неизвестный автор: nobody', err)
+
+        migrant = User.objects.get(username='migrant')
+        self.assertEqual(User.objects.filter(username='old_timer').count(), 1)
+        self.assertFalse(migrant.has_usable_password())
+        post = Post.objects.get(text='переехали')
+        self.assertEqual(post.pub_date.year, 2015)
+        self.assertEqual(post.group.slug, 'moved')
+        self.assertEqual(post.comments.get().created.day, 2)
+        self.assertEqual(Follow.objects.filter(author=migrant).count(), 1)
+
+        self.assertEqual((get_stats(migrant).posts,
+                          get_stats(migrant).followers), (1, 1))
+        self.assertEqual(get_stats(self.existing).comments, 1)
+        self.assertEqual(list(search.search('переехали')), [post])
+        # ленты подписчиков: и старого, и нового
+        self.assertEqual(
+            list(timeline.feed(self.reader).values_list('text', flat=True)),
+            ['старожил на месте'])
+        self.assertIn('переехали',
+                      timeline.feed(self.existing)
+                      .values_list('text', flat=True))
+        self.assertContains(self.client.get(reverse('index')), 'переехали')
+
+
+class TestSeedAndBenchmark(TestCase):
+    def setUp(self):
+        cache.clear()
+        default.kvstore.clear()
+        self.media = tempfile.TemporaryDirectory()
+        self.override = override_settings(MEDIA_ROOT=self.media.name)
+        self.override.enable()
+
+    def tearDown(self):
+        self.override.disable()
+        self.media.cleanup()
+
+    def test_upload_benchmark_survives_errors(self):
+        # исключение в дочернем процессе не продолжает команду в нём,
+        # а приходит родителю: normalize для анимации возвращает None
+        result = bench_uploads._measure(lambda data: None, b'')
+        self.assertIn('TypeError', result['error'])
+        result = bench_uploads._measure(lambda data: data[:1], b'abc')
+        self.assertEqual(result['size'], 1)
+
+    def seed(self, **options):
+        options = {'users': 15, 'posts': 60, 'comments': 2, 'follows': 4,
+                   'groups': 3, 'images': 2, 'image_ratio': 0.5, **options}
+        call_command('seed_data', stdout=io.StringIO(), **options)
+
+    def test_seed_builds_skewed_graph(self):
+        self.seed()
+        self.assertEqual(User.objects.count(), 15)
+        self.assertEqual(Post.objects.count(), 60)
+        self.assertEqual(Comment.objects.count(), 120)
+        self.assertTrue(Follow.objects.exists())
+        counts = sorted(get_stats(user).posts for user in User.objects.all())
+        # степенной закон: у самого плодовитого сильно больше медианы
+        self.assertGreater(counts[-1], counts[len(counts) // 2] * 3)
+        with_images = Post.objects.exclude(image='')
+        self.assertTrue(with_images.exists())
+        self.assertFalse(with_images.filter(image_width=None).exists())
+        self.assertEqual(MediaBlob.objects.filter(refs__gt=0).count(), 2)
+
+    def test_seed_is_reproducible(self):
+        self.seed(images=0)
+        first = list(Post.objects.order_by('pk')
+                     .values_list('author__username', 'text'))
+        Post.objects.all().delete()
+        User.objects.all().delete()
+        self.seed(images=0)
+        self.assertEqual(list(Post.objects.order_by('pk')
+                              .values_list('author__username', 'text')),
+                         first)
+
+    def test_benchmark_report(self):
+        self.seed()
+        output = os.path.join(self.media.name, 'bench.json')
+        call_command('bench_views', requests=3, memory_samples=1,
+                     output=output)
+        with open(output, encoding='utf-8') as file:
+            report = json.load(file)
+        # 60 из seed_data, 3 замера new_post и 1 под tracemalloc
+        self.assertEqual(report['meta']['data']['posts'], 64)
+        self.assertEqual(set(report['results']),
+                         {'index', 'group_posts', 'profile', 'post_view',
+                          'follow_index', 'new_post', 'add_comment',
+                          'post_edit', 'follow'})
+        index = report['results']['index']
+        self.assertLessEqual(index['p50_ms'], index['p99_ms'])
+        self.assertEqual(index['statuses'], {'200': 3})
+        self.assertGreater(report['results']['new_post']['queries_mean'], 0)
+        err = io.StringIO()
+        call_command('bench_views', requests=2, memory_samples=0,
+                     only=['index'], compare=output, stdout=io.StringIO(),
+                     stderr=err)
+        self.assertIn('p95_ms', err.getvalue())
+
+
+class TestQueryBudgets(TestCase):
+    def setUp(self):
+        self.reader = User.objects.create_user(username='budget_reader')
+        self.authors = [User.objects.create_user(username=f'budget{i}')
+                        for i in range(2)]
+        self.group = Group.objects.create(title='Бюджет', slug='budget',
+                                          description='бюджет')
+        for author in self.authors:
+            Follow.objects.create(user=self.reader, author=author)
+            # счётчики профиля создаются при первом чтении, один раз
+            get_stats(author)
+        self.client.force_login(self.reader)
+
+    def add_posts(self, count):
+        for number in range(count):
+            for author in self.authors:
+                post = Post.objects.create(text=f'бюджетный пост {number}',
+                                           author=author, group=self.group)
+                for _ in range(2):
+                    Comment.objects.create(post=post, author=self.reader,
+                                           text='комментарий')
+        return post
+
+    def urls(self, post):
+        author = self.authors[0].username
+        return [
+            reverse('index'),
+            reverse('group', args=[self.group.slug]),
+            reverse('profile', args=[author]),
+            reverse('post', args=[post.author.username, post.pk]),
+            reverse('follow_index'),
+            reverse('search') + '?q=бюджетный',
+            reverse('api_posts'),
+            reverse('api_group_posts', args=[self.group.slug]),
+            reverse('api_profile_posts', args=[author]),
+            reverse('api_post', args=[post.pk]),
+            reverse('post_comments', args=[post.author.username, post.pk]),
+        ]
+
+    def test_budgets_do_not_grow_with_posts(self):
+        counts = {}
+        for size in (1, 3, 12):
+            post = self.add_posts(size)
+            for api_page_size in (2, 10):
+                with override_settings(API_PAGE_SIZE=api_page_size):
+                    for url in self.urls(post):
+                        cache.clear()
+                        default.kvstore.clear()
+                        response, queries = budgets.check_budget(
+                            self.client, url)
+                        self.assertEqual(response.status_code, 200, url)
+                        counts.setdefault(url, set()).add(len(queries))
+        for url, seen in counts.items():
+            # запросы на пост выдают себя разным числом на разных объёмах
+            self.assertEqual(len(seen), 1, msg=f'{url}: {sorted(seen)}')
+
+    def test_over_budget_fails(self):
+        post = self.add_posts(1)
+        with override_settings(QUERY_BUDGETS={'post': 1}):
+            with self.assertRaisesRegex(budgets.QueryBudgetExceeded,
+                                        'при бюджете 1'):
+                budgets.check_budget(self.client, reverse(
+                    'post', args=[post.author.username, post.pk]))
+            with self.assertRaisesRegex(budgets.QueryBudgetExceeded,
+                                        'нет бюджета'):
+                budgets.check_budget(self.client, reverse('index'))
+
+
+class TestStrictQueries(TestCase):
+    def setUp(self):
+        author = User.objects.create_user(username='lazy')
+        Post.objects.create(text='ленивый', author=author)
+
+    def test_lazy_access_in_template_raises(self):
+        post = Post.objects.get()
+        template = Template('{{ post.author.username }}')
+        with connection.execute_wrapper(budgets.forbid_lazy_queries):
+            with self.assertRaisesRegex(budgets.LazyQueryError,
+                                        'post.author.username'):
+                template.render(Context({'post': post}))
+            with self.assertRaisesRegex(budgets.LazyQueryError,
+                                        'post.comments.count'):
+                Template('{{ post.comments.count }}').render(
+                    Context({'post': post}))
+            # QuerySet из контекста — запрос представления, он разрешён
+            self.assertEqual(
+                Template('{% for item in posts %}{{ item.text }}{% endfor %}')
+                .render(Context({'posts': Post.objects.all()})), 'ленивый')
+            post = Post.objects.select_related('author').get()
+            self.assertEqual(template.render(Context({'post': post})),
+                             'lazy')
+
+    @override_settings(QUERY_STRICT=True)
+    def test_pages_for_logged_in_user(self):
+        # request.user ленивый: первое обращение из шаблона — не ошибка
+        from django.contrib.flatpages.models import FlatPage
+        from django.contrib.sites.models import Site
+        page = FlatPage.objects.create(url='/author/', title='Автор',
+                                       content='об авторе')
+        page.sites.add(Site.objects.get_current())
+        self.client.force_login(User.objects.get(username='lazy'))
+        self.assertEqual(self.client.get('/about/author/').status_code, 200)
+        self.assertEqual(self.client.get(reverse('signup')).status_code, 200)
+        self.assertEqual(self.client.get('/no-such-page/').status_code, 404)
+
+    @override_settings(QUERY_STRICT=False)
+    def test_disabled_outside_debug(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            budgets.StrictQueriesMiddleware(lambda request: None)
+
+
+class TestMetrics(TestCase):
+    def setUp(self):
+        cache.clear()
+        caches[metrics.CACHE_ALIAS].clear()
+        metrics.registry.reset()
+        self.staff = User.objects.create_user(username='metrics',
+                                              is_staff=True)
+        Post.objects.create(text='метрики', author=self.staff)
+
+    @override_settings(METRICS_SAMPLE_RATE=1)
+    def test_request_is_recorded(self):
+        self.client.get(reverse('index'))
+        self.client.get(reverse('index'))
+        stats = metrics.collect()['index']
+        histograms = dict(zip(metrics.HISTOGRAMS, stats.counts))
+        sums = dict(zip(metrics.HISTOGRAMS, stats.sums))
+        for name in metrics.HISTOGRAMS:
+            self.assertEqual(sum(histograms[name]), 2, name)
+        self.assertGreater(sums['sql_queries'], 0)
+        self.assertGreater(sums['template_render_seconds'], 0)
+        self.assertGreater(sums['response_size_bytes'], 1000)
+        self.assertEqual(dict(stats.statuses), {200: 2})
+        self.assertGreater(stats.cache_hits + stats.cache_misses, 0)
+
+    @override_settings(METRICS_SAMPLE_RATE=10)
+    def test_sampled_histograms_are_weighted(self):
+        for _ in range(20):
+            self.client.get(reverse('index'))
+        stats = metrics.collect()['index']
+        # измерены 2 ответа из 20, каждый с весом 10; коды — у всех
+        for counts in stats.counts:
+            self.assertEqual(sum(counts), 20)
+        self.assertEqual(dict(stats.statuses), {200: 20})
+
+    @override_settings(METRICS_SAMPLE_RATE=1)
+    def test_endpoint_is_protected(self):
+        self.client.get(reverse('index'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith(
+            'text/plain; version=0.0.4'))
+        text = response.content.decode()
+        self.assertIn('# TYPE yatube_request_duration_seconds histogram',
+                      text)
+        self.assertIn('yatube_request_duration_seconds_bucket'
+                      '{view="index",le="+Inf"} 1\n', text)
+        self.assertIn('yatube_requests_total{view="metrics",status="403"} 1',
+                      text)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_endpoint_token(self):
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(
+            url, HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+        self.assertEqual(self.client.get(
+            url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+
+    def test_workers_are_summed(self):
+        other = metrics.Registry()
+        for registry in (other, metrics.registry):
+            registry.count('index', 200)
+            registry.observe('index', (0.02, 3, 0.001, 0.005, 100), 1, 2)
+        other.flush()
+        # снимок накопительный: повторный сброс не удваивает счёт
+        other.flush()
+        stats = metrics.collect()['index']
+        self.assertNotEqual(other.slot, metrics.registry.slot)
+        self.assertEqual(stats.counts[0][metrics.TIME_BUCKETS.index(0.025)],
+                         2)
+        self.assertEqual(stats.cache_misses, 4)
+        self.assertEqual(dict(stats.statuses), {200: 2})
+
+    def expire_lease(self, registry):
+        caches[metrics.CACHE_ALIAS].delete(metrics._lease_key(registry.slot))
+
+    def test_dead_worker_slot_is_reused(self):
+        dead = metrics.Registry()
+        dead.count('index', 200)
+        dead.flush()
+        self.expire_lease(dead)
+        # новый процесс получает тот же слот вместе с накопленным
+        new = metrics.Registry()
+        new.count('index', 200)
+        new.flush()
+        self.assertEqual(new.slot, dead.slot)
+        self.assertEqual(dict(metrics.collect()['index'].statuses),
+                         {200: 2})
+
+    def test_lost_lease_does_not_double_count(self):
+        stalled = metrics.Registry()
+        stalled.count('index', 200)
+        stalled.flush()
+        self.expire_lease(stalled)
+        heir = metrics.Registry()
+        heir.flush()
+        self.assertEqual(heir.slot, stalled.slot)
+        # записанное унаследовано, у себя остаётся только новое
+        stalled.count('index', 200)
+        stalled.flush()
+        self.assertNotEqual(stalled.slot, heir.slot)
+        self.assertEqual(dict(metrics.collect()['index'].statuses),
+                         {200: 2})
+
+    @override_settings(METRICS_MAX_SLOTS=2)
+    def test_slots_are_capped(self):
+        workers = [metrics.Registry() for _ in range(3)]
+        with self.assertLogs('yatube.metrics', 'WARNING'):
+            for worker in workers:
+                worker.count('index', 200)
+                worker.flush()
+        self.assertIsNone(workers[2].slot)
+        self.expire_lease(workers[0])
+        # место освободилось: следующий сброс занимает его
+        workers[2].flush()
+        self.assertEqual(workers[2].slot, 1)
+        statuses = dict(metrics.collect()['index'].statuses)
+        self.assertEqual(statuses, {200: 3})
+
+    def test_overhead_benchmark(self):
+        # страницы не пустые: пост с комментариями, лента из нескольких
+        group = Group.objects.create(title='Метрики', slug='metrics',
+                                     description='метрики')
+        for number in range(5):
+            post = Post.objects.create(text=f'заметка {number}',
+                                       author=self.staff, group=group)
+        for number in range(20):
+            Comment.objects.create(post=post, author=self.staff,
+                                   text=f'комментарий {number}')
+        out = io.StringIO()
+        # по умолчанию команда завершается ошибкой при расходах больше 1%
+        call_command('bench_metrics', requests=2000, stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(set(report['results']), {'index', 'post',
+                                                  'api_posts'})
+        self.assertGreater(report['middleware_us'], 0)
+        self.assertLessEqual(report['max_overhead_pct'], 1)
+
+
+@override_settings(SLOW_QUERY_MS=0, SLOW_QUERY_INTERVAL=60)
+class TestSlowQueries(TestCase):
+    def setUp(self):
+        slow_queries._recent.clear()
+        self.author = User.objects.create_user(username='slow')
+        Post.objects.create(text='медленный', author=self.author)
+
+    def records(self, logs):
+        return [json.loads(record.getMessage()) for record in logs.records]
+
+    def test_fingerprint_ignores_values(self):
+        self.assertEqual(
+            slow_queries.fingerprint(
+                'SELECT * FROM t WHERE id IN (%s, %s) AND a = \'x\' LIMIT 20'),
+            slow_queries.fingerprint(
+                'SELECT  * FROM t WHERE id IN (%s) AND a = \'yy\' LIMIT 40'))
+        self.assertNotEqual(slow_queries.fingerprint('SELECT a FROM t'),
+                            slow_queries.fingerprint('SELECT b FROM t'))
+
+    def test_logged_with_plan_and_call_site(self):
+        with self.assertLogs('posts.slow_queries', 'WARNING') as logs, \
+                connection.execute_wrapper(slow_queries.log_slow_queries):
+            for _ in range(3):
+                list(Post.objects.filter(author=self.author))
+            with override_settings(SLOW_QUERY_INTERVAL=0):
+                list(Post.objects.filter(author=self.author))
+        first, second = self.records(logs)
+        self.assertEqual(first['fingerprint'], second['fingerprint'])
+        self.assertEqual(first['params'], [str(self.author.pk)])
+        self.assertEqual(first['call_site'],
+                         'posts/tests.py:test_logged_with_plan_and_call_site')
+        self.assertTrue(any('posts_post' in step for step in first['plan']))
+        # два запроса между записями пропущены, но учтены
+        self.assertEqual((first['suppressed'], second['suppressed']), (0, 2))
+
+    def test_template_call_site(self):
+        post = Post.objects.get()
+        template = Template('{{ post.author.username }}', origin=Origin(
+            'lazy', template_name='includes/lazy.html'))
+        with self.assertLogs('posts.slow_queries', 'WARNING') as logs, \
+                connection.execute_wrapper(slow_queries.log_slow_queries):
+            template.render(Context({'post': post}))
+        self.assertEqual(self.records(logs)[0]['call_site'],
+                         'includes/lazy.html')
+
+    def test_installed_only_when_enabled(self):
+        connection_stub = SimpleNamespace(execute_wrappers=[])
+        with override_settings(SLOW_QUERY_MS=None):
+            slow_queries.install(None, connection_stub)
+        self.assertEqual(connection_stub.execute_wrappers, [])
+        slow_queries.install(None, connection_stub)
+        slow_queries.install(None, connection_stub)
+        self.assertEqual(connection_stub.execute_wrappers,
+                         [slow_queries.log_slow_queries])
+
+    def test_summary_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'slow.log')
+            records = [
+                {'fingerprint': 'aaa', 'normalized': 'SELECT a',
+                 'duration_ms': 50, 'call_site': 'posts/views.py:index',
+                 'plan': ['SCAN posts_post'], 'suppressed': 3,
+                 'suppressed_ms': 150},
+                {'fingerprint': 'bbb', 'normalized': 'SELECT b',
+                 'duration_ms': 120, 'call_site': 'posts/views.py:profile',
+                 'plan': None, 'suppressed': 0, 'suppressed_ms': 0},
+            ]
+            with open(path, 'w', encoding='utf-8') as file:
+                for record in records:
+                    file.write(json.dumps(record) + '\n')
+                file.write('не json\n')
+            out, err = io.StringIO(), io.StringIO()
+            call_command('slow_queries', log=path, plans=True, stdout=out,
+                         stderr=err)
+        text = out.getvalue()
+        self.assertLess(text.index('aaa'), text.index('bbb'))
+        self.assertIn('всего 200.0 мс, запросов 4', text)
+        self.assertIn('| SCAN posts_post', text)
+        self.assertIn('1', err.getvalue())
+
+
+@override_settings(COMMENTS_PAGE_SIZE=20)
+class TestPaginatedComments(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='viral')
+        self.reader = User.objects.create_user(username='commenter')
+        self.post = Post.objects.create(text='вирусный', author=self.author)
+        Comment.objects.bulk_create(
+            Comment(post=self.post, author=self.reader, text=f'отклик {i}')
+            for i in range(45)
+        )
+        self.url = reverse('post', args=['viral', self.post.pk])
+
+    def ids(self, comments):
+        return [comment.pk for comment in comments]
+
+    def test_first_page_only(self):
+        response = self.client.get(self.url)
+        comments = response.context['comments']
+        self.assertIs(type(comments), QuerySet)
+        newest = list(Comment.objects.order_by('-created', '-pk')
+                      .values_list('pk', flat=True))
+        self.assertEqual(self.ids(comments), newest[:20])
+        self.assertContains(response, 'data-more-comments')
+
+    def test_load_more_html_and_json(self):
+        context = self.client.get(self.url).context
+        more_url, seen = context['more_url'], self.ids(context['comments'])
+        pages = 0
+        while more_url:
+            response = self.client.get(more_url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotContains(response, '<html')
+            seen += self.ids(response.context['comments'])
+            data = self.client.get(more_url + '&format=json').json()
+            self.assertEqual([item['id'] for item in data['comments']],
+                             self.ids(response.context['comments']))
+            more_url = response.context['more_url']
+            self.assertEqual(data['next'] is None, more_url is None)
+            pages += 1
+        self.assertEqual(pages, 2)
+        self.assertEqual(sorted(seen),
+                         sorted(Comment.objects.values_list('pk', flat=True)))
+
+    def test_invalid_cursor(self):
+        url = reverse('post_comments', args=['viral', self.post.pk])
+        self.assertEqual(self.client.get(url, {'after': '!'}).status_code,
+                         400)
+        self.assertEqual(self.client.get(
+            url, {'after': '!', 'format': 'json'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse(
+            'post_comments', args=['commenter', self.post.pk])).status_code,
+            404)
+
+    @override_settings(COMMENTS_PAGE_SIZE=1)
+    def test_json_keeps_hole_markers_as_text(self):
+        markers = ['<!--hole:AAAA-->', caching.hole_marker(
+            'includes/holes/nav_user.html', {})]
+        for text in markers + ['обычный']:
+            Comment.objects.create(post=self.post, author=self.reader,
+                                   text=text)
+        self.client.force_login(self.reader)
+        more_url = self.client.get(self.url).context['more_url'] + \
+            '&format=json'
+        texts = []
+        for _ in markers:
+            response = self.client.get(more_url)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            texts += [item['text'] for item in data['comments']]
+            more_url = data['next']
+        self.assertEqual(texts, markers[::-1])
+
+    def test_add_comment_refreshes_first_page(self):
+        self.client.get(self.url)
+        self.client.force_login(self.reader)
+        self.client.post(reverse('add_comment', args=['viral', self.post.pk]),
+                         {'text': 'свежий отклик'})
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['comments'][0].text,
+                         'свежий отклик')
+        self.assertContains(response, 'свежий отклик')
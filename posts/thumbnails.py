@@ -0,0 +1,173 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile
+
+from . import caching
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+# ширины карточки поста для srcset, пропорции как у исходной 960x339
+CARD_WIDTHS = (480, 720, 960, 1440)
+CARD_BASE_WIDTH = 960
+CARD_OPTIONS = {'crop': 'center', 'upscale': True}
+THUMBNAIL_SPECS = [
+    (width, f'{width}x{round(width * 339 / 960)}', CARD_OPTIONS)
+    for width in CARD_WIDTHS
+]
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = None
+
+
+def _pool():
+    global _executor, _slots
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.THUMBNAIL_WORKERS,
+                thread_name_prefix='thumbnails',
+            )
+            _slots = threading.BoundedSemaphore(settings.THUMBNAIL_QUEUE_SIZE)
+    return _executor, _slots
+
+
+def source(image):
+    """
+    Исходник для sorl: имя файла превращается в файл хранилища поста.
+
+    Ключи и имена миниатюр sorl зависят от хранилища исходника, поэтому
+    по имени и по полю модели должны получаться одни и те же.
+    """
+    if hasattr(image, 'storage'):
+        return image
+    return ImageFile(image, Post._meta.get_field('image').storage)
+
+
+def in_memory_db():
+    """С базой SQLite в памяти (тесты) потоки упираются в блокировки таблиц."""
+    return connection.vendor == 'sqlite' and connection.is_in_memory_db()
+
+
+def specs_for(image_width):
+    """
+    Варианты карточки для картинки шириной image_width.
+
+    Шире исходника не растягиваем: такие варианты весят больше, а чётче
+    не становятся. Базовый вариант есть всегда, как и раньше.
+    """
+    limit = max(image_width or CARD_BASE_WIDTH, CARD_BASE_WIDTH)
+    return [spec for spec in THUMBNAIL_SPECS if spec[0] <= limit]
+
+
+def thumbnail_file(image, geometry, options):
+    """
+    Файл миниатюры без обращения к KV-хранилищу и к исходнику.
+
+    Повторяет подготовку опций из ThumbnailBackend.get_thumbnail, чтобы
+    имя совпало с тем, что создаст sorl.
+    """
+    backend = default.backend
+    options = dict(options)
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    name = backend._get_thumbnail_filename(ImageFile(source(image)),
+                                           geometry, options)
+    return ImageFile(name, default.storage)
+
+
+def card_variants(image, image_width=None):
+    """
+    Готовые варианты карточки: [(ширина, ImageFile)] по возрастанию.
+
+    Базовый вариант при необходимости создаётся сразу, как это делал
+    тег {% thumbnail %}; остальные берутся только из KV-хранилища,
+    недостающие создаст фоновая очередь.
+    """
+    variants = []
+    for width, geometry, options in specs_for(image_width):
+        if width == CARD_BASE_WIDTH:
+            variants.append((width, get_thumbnail(source(image), geometry,
+                                                  **options)))
+            continue
+        cached = default.kvstore.get(thumbnail_file(image, geometry, options))
+        if cached is not None:
+            variants.append((width, cached))
+    return variants
+
+
+def prefetch(images):
+    """
+    Загружает сведения о миниатюрах карточек страницы разом.
+
+    images — пары (картинка, ширина исходника). Заодно переносит
+    счётчики KV-хранилища процесса в общие (`cache_stats`), чтобы
+    не писать в кэш на каждое обращение.
+    """
+    kvstore = default.kvstore
+    if not hasattr(kvstore, 'prefetch'):
+        return
+    kvstore.prefetch([
+        thumbnail_file(image, geometry, options)
+        for image, image_width in images if image
+        for _, geometry, options in specs_for(image_width)
+    ])
+    for tier, amount in kvstore.take_stats().items():
+        caching.count(f'thumbnail_kv_{tier}', amount)
+
+
+def generate(image, image_width=None):
+    """Создаёт все миниатюры изображения, существующие пропускаются."""
+    created = 0
+    for _, geometry, options in specs_for(image_width):
+        try:
+            get_thumbnail(source(image), geometry, **options)
+            created += 1
+        except Exception:
+            logger.exception('Не удалось создать миниатюру %s для %s',
+                             geometry, image)
+    return created
+
+
+def _run(name, image_width, slots):
+    try:
+        generate(name, image_width)
+    finally:
+        slots.release()
+        close_old_connections()
+
+
+def enqueue(image, image_width=None):
+    """
+    Ставит генерацию миниатюр в очередь после фиксации транзакции.
+
+    Очередь ограничена THUMBNAIL_QUEUE_SIZE: если она заполнена, задача
+    отбрасывается и миниатюра будет создана при первом показе.
+    """
+    if not image:
+        return
+    name = image.name
+
+    def submit():
+        if not settings.THUMBNAIL_WORKERS or in_memory_db():
+            generate(name, image_width)
+            return
+        executor, slots = _pool()
+        if not slots.acquire(blocking=False):
+            logger.warning('Очередь миниатюр заполнена, пропускаю %s', name)
+            return
+        executor.submit(_run, name, image_width, slots)
+
+    transaction.on_commit(submit)
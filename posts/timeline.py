@@ -0,0 +1,158 @@
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, F, Q
+
+from .models import Follow, Post, TimelineEntry
+
+FEED_ORDERING = ('-feed_date', '-feed_id')
+
+
+def _entries(posts, user_ids):
+    return [
+        TimelineEntry(user_id=user_id, post_id=post.id,
+                      author_id=post.author_id, pub_date=post.pub_date)
+        for post in posts for user_id in user_ids
+    ]
+
+
+def is_pull_author(author_id):
+    return Follow.objects.filter(author_id=author_id, pull=True).exists()
+
+
+def fan_out(post):
+    if is_pull_author(post.author_id):
+        return
+    followers = Follow.objects.filter(author_id=post.author_id) \
+        .values_list('user_id', flat=True).iterator()
+    batch = []
+    for user_id in followers:
+        batch.append(user_id)
+        if len(batch) >= settings.TIMELINE_BATCH_SIZE:
+            TimelineEntry.objects.bulk_create(_entries([post], batch),
+                                              ignore_conflicts=True)
+            batch = []
+    if batch:
+        TimelineEntry.objects.bulk_create(_entries([post], batch),
+                                          ignore_conflicts=True)
+
+
+def promote_to_pull(author_id):
+    """
+    Переводит автора в режим чтения. Его записи в лентах остаются, но
+    не нужны: посты «тянущих» авторов лента берёт напрямую. Записей
+    может быть TIMELINE_FANOUT_LIMIT × TIMELINE_BACKFILL, поэтому
+    удаляет их не запрос подписки, а prune_pulled (команда
+    prune_timeline).
+    """
+    Follow.objects.filter(author_id=author_id).update(pull=True)
+
+
+def prune_pulled(author_ids=None):
+    """
+    Удаляет записи лент «тянущих» авторов (по умолчанию всех) пачками
+    по TIMELINE_BATCH_SIZE, каждая пачка — короткий DELETE. Возвращает
+    число удалённых записей.
+    """
+    if author_ids is None:
+        author_ids = Follow.objects.filter(pull=True).values('author_id')
+    entries = TimelineEntry.objects.filter(author_id__in=author_ids) \
+        .values_list('pk', flat=True)
+    deleted = 0
+    while True:
+        batch = list(entries[:settings.TIMELINE_BATCH_SIZE])
+        if not batch:
+            return deleted
+        deleted += TimelineEntry.objects.filter(pk__in=batch).delete()[0]
+
+
+def add_follow(follow):
+    if follow.pull:
+        return
+    if is_pull_author(follow.author_id):
+        follow.pull = True
+        Follow.objects.filter(pk=follow.pk).update(pull=True)
+        return
+    followers = Follow.objects.filter(author_id=follow.author_id).count()
+    if followers > settings.TIMELINE_FANOUT_LIMIT:
+        promote_to_pull(follow.author_id)
+        return
+    posts = Post.objects.filter(author_id=follow.author_id) \
+        .only('id', 'author_id', 'pub_date') \
+        .order_by('-pub_date')[:settings.TIMELINE_BACKFILL]
+    TimelineEntry.objects.bulk_create(_entries(posts, [follow.user_id]),
+                                      ignore_conflicts=True)
+
+
+def backfill(author_ids):
+    """
+    Раскладывает посты авторов по лентам подписчиков без сигналов,
+    например после массовой загрузки.
+
+    Каждый подписчик получает последние TIMELINE_BACKFILL постов автора
+    одним INSERT ... SELECT на пачку авторов. Авторы с числом подписчиков
+    больше TIMELINE_FANOUT_LIMIT, как и уже «тянущие», переводятся
+    в режим чтения целиком.
+    """
+    author_ids = list(author_ids)
+    for start in range(0, len(author_ids), 500):
+        batch = author_ids[start:start + 500]
+        pull_authors = Follow.objects.filter(author_id__in=batch) \
+            .values('author_id').annotate(
+                total=Count('pk'), pulls=Count('pk', filter=Q(pull=True))) \
+            .filter(Q(total__gt=settings.TIMELINE_FANOUT_LIMIT)
+                    | Q(pulls__gt=0)) \
+            .values_list('author_id', flat=True)
+        pull_authors = list(pull_authors)
+        for author_id in pull_authors:
+            promote_to_pull(author_id)
+        prune_pulled(pull_authors)
+        placeholders = ', '.join(['%s'] * len(batch))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'''
+                INSERT OR IGNORE INTO {TimelineEntry._meta.db_table}
+                    (user_id, post_id, author_id, pub_date)
+                SELECT follow.user_id, recent.id, recent.author_id,
+                       recent.pub_date
+                FROM (
+                    SELECT id, author_id, pub_date, ROW_NUMBER() OVER (
+                        PARTITION BY author_id ORDER BY pub_date DESC, id DESC
+                    ) AS position
+                    FROM {Post._meta.db_table}
+                    WHERE author_id IN ({placeholders})
+                ) AS recent
+                JOIN {Follow._meta.db_table} AS follow
+                    ON follow.author_id = recent.author_id
+                    AND follow.pull = %s
+                WHERE recent.position <= %s
+                ''',
+                [*batch, False, settings.TIMELINE_BACKFILL],
+            )
+
+
+def remove_follow(follow):
+    TimelineEntry.objects.filter(user_id=follow.user_id,
+                                 author_id=follow.author_id).delete()
+
+
+def feed(user):
+    """
+    Лента подписок, упорядоченная по FEED_ORDERING.
+
+    Без «тянущих» авторов это один проход по индексу ленты пользователя.
+    """
+    pull_authors = list(
+        user.follower.filter(pull=True).values_list('author_id', flat=True)
+    )
+    if not pull_authors:
+        posts = Post.objects.filter(timeline__user=user).annotate(
+            feed_date=F('timeline__pub_date'),
+            feed_id=F('timeline__post_id'),
+        )
+    else:
+        posts = Post.objects.filter(
+            Q(id__in=TimelineEntry.objects.filter(user=user)
+              .values('post_id'))
+            | Q(author_id__in=pull_authors)
+        ).annotate(feed_date=F('pub_date'), feed_id=F('id'))
+    return posts.order_by(*FEED_ORDERING)
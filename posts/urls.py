@@ -1,14 +1,23 @@
 from django.urls import path
 
-from . import views
+from . import api, views
 
 urlpatterns = [
+    path('api/v1/posts/', api.posts, name='api_posts'),
+    path('api/v1/posts/<int:post_id>/', api.post_detail, name='api_post'),
+    path('api/v1/groups/<str:slug>/posts/', api.group_posts,
+         name='api_group_posts'),
+    path('api/v1/users/<str:username>/posts/', api.profile_posts,
+         name='api_profile_posts'),
     path('new/', views.new_post, name='new_post'),
     path("follow/", views.follow_index, name="follow_index"),
     path('group/<str:slug>', views.group_posts, name='group'),
+    path('search/', views.search_posts, name='search'),
     path('<str:username>/', views.profile, name='profile'),
     # Просмотр записи
     path('<str:username>/<int:post_id>/', views.post_view, name='post'),
+    path('<str:username>/<int:post_id>/comments/', views.post_comments,
+         name='post_comments'),
     path('<str:username>/<int:post_id>/comment',
          views.add_comment, name='add_comment'),
     path('<str:username>/<int:post_id>/edit/',
@@ -1,10 +1,19 @@
+from urllib.parse import urlencode
+
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
+from django.http import HttpResponseBadRequest
 from django.shortcuts import get_object_or_404, redirect, render
-from django.views.decorators.cache import cache_page
+from django.views.decorators.http import require_safe
 
+from . import api, search, timeline
+from .caching import attach_cards, cached_view
+from .feeds import (COMMENT_ORDERING, attach_comment_counts, comments_url,
+                    prepare_page)
 from .forms import CommentForm, PostForm
 from .models import Comment, Follow, Group, Post, User
+from .pagination import CursorPaginator, InvalidCursor, paginate
+from .stats import get_stats
 
 
 def page_not_found(request, exception):
@@ -20,30 +29,56 @@ def server_error(request):
     return render(request, "misc/500.html", status=500)
 
 
-@cache_page(20, key_prefix='index_page')
+@cached_view(lambda request: ['global', 'groups'])
 def index(request):
     post_list = Post.objects.select_related('author', 'group'). \
-        order_by('-pub_date').all().prefetch_related('comments')
-    paginator = Paginator(post_list, 2)
-    page_number = request.GET.get('page', 1)
-    page = paginator.get_page(page_number)
+        order_by('-pub_date').all()
+    page, paginator = paginate(request, post_list, 2)
+    prepare_page(page)
     return render(request, 'index.html',
                   {'page': page, 'paginator': paginator})
 
 
+@cached_view(lambda request, slug: [f'group:{slug}', 'groups'])
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
     post_list = group.group_posts. \
         select_related('author', 'group'). \
-        order_by("-pub_date").all().prefetch_related('comments')
-    paginator = Paginator(post_list, 2)
-    page_number = request.GET.get('page', 1)
-    page = paginator.get_page(page_number)
+        order_by("-pub_date").all()
+    page, paginator = paginate(request, post_list, 2)
+    prepare_page(page)
     return render(request, "group.html", {"page": page,
                                           "paginator": paginator,
                                           "group": group})
 
 
+@cached_view(lambda request: ['global', 'groups'])
+def search_posts(request):
+    query = request.GET.get('q', '').strip()
+    filters = {'group__slug': request.GET.get('group'),
+               'author__username': request.GET.get('author')}
+    post_list = search.search(
+        query, Post.objects.select_related('author', 'group'))
+    for lookup, value in filters.items():
+        if value:
+            post_list = post_list.filter(**{lookup: value})
+    # общее число совпадений не считаем, поэтому только курсоры
+    paginator = CursorPaginator(post_list, 10)
+    page = paginator.get_page(after=request.GET.get('after'),
+                              before=request.GET.get('before'))
+    prepare_page(page)
+    params = {'q': query, 'group': filters['group__slug'],
+              'author': filters['author__username']}
+    return render(request, 'search.html', {
+        'query': query,
+        'page': page,
+        'paginator': paginator,
+        'facets': search.facets(post_list) if query else None,
+        'params': urlencode({key: value for key, value in params.items()
+                             if value}),
+    })
+
+
 @login_required
 def new_post(request):
     form = PostForm(request.POST or None,
@@ -60,52 +95,90 @@ def new_post(request):
                                              'post': None})
 
 
+@cached_view(lambda request, username: [f'author:{username}', 'groups'])
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
+    author = get_object_or_404(User.objects.select_related('stats'),
+                               username=username)
     post_list = author.posts.all(). \
         select_related('author', 'group'). \
-        order_by('-pub_date').all().prefetch_related('comments')
-    paginator = Paginator(post_list, 5)
-    page_number = request.GET.get('page', 1)
-    page = paginator.get_page(page_number)
-    following = False
-    if request.user.is_authenticated:
-        following = request.user.follower.filter(author=author).exists()
+        order_by('-pub_date').all()
+    page, paginator = paginate(request, post_list, 5)
+    prepare_page(page)
     return render(request,
                   'profile.html',
                   {
                       'author': author,
+                      'stats': get_stats(author),
                       'page': page,
                       'paginator': paginator,
                       'user': request.user,
-                      'following': following
                   }
                   )
 
 
+@cached_view(lambda request, username, post_id: [
+    f'post:{post_id}', f'author:{username}', 'groups'])
 def post_view(request, username, post_id):
-    author = get_object_or_404(User, username=username)
-    post = get_object_or_404(Post, pk=post_id)
-    post_count = author.posts.count()
-    following = False
-    if request.user.is_authenticated:
-        following = request.user.follower.filter(author=author).exists()
+    # автор, его счётчики и группа — одним запросом вместе с постом
+    post = get_object_or_404(
+        Post.objects.select_related('author__stats', 'group'),
+        pk=post_id, author__username=username,
+    )
+    author = post.author
+    if attach_cards([post])[0].cached_card is None:
+        attach_comment_counts([post])
+    stats = get_stats(author)
     form = CommentForm(None)
-    comments = post.comments. \
-        select_related('author').order_by('-created').all()
+    # только первая страница: остальные подгружает post_comments
+    comments = post.comments.select_related('author') \
+        .order_by(*COMMENT_ORDERING)[:settings.COMMENTS_PAGE_SIZE]
+    more_url = None
+    # полная страница — вероятно, есть ещё; лишней строки не выбираем
+    if len(comments) == settings.COMMENTS_PAGE_SIZE:
+        more_url = comments_url(username, post_id, CursorPaginator(
+            post.comments.all(), settings.COMMENTS_PAGE_SIZE,
+            COMMENT_ORDERING,
+        ).encode_cursor(comments[len(comments) - 1]))
     return render(request, 'post.html',
                   {
                       'post': post,
                       'author': author,
                       'user': request.user,
-                      'post_count': post_count,
+                      'stats': stats,
+                      'post_count': stats.posts,
                       'form': form,
                       'comments': comments,
-                      'following': following
+                      'more_url': more_url,
                   }
                   )
 
 
+@require_safe
+def post_comments(request, username, post_id):
+    """Следующая страница комментариев: HTML-фрагмент или ?format=json."""
+    if request.GET.get('format') == 'json':
+        # JSON кэшируется отдельно: в нём нет «дырок», а текст
+        # комментариев не экранирован и не должен их заполнять
+        return api.post_comments(request, username, post_id)
+    return comments_fragment(request, username, post_id)
+
+
+@cached_view(lambda request, username, post_id: [f'post:{post_id}'])
+def comments_fragment(request, username, post_id):
+    post = get_object_or_404(Post.objects.only('pk'), pk=post_id,
+                             author__username=username)
+    paginator = CursorPaginator(post.comments.select_related('author'),
+                                settings.COMMENTS_PAGE_SIZE, COMMENT_ORDERING)
+    try:
+        page = paginator.page(after=request.GET.get('after'))
+    except InvalidCursor:
+        return HttpResponseBadRequest('Неверный курсор')
+    more_url = comments_url(username, post_id, page.next_cursor) \
+        if page.has_next() else None
+    return render(request, 'includes/comment_list.html',
+                  {'comments': page, 'more_url': more_url})
+
+
 @login_required
 def post_edit(request, username, post_id):
     author = get_object_or_404(User, username=username)
@@ -144,12 +217,9 @@ def add_comment(request, username, post_id):
 
 @login_required
 def follow_index(request):
-    posts = Post.objects.select_related('author', 'group').\
-        order_by('-pub_date').filter(author__following__user=request.user).\
-        prefetch_related('comments')
-    paginator = Paginator(posts, 5)
-    page_number = request.GET.get('page', 1)
-    page = paginator.get_page(page_number)
+    posts = timeline.feed(request.user).select_related('author', 'group')
+    page, paginator = paginate(request, posts, 5, timeline.FEED_ORDERING)
+    prepare_page(page)
     return render(request, 'follow.html',
                   {'page': page, 'paginator': paginator})
 
@@ -0,0 +1,377 @@
+import itertools
+import logging
+import os
+import secrets
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.http import HttpResponse, HttpResponseForbidden
+from django.template.backends.django import DjangoTemplates
+from django.utils.crypto import constant_time_compare
+
+PREFIX = 'yatube_'
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1,
+                2.5, 5)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+# имя: (описание, границы корзин); корзины фиксированы, поэтому объём
+# данных не зависит от числа запросов
+HISTOGRAMS = {
+    'request_duration_seconds': ('Время ответа', TIME_BUCKETS),
+    'sql_queries': ('Запросов к базе на ответ', COUNT_BUCKETS),
+    'sql_duration_seconds': ('Время запросов к базе на ответ',
+                             TIME_BUCKETS),
+    'template_render_seconds': ('Время отрисовки шаблонов на ответ',
+                                TIME_BUCKETS),
+    'response_size_bytes': ('Размер ответа', SIZE_BUCKETS),
+}
+# имя: (описание, значение из ViewStats)
+COUNTERS = {
+    'requests_total': ('Ответов по кодам', None),
+    'cache_hits_total': ('Найдено ключей в кэше',
+                         lambda stats: stats.cache_hits),
+    'cache_misses_total': ('Не найдено ключей в кэше',
+                           lambda stats: stats.cache_misses),
+}
+# отдельный кэш (CACHES['metrics']): в общем LRU вытеснил бы слоты
+CACHE_ALIAS = 'metrics'
+# аренда слота живёт столько интервалов сброса
+LEASE_INTERVALS = 3
+
+logger = logging.getLogger(__name__)
+_local = threading.local()
+
+
+def _slot_key(slot):
+    return f'metrics:slot:{slot}'
+
+
+def _lease_key(slot):
+    return f'metrics:lease:{slot}'
+
+
+class RequestStats:
+    __slots__ = ('queries', 'sql_time', 'template_time', 'rendering',
+                 'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        self.queries = self.cache_hits = self.cache_misses = 0
+        self.sql_time = self.template_time = 0.0
+        self.rendering = False
+
+
+class ViewStats:
+    """Корзины и суммы гистограмм (в порядке HISTOGRAMS) и счётчики URL."""
+    __slots__ = ('counts', 'sums', 'statuses', 'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        self.counts = [[0] * (len(buckets) + 1)
+                       for _, buckets in HISTOGRAMS.values()]
+        self.sums = [0] * len(HISTOGRAMS)
+        self.statuses = defaultdict(int)
+        self.cache_hits = self.cache_misses = 0
+
+    def add(self, other, sign=1):
+        for counts, more in zip(self.counts, other.counts):
+            for index, count in enumerate(more):
+                counts[index] += count * sign
+        self.sums = [a + b * sign for a, b in zip(self.sums, other.sums)]
+        for status, count in other.statuses.items():
+            self.statuses[status] += count * sign
+        self.cache_hits += other.cache_hits * sign
+        self.cache_misses += other.cache_misses * sign
+
+
+_BUCKETS = [buckets for _, buckets in HISTOGRAMS.values()]
+
+
+def _drain(queue):
+    # только то, что было в очереди к началу: дописанное другими потоками
+    # останется до следующего раза
+    return [queue.popleft() for _ in range(len(queue))]
+
+
+class Registry:
+    """
+    Гистограммы и счётчики процесса.
+
+    Ответ только дописывает наблюдение в очередь (deque.append атомарен,
+    блокировка не нужна), по корзинам их раскладывает `snapshot` при
+    сбросе. Метрики заполняются по выборке: каждое наблюдение идёт
+    с весом METRICS_SAMPLE_RATE, так что суммы и _count оценивают все
+    ответы, а не только измеренные. Ошибки (код от 400) считаются все.
+
+    Раз в METRICS_FLUSH_INTERVAL секунд процесс записывает накопленное
+    в свой слот кэша CACHES['metrics'] одним set. Слотов не больше
+    METRICS_MAX_SLOTS: процесс берёт свободный в аренду (атомарный add)
+    и продлевает её при каждом сбросе. Слот завершившегося процесса
+    по истечении аренды достаётся новому вместе с накопленным, поэтому
+    счётчики не убывают, а /metrics/ читает не больше METRICS_MAX_SLOTS
+    ключей.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.views = {}
+        self.slot = self.token = None
+        # снимок, записанный в слот последним
+        self.written = {}
+        self.flushed = time.monotonic()
+        self.statuses = deque()
+        self.samples = deque()
+
+    def count(self, view, status, weight=1):
+        self.statuses.append((view, status, weight))
+
+    def observe(self, view, values, hits, misses, weight=1):
+        """values — значения гистограмм в порядке HISTOGRAMS."""
+        self.samples.append((view, values, hits, misses, weight))
+
+    def _stats(self, view):
+        stats = self.views.get(view)
+        if stats is None:
+            stats = self.views[view] = ViewStats()
+        return stats
+
+    def _fold(self):
+        for view, status, weight in _drain(self.statuses):
+            self._stats(view).statuses[status] += weight
+        for view, values, hits, misses, weight in _drain(self.samples):
+            stats = self._stats(view)
+            for number, (buckets, value) in enumerate(zip(_BUCKETS, values)):
+                if value is not None:
+                    stats.counts[number][bisect_left(buckets, value)] += weight
+                    stats.sums[number] += value * weight
+            stats.cache_hits += hits * weight
+            stats.cache_misses += misses * weight
+
+    def _merge(self, views, sign=1):
+        with self.lock:
+            self._fold()
+            for view, stats in views.items():
+                self._stats(view).add(stats, sign)
+
+    def snapshot(self):
+        with self.lock:
+            self._fold()
+            snapshot = {}
+            for view, stats in self.views.items():
+                copy = snapshot[view] = ViewStats()
+                copy.add(stats)
+            return snapshot
+
+    def _lease(self):
+        return settings.METRICS_FLUSH_INTERVAL * LEASE_INTERVALS
+
+    def _renew(self, store):
+        key = _lease_key(self.slot)
+        return store.get(key) == self.token \
+            and store.touch(key, self._lease())
+
+    def _claim(self, store):
+        token = secrets.token_hex(8)
+        for slot in range(1, settings.METRICS_MAX_SLOTS + 1):
+            if store.add(_lease_key(slot), token, self._lease()):
+                # накопленное прежним владельцем продолжает считать новый
+                self._merge(store.get(_slot_key(slot)) or {})
+                self.slot, self.token = slot, token
+                return
+        logger.warning('Нет свободного слота метрик из %s, процесс %s '
+                       'пока не виден в /metrics/',
+                       settings.METRICS_MAX_SLOTS, os.getpid())
+
+    def flush(self):
+        store = caches[CACHE_ALIAS]
+        if self.slot is not None and not self._renew(store):
+            # аренда истекла, и записанное в слот мог унаследовать другой
+            # процесс: у себя оставляем только накопленное после записи
+            self._merge(self.written, -1)
+            self.slot = self.token = None
+            self.written = {}
+        if self.slot is None:
+            self._claim(store)
+        if self.slot is not None:
+            self.written = self.snapshot()
+            store.set(_slot_key(self.slot), self.written, None)
+        self.flushed = time.monotonic()
+
+    def maybe_flush(self):
+        if time.monotonic() - self.flushed >= settings.METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+
+registry = Registry()
+# накопленное родителем до fork() посчиталось бы в детях повторно
+os.register_at_fork(after_in_child=registry.reset)
+
+
+def record_cache(hits, misses):
+    """Вызывается бэкендом кэша; вне запроса ничего не делает."""
+    stats = getattr(_local, 'stats', None)
+    if stats is not None:
+        stats.cache_hits += hits
+        stats.cache_misses += misses
+
+
+def _time_query(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats = getattr(_local, 'stats', None)
+        if stats is not None:
+            stats.queries += 1
+            stats.sql_time += time.perf_counter() - started
+
+
+class TimedTemplate:
+    """Шаблон бэкенда, время отрисовки которого идёт в метрики ответа."""
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        stats = getattr(_local, 'stats', None)
+        if stats is None or stats.rendering:
+            # вложенные шаблоны уже входят во время внешнего
+            return self.template.render(context, request)
+        stats.rendering = True
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            stats.rendering = False
+            stats.template_time += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+def _view_name(request):
+    match = request.resolver_match
+    return match.view_name if match is not None else 'unresolved'
+
+
+class MetricsMiddleware:
+    """
+    Время ответа, запросы к базе, отрисовка шаблонов, попадания в кэш
+    и размер ответа по имени URL. Измеряется каждый
+    METRICS_SAMPLE_RATE-й ответ, у остальных считаются только ошибки;
+    в общий кэш пишет `Registry.flush` не чаще раза
+    в METRICS_FLUSH_INTERVAL.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.rate = settings.METRICS_SAMPLE_RATE
+        # номер ответа для выборки; next() атомарен
+        self.responses = itertools.count()
+
+    def __call__(self, request):
+        rate = self.rate
+        if next(self.responses) % rate:
+            response = self.get_response(request)
+            if response.status_code >= 400:
+                registry.count(_view_name(request), response.status_code)
+            return response
+        stats = _local.stats = RequestStats()
+        started = time.perf_counter()
+        # то же, что connection.execute_wrapper, без контекстного менеджера
+        wrappers = connection.execute_wrappers
+        wrappers.append(_time_query)
+        try:
+            response = self.get_response(request)
+        finally:
+            wrappers.remove(_time_query)
+            _local.stats = None
+        elapsed = time.perf_counter() - started
+        view = _view_name(request)
+        status = response.status_code
+        registry.count(view, status, 1 if status >= 400 else rate)
+        registry.observe(
+            view,
+            (elapsed, stats.queries, stats.sql_time, stats.template_time,
+             None if response.streaming else len(response.content)),
+            stats.cache_hits, stats.cache_misses, rate,
+        )
+        # сброс проверяется только в измеряемых ответах
+        registry.maybe_flush()
+        return response
+
+
+def collect():
+    """Сумма слотов всех процессов, включая только что сброшенный свой."""
+    registry.flush()
+    keys = [_slot_key(slot)
+            for slot in range(1, settings.METRICS_MAX_SLOTS + 1)]
+    views = defaultdict(ViewStats)
+    for snapshot in caches[CACHE_ALIAS].get_many(keys).values():
+        for view, stats in snapshot.items():
+            views[view].add(stats)
+    return dict(views)
+
+
+def _label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"') \
+        .replace('\n', r'\n')
+
+
+def render(views):
+    """Текстовый формат Prometheus 0.0.4."""
+    views = sorted((_label(view), stats) for view, stats in views.items())
+    lines = []
+    for index, (name, (description, buckets)) in enumerate(
+            HISTOGRAMS.items()):
+        metric = PREFIX + name
+        lines += [f'# HELP {metric} {description}',
+                  f'# TYPE {metric} histogram']
+        for view, stats in views:
+            cumulative = 0
+            for bound, count in zip(buckets + ('+Inf',),
+                                    stats.counts[index]):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{view="{view}",le="{bound}"}} '
+                             f'{cumulative}')
+            lines.append(f'{metric}_sum{{view="{view}"}} '
+                         f'{stats.sums[index]}')
+            lines.append(f'{metric}_count{{view="{view}"}} {cumulative}')
+    for name, (description, value) in COUNTERS.items():
+        metric = PREFIX + name
+        lines += [f'# HELP {metric} {description}',
+                  f'# TYPE {metric} counter']
+        for view, stats in views:
+            if name == 'requests_total':
+                lines += [f'{metric}{{view="{view}",status="{status}"}} '
+                          f'{count}'
+                          for status, count in sorted(stats.statuses.items())]
+            else:
+                lines.append(f'{metric}{{view="{view}"}} {value(stats)}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """Метрики для Prometheus: по токену METRICS_TOKEN или сотрудникам."""
+    token = settings.METRICS_TOKEN
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    if not (token and constant_time_compare(header, f'Bearer {token}')
+            or request.user.is_staff):
+        return HttpResponseForbidden()
+    return HttpResponse(render(collect()),
+                        content_type='text/plain; version=0.0.4; '
+                                     'charset=utf-8')
@@ -52,6 +52,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'debug_toolbar.middleware.DebugToolbarMiddleware',
+    'yatube.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -59,6 +60,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'posts.budgets.StrictQueriesMiddleware',
 ]
 
 ROOT_URLCONF = 'yatube.urls'
@@ -66,7 +68,7 @@ ROOT_URLCONF = 'yatube.urls'
 TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'yatube.metrics.TimedDjangoTemplates',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -81,10 +83,27 @@ TEMPLATES = [
     },
 ]
 
+# Общий для всех воркеров кэш в файле SQLite (см. yatube/sqlite_cache.py)
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+        'BACKEND': 'yatube.sqlite_cache.SQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache.sqlite3'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'MAX_BYTES': 256 * 1024 * 1024,
+        },
+    },
+    # слоты метрик (yatube/metrics.py): их не больше METRICS_MAX_SLOTS
+    # с арендами, и пределы заведомо не достигаются — из LRU
+    # не вытесняется ничего
+    'metrics': {
+        'BACKEND': 'yatube.sqlite_cache.SQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'metrics.sqlite3'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+            'MAX_BYTES': 256 * 1024 * 1024,
+        },
+    },
 }
 
 WSGI_APPLICATION = 'yatube.wsgi.application'
@@ -154,3 +173,120 @@ SITE_ID = 1
 INTERNAL_IPS = [
     '127.0.0.1',
 ]
+
+# 'offset' — классический Paginator с номерами страниц,
+# 'cursor' — keyset-пагинация по (pub_date, id) без COUNT(*)
+FEED_PAGINATION = 'offset'
+
+# Лента подписок материализуется при записи (fan-out). Авторы, у которых
+# подписчиков больше TIMELINE_FANOUT_LIMIT, переводятся в режим чтения
+# при запросе ленты; их старые записи в лентах удаляет пачками по
+# TIMELINE_BATCH_SIZE команда prune_timeline (запускать по расписанию).
+# При подписке в ленту попадают последние TIMELINE_BACKFILL постов автора.
+TIMELINE_FANOUT_LIMIT = 10000
+TIMELINE_BACKFILL = 200
+TIMELINE_BATCH_SIZE = 1000
+
+# Размер страницы лент в JSON API (/api/v1/)
+API_PAGE_SIZE = 20
+
+# Комментариев на странице поста и в каждой подгрузке «Показать ещё»
+COMMENTS_PAGE_SIZE = 20
+
+# Сколько последних комментариев показывать под постом в лентах (0 — нисколько)
+FEED_COMMENT_PREVIEW = 0
+
+# Страницы кэшируются под версионными ключами, которые сбрасываются при
+# записи, поэтому срок жизни может быть большим
+FEED_CACHE_TIMEOUT = 60 * 60 * 6
+
+# Миниатюры загруженных картинок создаются в фоне пулом из THUMBNAIL_WORKERS
+# потоков (0 — сразу в запросе); в очереди не больше THUMBNAIL_QUEUE_SIZE задач
+THUMBNAIL_WORKERS = 2
+THUMBNAIL_QUEUE_SIZE = 100
+
+# Загруженные к постам картинки уменьшаются до POST_IMAGE_MAX_SIDE пикселей
+# по большей стороне и перекодируются в POST_IMAGE_FORMAT без метаданных.
+# Растр больше POST_IMAGE_MAX_PIXELS не декодируется: JPEG сравнивается
+# в уменьшенном при чтении масштабе, остальные форматы — в полном
+POST_IMAGE_MAX_SIDE = 2048
+POST_IMAGE_MAX_PIXELS = 20 * 10 ** 6
+POST_IMAGE_FORMAT = 'WEBP'
+POST_IMAGE_QUALITY = 85
+
+# Сведения о миниатюрах sorl-thumbnail: последние записи держатся в памяти
+# процесса, остальные в кэше и базе
+THUMBNAIL_KVSTORE = 'yatube.thumbnail_kvstore.KVStore'
+THUMBNAIL_KVSTORE_LRU_SIZE = 10000
+
+# Сессии читаются из общего кэша, в базу только запись: условный GET
+# залогиненного пользователя обходится одним запросом за пользователем
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# Сколько запросов к базе может сделать страница (по имени URL) с пустым
+# кэшем и залогиненным пользователем, сколько бы постов на ней ни было.
+# Проверяется тестами (posts.budgets.check_budget)
+QUERY_BUDGETS = {
+    'index': 5,
+    'group': 6,
+    'profile': 7,
+    'post': 6,
+    'follow_index': 6,
+    'search': 6,
+    'api_posts': 2,
+    'api_group_posts': 3,
+    'api_profile_posts': 3,
+    'api_post': 3,
+    'post_comments': 4,
+}
+
+# Строгий режим: запрос к базе при разрешении переменной шаблона
+# ({{ post.author.username }} без select_related) — ошибка LazyQueryError
+QUERY_STRICT = DEBUG
+
+# Метрики ответов по имени URL (yatube/metrics.py): процесс копит их
+# в памяти и раз в METRICS_FLUSH_INTERVAL секунд пишет в свой слот
+# кэша 'metrics'; слотов не больше METRICS_MAX_SLOTS (процессов
+# одновременно), слоты завершившихся процессов достаются новым.
+# Измеряется каждый METRICS_SAMPLE_RATE-й ответ (с весом
+# METRICS_SAMPLE_RATE), чтобы метрики стоили меньше процента времени
+# ответа; ответы с ошибками (код от 400) считаются все.
+# /metrics/ доступен сотрудникам или по заголовку
+# Authorization: Bearer <METRICS_TOKEN>
+METRICS_FLUSH_INTERVAL = 10
+METRICS_MAX_SLOTS = 64
+METRICS_SAMPLE_RATE = 20
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Журнал медленных запросов (posts/slow_queries.py): запросы дольше
+# SLOW_QUERY_MS миллисекунд пишутся в SLOW_QUERY_LOG вместе с планом
+# и местом вызова, один отпечаток — не чаще раза в SLOW_QUERY_INTERVAL
+# секунд. None — журнал выключен. Сводка: manage.py slow_queries
+SLOW_QUERY_MS = float(os.environ['SLOW_QUERY_MS']) \
+    if os.environ.get('SLOW_QUERY_MS') else None
+SLOW_QUERY_INTERVAL = 60
+SLOW_QUERY_LOG = os.path.join(BASE_DIR, 'slow_queries.log')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'slow_queries': {
+            'class': 'logging.FileHandler',
+            'filename': SLOW_QUERY_LOG,
+            'formatter': 'message',
+            # файл появляется только с первой записью
+            'delay': True,
+        },
+    },
+    'loggers': {
+        'posts.slow_queries': {
+            'handlers': ['slow_queries'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
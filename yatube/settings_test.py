@@ -0,0 +1,21 @@
+"""
+Настройки тестов (manage.py test и pytest). Общий кэш живёт дольше
+процессов и нужен работающему сайту, поэтому у тестов свои файлы
+кэшей во временном каталоге, удаляемом при выходе.
+"""
+import atexit
+import os
+import shutil
+import tempfile
+
+from .settings import *  # noqa: F401,F403
+from .settings import CACHES
+
+_cache_directory = tempfile.mkdtemp(prefix='yatube-test-cache-')
+atexit.register(shutil.rmtree, _cache_directory, ignore_errors=True)
+
+CACHES = {
+    alias: {**options,
+            'LOCATION': os.path.join(_cache_directory, f'{alias}.sqlite3')}
+    for alias, options in CACHES.items()
+}
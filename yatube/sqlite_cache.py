@@ -0,0 +1,231 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from yatube import metrics
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    value BLOB,
+    expires REAL,
+    accessed REAL NOT NULL,
+    size INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed);
+CREATE TABLE IF NOT EXISTS cache_totals (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    entries INTEGER NOT NULL,
+    bytes INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO cache_totals VALUES (1, 0, 0);
+CREATE TRIGGER IF NOT EXISTS cache_totals_insert AFTER INSERT ON cache
+BEGIN
+    UPDATE cache_totals SET entries = entries + 1,
+                            bytes = bytes + NEW.size;
+END;
+CREATE TRIGGER IF NOT EXISTS cache_totals_delete AFTER DELETE ON cache
+BEGIN
+    UPDATE cache_totals SET entries = entries - 1,
+                            bytes = bytes - OLD.size;
+END;
+CREATE TRIGGER IF NOT EXISTS cache_totals_update AFTER UPDATE OF size ON cache
+BEGIN
+    UPDATE cache_totals SET bytes = bytes - OLD.size + NEW.size;
+END;
+"""
+
+
+class SQLiteCache(BaseCache):
+    """
+    Кэш в файле SQLite, общий для всех процессов на машине.
+
+    Размер ограничен числом записей (MAX_ENTRIES) и объёмом (MAX_BYTES);
+    при переполнении вытесняются давно не читавшиеся записи (LRU).
+    Целые числа хранятся как INTEGER, поэтому incr/decr атомарны
+    и выполняются одним UPDATE.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = location
+        options = params.get('OPTIONS', {})
+        self._max_bytes = int(options.get('MAX_BYTES', 64 * 1024 * 1024))
+        # время доступа обновляем не чаще, чем раз в ACCESS_RESOLUTION секунд
+        self._access_resolution = float(options.get('ACCESS_RESOLUTION', 1))
+        self._local = threading.local()
+
+    @property
+    def _db(self):
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            # соединение нельзя наследовать от родителя через fork()
+            directory = os.path.dirname(self._path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self._path, timeout=30,
+                                 isolation_level=None,
+                                 check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.executescript(SCHEMA)
+            local.db = db
+            local.pid = os.getpid()
+        return local.db
+
+    def _encode(self, value):
+        if type(value) is int and -2 ** 63 <= value < 2 ** 63:
+            return value, 8
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        return data, len(data)
+
+    @staticmethod
+    def _decode(value):
+        return value if isinstance(value, int) else pickle.loads(value)
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def get(self, key, default=None, version=None):
+        return self.get_many([key], version=version).get(key, default)
+
+    def get_many(self, keys, version=None):
+        if not keys:
+            return {}
+        made = {self._key(key, version): key for key in keys}
+        now = time.time()
+        marks = ','.join('?' * len(made))
+        rows = self._db.execute(
+            f'SELECT key, value, accessed FROM cache WHERE key IN ({marks}) '
+            f'AND (expires IS NULL OR expires > ?)',
+            [*made, now],
+        ).fetchall()
+        stale = [key for key, _, accessed in rows
+                 if accessed < now - self._access_resolution]
+        if stale:
+            marks = ','.join('?' * len(stale))
+            self._db.execute(
+                f'UPDATE cache SET accessed = ? WHERE key IN ({marks})',
+                [now, *stale],
+            )
+        metrics.record_cache(len(rows), len(made) - len(rows))
+        return {made[key]: self._decode(value) for key, value, _ in rows}
+
+    def _write(self, db, key, value, timeout, replace=True):
+        data, size = self._encode(value)
+        # upsert, а не INSERT OR REPLACE: замена строки не вызывает
+        # триггер удаления, и счётчики cache_totals разошлись бы
+        conflict = ('DO UPDATE SET value = excluded.value, '
+                    'expires = excluded.expires, '
+                    'accessed = excluded.accessed, size = excluded.size'
+                    if replace else 'DO NOTHING')
+        cursor = db.execute(
+            'INSERT INTO cache (key, value, expires, accessed, size) '
+            f'VALUES (?, ?, ?, ?, ?) ON CONFLICT (key) {conflict}',
+            (key, data, self.get_backend_timeout(timeout), time.time(),
+             size),
+        )
+        return cursor.rowcount > 0
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout=timeout, version=version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        db = self._db
+        with db:
+            db.execute('BEGIN IMMEDIATE')
+            for key, value in data.items():
+                self._write(db, self._key(key, version), value, timeout)
+        self._cull()
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        db = self._db
+        with db:
+            db.execute('BEGIN IMMEDIATE')
+            db.execute('DELETE FROM cache WHERE key = ? AND expires <= ?',
+                       (key, time.time()))
+            added = self._write(db, key, value, timeout, replace=False)
+        if added:
+            self._cull()
+        return added
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        db = self._db
+        with db:
+            db.execute('BEGIN IMMEDIATE')
+            cursor = db.execute(
+                "UPDATE cache SET value = value + ? WHERE key = ? "
+                "AND typeof(value) = 'integer' "
+                "AND (expires IS NULL OR expires > ?)",
+                (delta, key, time.time()),
+            )
+            if not cursor.rowcount:
+                raise ValueError("Key '%s' not found" % key)
+            return db.execute('SELECT value FROM cache WHERE key = ?',
+                              (key,)).fetchone()[0]
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        cursor = self._db.execute(
+            'UPDATE cache SET expires = ? WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (self.get_backend_timeout(timeout), key, time.time()),
+        )
+        return cursor.rowcount > 0
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+        return self._db.execute(
+            'SELECT 1 FROM cache WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (key, time.time()),
+        ).fetchone() is not None
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version=version)
+
+    def delete_many(self, keys, version=None):
+        keys = [self._key(key, version) for key in keys]
+        if keys:
+            marks = ','.join('?' * len(keys))
+            self._db.execute(f'DELETE FROM cache WHERE key IN ({marks})',
+                             keys)
+
+    def clear(self):
+        self._db.execute('DELETE FROM cache')
+
+    def totals(self):
+        entries, size = self._db.execute(
+            'SELECT entries, bytes FROM cache_totals').fetchone()
+        return {'entries': entries, 'bytes': size}
+
+    def _cull(self):
+        totals = self.totals()
+        if (totals['entries'] <= self._max_entries
+                and totals['bytes'] <= self._max_bytes):
+            return
+        db = self._db
+        with db:
+            db.execute('BEGIN IMMEDIATE')
+            db.execute('DELETE FROM cache WHERE expires <= ?', (time.time(),))
+            entries, size = db.execute(
+                'SELECT entries, bytes FROM cache_totals').fetchone()
+            if self._cull_frequency == 0:
+                db.execute('DELETE FROM cache')
+            elif entries > self._max_entries or size > self._max_bytes:
+                count = max(1, entries // self._cull_frequency)
+                if size > self._max_bytes:
+                    count = max(count, entries - entries * self._max_bytes
+                                // max(size, 1))
+                db.execute(
+                    'DELETE FROM cache WHERE key IN (SELECT key FROM cache '
+                    'ORDER BY accessed LIMIT ?)', (count,))
@@ -0,0 +1,100 @@
+import threading
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.kvstores import cached_db_kvstore
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+EMPTY_VALUE = cached_db_kvstore.EMPTY_VALUE
+
+
+class KVStore(cached_db_kvstore.KVStore):
+    """
+    KV-хранилище sorl-thumbnail с LRU в памяти процесса.
+
+    Перед общим уровнем (кэш, за ним таблица thumbnail_kvstore) держит
+    THUMBNAIL_KVSTORE_LRU_SIZE последних записей. Отсутствие записи
+    в памяти не запоминается: миниатюру мог уже создать другой процесс.
+    `prefetch` загружает записи целой страницы одним get_many и одним
+    запросом к базе.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = Counter()
+
+    def _remember(self, values):
+        with self._lock:
+            for key, value in values.items():
+                self._lru[key] = value
+                self._lru.move_to_end(key)
+            while len(self._lru) > settings.THUMBNAIL_KVSTORE_LRU_SIZE:
+                self._lru.popitem(last=False)
+
+    def _recall(self, key):
+        with self._lock:
+            value = self._lru.get(key)
+            if value is not None:
+                self._lru.move_to_end(key)
+                self._stats['memory'] += 1
+            return value
+
+    def _load(self, keys):
+        found = self.cache.get_many(keys)
+        self._stats['cache'] += sum(value is not EMPTY_VALUE
+                                    for value in found.values())
+        missing = [key for key in keys if key not in found]
+        if missing:
+            rows = dict(KVStoreModel.objects.filter(key__in=missing)
+                        .values_list('key', 'value'))
+            self._stats['db'] += len(rows)
+            # отсутствие записи кэшируем, как и cached_db_kvstore
+            self.cache.set_many(
+                {key: rows.get(key, EMPTY_VALUE) for key in missing},
+                sorl_settings.THUMBNAIL_CACHE_TIMEOUT,
+            )
+            found.update(rows)
+        values = {key: value for key, value in found.items()
+                  if value is not EMPTY_VALUE}
+        self._stats['miss'] += len(keys) - len(values)
+        self._remember(values)
+        return values
+
+    def prefetch(self, image_files):
+        keys = [add_prefix(image_file.key) for image_file in image_files]
+        with self._lock:
+            keys = [key for key in dict.fromkeys(keys)
+                    if key not in self._lru]
+        if keys:
+            self._load(keys)
+
+    def take_stats(self):
+        """Счётчики с прошлого вызова: memory, cache, db, miss."""
+        with self._lock:
+            stats, self._stats = self._stats, Counter()
+        return stats
+
+    def _get_raw(self, key):
+        value = self._recall(key)
+        if value is None:
+            value = self._load([key]).get(key)
+        return value
+
+    def _set_raw(self, key, value):
+        super()._set_raw(key, value)
+        self._remember({key: value})
+
+    def _delete_raw(self, *keys):
+        super()._delete_raw(*keys)
+        with self._lock:
+            for key in keys:
+                self._lru.pop(key, None)
+
+    def clear(self, delete_thumbnails=False):
+        super().clear(delete_thumbnails)
+        with self._lock:
+            self._lru.clear()
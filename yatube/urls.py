@@ -5,12 +5,15 @@ from django.contrib import admin
 from django.contrib.flatpages import views as flat_v
 from django.urls import include, path
 
+from yatube.metrics import metrics_view
+
 handler404 = "posts.views.page_not_found"  # noqa
 handler500 = "posts.views.server_error"  # noqa
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics/', metrics_view, name='metrics'),
     path('about/', include('django.contrib.flatpages.urls')),
     path('auth/', include('users.urls')),
     path('auth/', include('django.contrib.auth.urls')),